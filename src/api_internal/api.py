@@ -5,11 +5,21 @@ This module provides API routes for game servers to report their status
 and update subscription information in the database.
 """
 
+import asyncio
 import json
 import logging
+import os
+import uuid
 from typing import Callable, Dict, Any, Optional, Tuple, List
-from quart import Blueprint, request, Response
+from quart import Blueprint, request, Response, jsonify
+import helper_classes.custom_dataclass as cdata
 from db import db
+from db.command_tracker import FAILED, FINAL_STATES, REPORTED_STATES, SUCCEEDED
+from db.metrics_store import get_metrics_store
+from db.server_events import publish_server_event
+from api_internal.report_buffer import get_report_buffer
+from game_jobs.pending_queue import PendingQueue
+from game_jobs.placement_engine import get_placement_engine
 
 # Create module-level logger
 logger = logging.getLogger("backendlogger")
@@ -17,6 +27,17 @@ logger = logging.getLogger("backendlogger")
 # Blueprint definition
 apiblueprint = Blueprint("api", __name__)
 
+# Bounds for /api/server_reports
+REPORT_BATCH_MAX_ITEMS = int(os.getenv("REPORT_BATCH_MAX_ITEMS", 1000))
+REPORT_BATCH_CONCURRENCY = int(os.getenv("REPORT_BATCH_CONCURRENCY", 16))
+
+# Reported server statuses meaning the container no longer holds its host's capacity
+CAPACITY_FREEING_STATUSES = {
+    db.SERVER_STATUS.FAILED.value,
+    db.SERVER_STATUS.NOT_FOUND.value,
+}
+SERVER_STATUSES = {status.value for status in db.SERVER_STATUS}
+
 
 class RegisterHandler:
     registry: Dict[str, Callable] = {}
@@ -37,7 +58,40 @@ class RegisterHandler:
                 False,
                 f"Unknown action available actions are <{self.registry.keys()}>",
             )
-        return await self.registry[action](data)
+        result = await self.registry[action](data)
+        if not result[0]:
+            return result
+        if isinstance(data.get("metrics"), dict) and data.get("subscription_id"):
+            await self._record_metrics(data["subscription_id"], data["metrics"])
+        if data.get("status") in CAPACITY_FREEING_STATUSES and data.get(
+            "subscription_id"
+        ):
+            # The flusher releases the server's reservation and wakes the
+            # pending-order drain
+            self._buffer_report(
+                cdata.ServerReport(
+                    subscription_id=data["subscription_id"], releases_capacity=True
+                )
+            )
+        return result
+
+    @staticmethod
+    async def _record_metrics(subscription_id: str, metrics: Dict) -> None:
+        """Store a metrics sample in Redis; a failure never fails the report."""
+        try:
+            await get_metrics_store().record(subscription_id, metrics)
+        except Exception as e:
+            logger.error(f"Unable to record metrics for {subscription_id}: {e}")
+
+    @staticmethod
+    def _buffer_report(report: cdata.ServerReport) -> Tuple[bool, Optional[Dict]]:
+        """Queue a report's database changes for the next batched write."""
+        if not get_report_buffer().add(report):
+            logger.warning(
+                f"Report buffer full, dropping report for {report.subscription_id}"
+            )
+            return False, {"status": "error", "message": "Report buffer full"}
+        return True, None
 
     @staticmethod
     def map_server_status_to_subscription(server_status: str) -> str:
@@ -75,6 +129,27 @@ class RegisterHandler:
                 return False, field
         return True, None
 
+    @staticmethod
+    def _check_values(data: Dict) -> Optional[str]:
+        """Why a report's values would fail its database write, if they would."""
+        try:
+            uuid.UUID(str(data["subscription_id"]))
+        except ValueError:
+            return f"Invalid subscription_id: {data['subscription_id']!r}"
+        if data["status"] not in SERVER_STATUSES:
+            return f"Invalid status {data['status']!r}, expected one of {sorted(SERVER_STATUSES)}"
+        if "container_id" in data and not isinstance(data["container_id"], str):
+            return "container_id must be a string"
+        if data.get("ports") and not isinstance(data["ports"], (dict, list)):
+            return "ports must be an object or an array"
+        return None
+
+    @staticmethod
+    def _bad_report(message: str) -> Tuple[bool, Dict]:
+        """Reject a report that could never be written; answered with a 400."""
+        logger.warning(f"Rejected server report: {message}")
+        return False, {"status": "error", "message": message, "code": 400}
+
     async def _start_handler(self, data: Dict) -> Tuple[bool, Optional[Dict]]:
         # Validate required fields
 
@@ -87,74 +162,24 @@ class RegisterHandler:
                 "message": f"Missing required field: {missing_field}",
             }
 
-        # Update server status in the database
-        try:
-            server, err = await db.db_select_server_by_subscription_id(
-                data["subscription_id"]
-            )
-            ports = {}
-            if "ports" in data.keys():
-                ports = data["ports"]
-            if ports == {}:  # restart
-                if server:
-                    ports = server.get("ports", "{}")
-                    ports = json.loads(ports)
-            server, err = await db.db_update_server_status(
-                status=data["status"],
-                docker_container_id=data["container_id"],
-                subscription_id=data["subscription_id"],
-                ports=json.dumps(ports),
-            )
-            if err or not server:
-                return False, {"status": "error", "message": err}
-
-            if "metrics" in data.keys():
-                pwd = data["metrics"].get("password")
-                username = data["metrics"].get("username")
-                _, err = await db.db_update_server_sftp(
-                    sftp_username=username,
-                    sftp_password=pwd,
-                    server_id=str(server.get("id", "")),
-                )
-                if err:
-                    return False, {"status": "error", "message": err}
-
-            logger.info(
-                f"Server status updated for subscription: {data['subscription_id']}"
-            )
-        except Exception as e:
-            logger.exception(f"Failed to update server status: {str(e)}")
-            return False, {
-                "status": "error",
-                "message": "Database error updating server",
-            }
+        invalid = self._check_values(data)
+        if invalid:
+            return self._bad_report(invalid)
 
-        # Update subscription billing dates
-        subscription, err = await db.db_select_subscription_by_id(
-            data["subscription_id"]
-        )
-        if not subscription:
-            logger.exception(
-                f"Unable to select subscription {data['subscription_id']}:", err
-            )
-            return False, {
-                "status": "error",
-                "message": "Database error slecting subscription",
-            }
-        try:
-            await db.db_update_subscription_internal_status(
+        ports = data.get("ports") or None
+        sftp = None
+        if "metrics" in data.keys():
+            sftp = (data["metrics"].get("username"), data["metrics"].get("password"))
+        return self._buffer_report(
+            cdata.ServerReport(
                 subscription_id=data["subscription_id"],
+                status=data["status"],
+                docker_container_id=data["container_id"],
+                ports=json.dumps(ports) if ports else None,
+                sftp=sftp,
                 internal_status=self.map_server_status_to_subscription(data["status"]),
             )
-            logger.info(f"Subscription updated for ID: {data['subscription_id']}")
-        except Exception as e:
-            logger.exception(f"Failed to update subscription: {str(e)}")
-            return False, {
-                "status": "error",
-                "message": "Database error updating subscription",
-            }
-
-        return True, None
+        )
 
     async def _stop_handler(self, data: Dict) -> Tuple[bool, Optional[Dict]]:
         required_fields = ["subscription_id", "status"]
@@ -165,31 +190,15 @@ class RegisterHandler:
                 "status": "error",
                 "message": f"Missing required field: {missing_field}",
             }
+        invalid = self._check_values(data)
+        if invalid:
+            return self._bad_report(invalid)
 
-        server, err = await db.db_select_server_by_subscription_id(
-            data["subscription_id"]
-        )
-        if err or not server:
-            logger.warning(
-                f"Error when selecting server by subscription_id {data['subscription_id']} :{err}"
+        return self._buffer_report(
+            cdata.ServerReport(
+                subscription_id=data["subscription_id"], status=data["status"]
             )
-            return False, {
-                "status": "error",
-                "message": f"Error when selecting server by subscription_id {data['subscription_id']}",
-            }
-        server, err = await db.db_update_server_status(
-            status=data["status"],
-            docker_container_id=server.get("docker_container_id", ""),
-            subscription_id=data["subscription_id"],
-            ports=server.get("ports", "{}"),
         )
-        if err or not server:
-            logger.warning(
-                f"Error when selecting updating server status in _stop_handler by subscription_id {data['subscription_id']} :{err}"
-            )
-            return False, {"status": "error", "message": "Error when stopping server"}
-        logger.info(f"Server stoped for subscription: {data['subscription_id']}")
-        return True, None
 
     async def _status_handler(self, data: Dict) -> Tuple[bool, Optional[Dict]]:
         required_fields = ["subscription_id", "status", "container_id", "metrics"]
@@ -239,6 +248,40 @@ class RegisterHandler:
         return True, None
 
 
+async def process_report(rh: RegisterHandler, data: Any) -> Tuple[Dict[str, Any], int]:
+    """Validate and dispatch one report, returning the response body and status."""
+    if not data or not isinstance(data, dict):
+        logger.warning("Empty server report received")
+        return {"status": "error", "message": "No data provided"}, 400
+
+    # Reports answering a command settle it, whatever else they carry
+    error: Optional[str] = data.get("error")
+    if isinstance(data.get("command_id"), str):
+        await settle_command(
+            data["command_id"], FAILED if error else SUCCEEDED, str(error or "")
+        )
+
+    # Check for error reports
+    if error:
+        logger.error(f"Server error reported: {error}")
+        return {"status": "received", "error_logged": True}, 200
+    action = data.get("action")
+    if not action:
+        logger.error("No action in report")
+        return {"status": "received", "error_logged": True}, 200
+
+    if get_report_buffer().is_full():
+        return {"status": "error", "message": "Busy, retry later"}, 503
+
+    success, err = await rh.handle_report(action=action, data=data)
+    if not success:
+        if isinstance(err, dict) and "code" in err:
+            body = dict(err)
+            return body, body.pop("code")
+        return {"status": "received", "error_logged": True}, 200
+    return {"status": "success", "action": action}, 200
+
+
 @apiblueprint.route("/api/server_report", methods=["POST"])
 async def register_server() -> Response:
     """
@@ -255,33 +298,159 @@ async def register_server() -> Response:
         # Get request data
         data: Dict[str, Any] = await request.get_json()
 
-        # Validate request data
-        if not data:
-            logger.warning("Empty server report received")
-            return Response(
-                response={"status": "error", "message": "No data provided"}, status=400
-            )
-
         # Log the received data
         logger.info(f"Server report received: {data}")
 
-        # Check for error reports
-        error: Optional[str] = data.get("error")
-        if error:
-            logger.error(f"Server error reported: {error}")
-            return Response({"status": "received", "error_logged": True}, 200)
-        action = data.get("action")
-        if not action:
-            logger.error("No action in report")
-            return Response({"status": "received", "error_logged": True}, 200)
-
-        rh = RegisterHandler()
-        success, err = await rh.handle_report(action=action, data=data)
-        if not success:
-            return Response({"status": "received", "error_logged": True}, 200)
+        body, status = await process_report(RegisterHandler(), data)
+        if status == 503:
+            return Response(body, status, headers={"Retry-After": "1"})
+        return Response(body, status)
 
     except Exception as e:
         logger.exception(f"Unexpected error in server_report: {str(e)}")
         return Response({"status": "error", "message": "Internal server error"}, 500)
 
-    return Response({"status": "success", "action": action})
+
+async def settle_command(
+    command_id: str, state: str, detail: str = ""
+) -> Tuple[Dict[str, Any], int]:
+    """Record an agent-reported command state and tell the server's watchers.
+
+    A failed start, restart or stop also marks the server failed and
+    releases its capacity.
+    """
+    redis_client = await db.get_redis_client()
+    previous = await db.COMMAND_TRACKER.mark(redis_client, command_id, state, detail)
+    if previous is None:
+        return {"status": "error", "message": "Unknown command"}, 404
+    if previous in FINAL_STATES:
+        return {"status": "ignored", "state": previous}, 200
+    if state not in FINAL_STATES:
+        return {"status": "success", "state": state}, 200
+
+    command = await db.COMMAND_TRACKER.get(redis_client, command_id) or {}
+    subscription_id = command.get("subscription_id", "")
+    servers = []
+    if state == FAILED:
+        logger.warning(f"Command {command_id} failed: {detail}")
+        failed, err = await db.db_fail_command_servers([command])
+        if err:
+            logger.error(f"Unable to mark server of command {command_id}: {err}")
+        servers = failed.servers
+        for record in failed.released:
+            get_placement_engine().observe(record)
+        if failed.released:
+            await PendingQueue().notify("capacity_freed")
+    pipe = redis_client.pipeline(transaction=False)
+    publish_server_event(
+        pipe,
+        subscription_id,
+        "command",
+        id=command_id,
+        command=command.get("type"),
+        state=state,
+    )
+    if servers:
+        publish_server_event(
+            pipe, subscription_id, "status", status=db.SERVER_STATUS.FAILED.value
+        )
+    await pipe.execute()
+    return {"status": "success", "state": state}, 200
+
+
+@apiblueprint.route("/api/command_state", methods=["POST"])
+async def command_state() -> Response:
+    """
+    Record the state of a command popped from a baremetal queue.
+
+    Agents report `running` when they start a command, then `succeeded` or
+    `failed` with an optional `detail`. Commands not reported running
+    before their deadline are pushed again; see `CommandTracker`.
+
+    Returns:
+        JSON response with the recorded state
+    """
+    try:
+        data = await request.get_json()
+        if not isinstance(data, dict) or not isinstance(data.get("command_id"), str):
+            return jsonify({"status": "error", "message": "command_id required"}), 400
+        state = data.get("state")
+        if state not in REPORTED_STATES:
+            return jsonify(
+                {
+                    "status": "error",
+                    "message": f"state must be one of {sorted(REPORTED_STATES)}",
+                }
+            ), 400
+        body, status = await settle_command(
+            data["command_id"], state, str(data.get("detail") or "")
+        )
+        return jsonify(body), status
+    except Exception as e:
+        logger.exception(f"Unexpected error in command_state: {str(e)}")
+        return jsonify({"status": "error", "message": "Internal server error"}), 500
+
+
+def parse_report_batch(raw: str, content_type: str) -> List[Any]:
+    """Reports from a JSON array body, or one JSON object per line for NDJSON."""
+    if "ndjson" in content_type or not raw.lstrip().startswith("["):
+        return [json.loads(line) for line in raw.splitlines() if line.strip()]
+    reports = json.loads(raw)
+    if not isinstance(reports, list):
+        raise ValueError("Expected a JSON array of reports")
+    return reports
+
+
+@apiblueprint.route("/api/server_reports", methods=["POST"])
+async def register_server_batch() -> Response:
+    """
+    Process many server reports from one baremetal agent in one request.
+
+    The body is a JSON array of reports, or NDJSON with one report per line.
+    Every report is handled like a `/api/server_report` request, with at most
+    REPORT_BATCH_CONCURRENCY in flight. The response lists a result per
+    report, in request order.
+    """
+    try:
+        raw = await request.get_data(as_text=True)
+        try:
+            reports = parse_report_batch(raw, request.content_type or "")
+        except ValueError as e:
+            # json.JSONDecodeError is a ValueError too
+            return jsonify({"status": "error", "message": str(e)}), 400
+        if len(reports) > REPORT_BATCH_MAX_ITEMS:
+            return jsonify(
+                {
+                    "status": "error",
+                    "message": f"At most {REPORT_BATCH_MAX_ITEMS} reports per batch",
+                }
+            ), 413
+        if get_report_buffer().is_full():
+            return (
+                jsonify({"status": "error", "message": "Busy, retry later"}),
+                503,
+                {"Retry-After": "1"},
+            )
+
+        logger.info(f"Server report batch received with {len(reports)} reports")
+        rh = RegisterHandler()
+        semaphore = asyncio.Semaphore(REPORT_BATCH_CONCURRENCY)
+
+        async def process(data: Any) -> Dict[str, Any]:
+            async with semaphore:
+                try:
+                    body, status = await process_report(rh, data)
+                except Exception as e:
+                    logger.exception(f"Unexpected error in server_reports: {str(e)}")
+                    body, status = (
+                        {"status": "error", "message": "Internal server error"},
+                        500,
+                    )
+            return {**body, "code": status}
+
+        results = await asyncio.gather(*(process(data) for data in reports))
+        return jsonify({"status": "success", "results": results}), 200
+
+    except Exception as e:
+        logger.exception(f"Unexpected error in server_reports: {str(e)}")
+        return jsonify({"status": "error", "message": "Internal server error"}), 500
@@ -0,0 +1,229 @@
+"""
+In-process buffer for server reports.
+
+`/api/server_report` validates a report and adds it here instead of writing
+it straight away. A background flusher coalesces the buffered reports per
+subscription, the latest report winning, and writes them in one
+transaction every `flush_interval` seconds or as soon as `max_batch`
+subscriptions are waiting. Status changes are published to the
+subscriptions' watchers once written.
+
+If the database rejects a batch while it is reachable, the batch is split
+in halves until the reports it rejects are isolated, so one bad report
+never holds back the others. A report rejected `max_attempts` flushes in
+a row is dead-lettered to `reports:dead` instead of being retried.
+"""
+
+import asyncio
+import dataclasses
+import json
+import logging
+import os
+import time
+from typing import Dict, List, Optional, Tuple
+
+from asyncpg import Record
+
+import helper_classes.custom_dataclass as cdata
+from db import db
+from db.server_events import publish_server_event
+from game_jobs.pending_queue import PendingQueue
+from game_jobs.placement_engine import get_placement_engine
+
+DEAD_LETTER_KEY = "reports:dead"
+
+
+class ReportBuffer:
+    """Coalescing buffer between the report endpoint and the database.
+
+    If the database is unavailable, unwritten reports are kept and merged
+    with newer ones. `add` refuses reports once `max_pending` subscriptions
+    are waiting, so agents back off instead of growing the buffer unbounded.
+    Unwritten reports only count as failed while the database is reachable.
+    """
+
+    def __init__(
+        self,
+        flush_interval: float = float(os.getenv("REPORT_FLUSH_INTERVAL_MS", 250))
+        / 1000,
+        max_batch: int = int(os.getenv("REPORT_FLUSH_MAX_BATCH", 500)),
+        max_pending: int = int(os.getenv("REPORT_BUFFER_MAX_PENDING", 20000)),
+        max_attempts: int = int(os.getenv("REPORT_MAX_ATTEMPTS", 3)),
+        dead_letter_size: int = 1000,
+    ) -> None:
+        self.logger = logging.getLogger("backendlogger")
+        self.flush_interval = flush_interval
+        self.max_batch = max_batch
+        self.max_pending = max_pending
+        self.max_attempts = max_attempts
+        self.dead_letter_size = dead_letter_size
+        self._pending: Dict[str, cdata.ServerReport] = {}
+        # Flushes in a row that rejected each subscription's report
+        self._failures: Dict[str, int] = {}
+        self._batch_ready = asyncio.Event()
+        self._flush_lock = asyncio.Lock()
+
+    def __len__(self) -> int:
+        return len(self._pending)
+
+    def is_full(self) -> bool:
+        return len(self._pending) >= self.max_pending
+
+    def add(self, report: cdata.ServerReport) -> bool:
+        """Buffer a report, merging it with one already waiting for its subscription.
+
+        Returns False if the buffer is full.
+        """
+        older = self._pending.get(report.subscription_id)
+        if older is not None:
+            report = report.merged_into(older)
+        elif len(self._pending) >= self.max_pending:
+            return False
+        self._pending[report.subscription_id] = report
+        if len(self._pending) >= self.max_batch:
+            self._batch_ready.set()
+        return True
+
+    async def run(self) -> None:
+        """Flush forever, every `flush_interval` or when a full batch is waiting."""
+        while True:
+            try:
+                await asyncio.wait_for(
+                    self._batch_ready.wait(), timeout=self.flush_interval
+                )
+            except asyncio.TimeoutError:
+                pass
+            try:
+                await self.flush()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.logger.error(f"Server report flush failed: {e}")
+
+    async def flush(self) -> int:
+        """Write everything buffered so far and return the number of subscriptions."""
+        async with self._flush_lock:
+            self._batch_ready.clear()
+            if not self._pending:
+                return 0
+            batch, self._pending = self._pending, {}
+            reports = list(batch.values())
+            released, err = await db.db_apply_server_reports(reports)
+            if err:
+                reachable, _ = await db.db_ping()
+                if not reachable:
+                    self._requeue(batch)
+                    self.logger.error(
+                        f"Unable to write {len(batch)} server reports: {err}"
+                    )
+                    return 0
+                reports, released, rejected = await self._write_split(reports)
+                await self._reject(rejected, err)
+                batch = {report.subscription_id: report for report in reports}
+
+            for subscription_id in batch:
+                self._failures.pop(subscription_id, None)
+            for record in released:
+                get_placement_engine().observe(record)
+            if released:
+                await PendingQueue().notify("capacity_freed")
+            await self._publish(batch)
+            self.logger.debug(f"Wrote {len(batch)} server reports")
+            return len(batch)
+
+    async def _write_split(
+        self, reports: List[cdata.ServerReport]
+    ) -> Tuple[List[cdata.ServerReport], List[Record], List[cdata.ServerReport]]:
+        """Write a batch the database rejected, in halves, down to single reports.
+
+        Returns the reports written, the baremetals released and the reports
+        rejected on their own.
+        """
+        if len(reports) == 1:
+            return [], [], reports
+        middle = len(reports) // 2
+        written: List[cdata.ServerReport] = []
+        released: List[Record] = []
+        rejected: List[cdata.ServerReport] = []
+        for half in (reports[:middle], reports[middle:]):
+            half_released, err = await db.db_apply_server_reports(half)
+            if err:
+                half, half_released, half_rejected = await self._write_split(half)
+                rejected += half_rejected
+            written += half
+            released += half_released
+        return written, released, rejected
+
+    async def _reject(self, rejected: List[cdata.ServerReport], err: str) -> None:
+        """Retry rejected reports at the next flush, or dead-letter them."""
+        dead = []
+        for report in rejected:
+            failures = self._failures.get(report.subscription_id, 0) + 1
+            if failures < self.max_attempts:
+                self._failures[report.subscription_id] = failures
+                self._requeue({report.subscription_id: report})
+            else:
+                self._failures.pop(report.subscription_id, None)
+                dead.append(report)
+        if rejected:
+            self.logger.error(
+                f"Database rejected {len(rejected)} server reports, dead-lettered"
+                f" {len(dead)}: {err}"
+            )
+        if not dead:
+            return
+        try:
+            pipe = (await db.get_redis_client()).pipeline(transaction=False)
+            pipe.lpush(
+                DEAD_LETTER_KEY,
+                *(
+                    json.dumps({**dataclasses.asdict(report), "failed_at": time.time()})
+                    for report in dead
+                ),
+            )
+            pipe.ltrim(DEAD_LETTER_KEY, 0, self.dead_letter_size - 1)
+            await pipe.execute()
+        except Exception as e:
+            self.logger.warning(f"Unable to dead-letter {len(dead)} reports: {e}")
+
+    async def _publish(self, batch: Dict[str, cdata.ServerReport]) -> None:
+        """Tell the subscriptions' watchers about the status changes just written."""
+        changed = [
+            report
+            for report in batch.values()
+            if report.status is not None or report.internal_status is not None
+        ]
+        if not changed:
+            return
+        try:
+            pipe = (await db.get_redis_client()).pipeline(transaction=False)
+            for report in changed:
+                publish_server_event(
+                    pipe,
+                    report.subscription_id,
+                    "status",
+                    status=report.status,
+                    internal_status=report.internal_status,
+                )
+            await pipe.execute()
+        except Exception as e:
+            self.logger.warning(f"Unable to publish {len(changed)} server events: {e}")
+
+    def _requeue(self, batch: Dict[str, cdata.ServerReport]) -> None:
+        """Put back a batch that was not written, under any newer reports."""
+        for subscription_id, report in batch.items():
+            newer = self._pending.get(subscription_id)
+            self._pending[subscription_id] = (
+                report if newer is None else newer.merged_into(report)
+            )
+
+
+_buffer: Optional[ReportBuffer] = None
+
+
+def get_report_buffer() -> ReportBuffer:
+    """Process-wide report buffer shared by the endpoint and the flusher."""
+    global _buffer
+    if _buffer is None:
+        _buffer = ReportBuffer()
+    return _buffer
@@ -1,7 +1,7 @@
 import logging
 import asyncpg
 import datetime
-from typing import Dict, Any
+from typing import Dict, Any, List, Optional, Tuple
 
 
 async def extract_single_sub_record(record: asyncpg.Record) -> Dict[str, Any]:
@@ -36,3 +36,37 @@ async def extract_single_sub_record(record: asyncpg.Record) -> Dict[str, Any]:
     except Exception as e:
         logger.exception(f"Error extracting subscription data: {str(e)}")
         return {}
+
+
+def memory_percent(sample: Dict[str, float], ram_gb: Optional[int]) -> Optional[float]:
+    """
+    Memory usage of a metrics sample in percent.
+
+    Uses the reported percentage, or else derives it from the reported
+    megabytes and the plan's RAM. Returns None when neither is available.
+    """
+    if sample.get("memory_usage_percent") is not None:
+        return round(sample["memory_usage_percent"], 1)
+    if sample.get("memory_usage_mb") is None or not ram_gb:
+        return None
+    return round(min(100.0, sample["memory_usage_mb"] / (ram_gb * 1024) * 100), 1)
+
+
+def sparkline_points(
+    history: List[Tuple[int, Optional[float]]], width: int = 300, height: int = 40
+) -> str:
+    """
+    SVG polyline points of a percentage series, oldest point on the left.
+
+    Returns an empty string when there are fewer than two points.
+    """
+    points = [(timestamp, value) for timestamp, value in history if value is not None]
+    if len(points) < 2:
+        return ""
+    start, end = points[0][0], points[-1][0]
+    span = max(end - start, 1)
+    return " ".join(
+        f"{(timestamp - start) / span * width:.1f},"
+        f"{height - min(max(value, 0.0), 100.0) / 100 * height:.1f}"
+        for timestamp, value in points
+    )
@@ -1,157 +1,163 @@
 import logging
 from quart import Blueprint, request, jsonify
-from quart_auth import login_required
+from quart_auth import current_user, login_required
 from db import db
+from db.agent_commands import Command
+from db.command_tracker import DUPLICATE, QUEUE_FULL, RATE_LIMITED
+from db.server_events import publish_server_event
 from game_jobs.mainProvisioner import MainProvisioner
+from game_jobs.placement_engine import get_placement_engine
 import json
 
 serverActionsBlueprint = Blueprint("serverActionsBlueprint", __name__)
 
+# Actions that run the server, so it must hold capacity on its host
+CAPACITY_ACTIONS = {"start", "restart"}
+
 
 def create_error_response(message, status_code=400):
     """Helper function to create standardized error responses."""
     return jsonify({"error": message}), status_code
 
 
-@serverActionsBlueprint.route("/restart_server", methods=["POST"])
-@login_required
-async def restart_server():
-    redis_Client = await db.get_redis_client()
+async def queue_server_action(action: str, status: str, reply: str):
+    """Push `action` to the server's baremetal queue and set its status.
+
+    The push is refused with 429 when the subscription is sending commands
+    too fast and 503 when the host's queue is full. An action already
+    queued for the server is not queued again. The id of the command to
+    follow is returned in the X-Command-Id header.
+
+    A server whose capacity was released after it failed reserves it again
+    on its host before a start or restart is pushed; the action is refused
+    with 409 if the server has no host and 503 if the host has no room.
+    """
     logger = logging.getLogger("backendlogger")
     subscription_id = request.args.get("subscription_id", "")
     if not subscription_id:
         return create_error_response("Missing subscription_id", 400)
 
     try:
-        server, err = await db.db_select_server_by_subscription_id(subscription_id)
-        if not server:
+        context, err = await db.db_select_server_context(
+            subscription_id=subscription_id
+        )
+        if not context:
             logger.error(
                 f"Server not found for subscription_id {subscription_id}: {err}"
             )
             return create_error_response("Server not found", 404)
 
-        subscription, err = await db.db_select_subscription_by_id(subscription_id)
-        if not subscription:
-            logger.error(
-                f"Subscription not found for subscription_id {subscription_id}: {err}"
-            )
-            return create_error_response("Subscription not found", 404)
-
-        plan, err = await db.db_select_plan_by_id(str(subscription.get("plan_id", "")))
-        if not plan:
-            logger.error(f"Plan not found for subscription_id {subscription_id}: {err}")
-            return create_error_response("Plan not found", 404)
-
-        game, err = await db.db_select_game_by_id(str(plan.get("parent_id", "")))
-        if not game:
-            logger.error(f"Game not found for subscription_id {subscription_id}: {err}")
-            return create_error_response("Game not found", 404)
-
-        game_name = game.get("name", "")
-        await db.db_update_server_status(
-            status=db.SERVER_STATUS.RESTARTING.value,
-            docker_container_id=server.get("docker_container_id", ""),
-            subscription_id=subscription_id,
-            ports=server.get("ports", ""),
+        reserved = None
+        if action in CAPACITY_ACTIONS and context.baremetal_id is None:
+            if not context.ip_address:
+                return create_error_response("Server has no host", 409)
+            reserved, err = await db.db_attach_server_capacity(subscription_id)
+            if err:
+                logger.error(f"Unable to reserve capacity for {subscription_id}: {err}")
+                return create_error_response("Internal server error", 500)
+            if reserved is None:
+                return (
+                    jsonify({"error": "Server host is full, please try again later"}),
+                    503,
+                    {"Retry-After": "60"},
+                )
+            get_placement_engine().observe(reserved)
+
+        redis_Client = await db.get_redis_client()
+        command = Command.new(action, subscription_id, game=context.game_name)
+        outcome, command_id = await db.COMMAND_TRACKER.submit(
+            redis_Client, context.ip_address, command
         )
-        ip = server.get("ip_address", "")
-        queueName = f"badger:pending:{ip}"
-        payload = f"python3 setup_server.py -u {subscription_id} -g {game_name} restart"
-        await redis_Client.lpush(queueName, payload)
-        return "restarting", 200
+        if reserved is not None and outcome in (RATE_LIMITED, QUEUE_FULL):
+            released, err = await db.db_release_server_capacity(subscription_id)
+            if err:
+                logger.error(f"Unable to release capacity of {subscription_id}: {err}")
+            elif released is not None:
+                get_placement_engine().observe(released)
+        if outcome == RATE_LIMITED:
+            return (
+                jsonify({"error": "Too many actions, please try again shortly"}),
+                429,
+                {"Retry-After": str(db.COMMAND_TRACKER.rate_window_ms // 1000)},
+            )
+        if outcome == QUEUE_FULL:
+            return (
+                jsonify({"error": "Server host is busy, please try again shortly"}),
+                503,
+                {"Retry-After": "5"},
+            )
+        if outcome != DUPLICATE:
+            _, err = await db.db_update_server_status_with_context(
+                subscription_id=subscription_id, status=status
+            )
+            if err:
+                logger.error(f"Unable to set status of {subscription_id}: {err}")
+            await publish_server_event(
+                redis_Client, subscription_id, "status", status=status
+            )
+        return reply, 200, {"X-Command-Id": command_id}
     except Exception as e:
         logger.exception(
-            f"Unexpected error when restarting server for subscription_id {subscription_id}: {e}"
+            f"Unexpected error on {action} for subscription_id {subscription_id}: {e}"
         )
         return create_error_response("Internal server error", 500)
 
 
-@serverActionsBlueprint.route("/stop_server", methods=["POST"])
+@serverActionsBlueprint.route("/restart_server", methods=["POST"])
 @login_required
-async def stop_server():
-    redis_Client = await db.get_redis_client()
-    subscription_id = request.args.get("subscription_id", "")
-    if not subscription_id:
-        return create_error_response("Missing subscription_id", 400)
-
-    try:
-        server, err = await db.db_select_server_by_subscription_id(subscription_id)
-        if not server:
-            return create_error_response("Server not found", 404)
-
-        subscription, err = await db.db_select_subscription_by_id(subscription_id)
-        if not subscription:
-            return create_error_response("Subscription not found", 404)
-
-        plan, err = await db.db_select_plan_by_id(str(subscription.get("plan_id", "")))
-        if not plan:
-            return create_error_response("Plan not found", 404)
+async def restart_server():
+    return await queue_server_action(
+        "restart", db.SERVER_STATUS.RESTARTING.value, "restarting"
+    )
 
-        game, err = await db.db_select_game_by_id(str(plan.get("parent_id", "")))
-        if not game:
-            return create_error_response("Game not found", 404)
 
-        game_name = game.get("name", "")
-        await db.db_update_server_status(
-            status=db.SERVER_STATUS.STOPPING.value,
-            docker_container_id=server.get("docker_container_id", ""),
-            subscription_id=subscription_id,
-            ports=server.get("ports", ""),
-        )
-        ip = server.get("ip_address", "")
-        queueName = f"badger:pending:{ip}"
-        payload = f"python3 setup_server.py -u {subscription_id} -g {game_name} stop"
-        await redis_Client.lpush(queueName, payload)
-        return "stopping", 200
-    except Exception as e:
-        logging.exception(
-            f"Unexpected error when stopping server for subscription_id {subscription_id}: {e}"
-        )
-        return create_error_response("Internal server error", 500)
+@serverActionsBlueprint.route("/stop_server", methods=["POST"])
+@login_required
+async def stop_server():
+    return await queue_server_action(
+        "stop", db.SERVER_STATUS.STOPPING.value, "stopping"
+    )
 
 
 @serverActionsBlueprint.route("/backup_server", methods=["POST"])
 @login_required
 async def backup_server():
-    redis_Client = await db.get_redis_client()
-    subscription_id = request.args.get("subscription_id", "")
-    if not subscription_id:
-        return create_error_response("Missing subscription_id", 400)
-
-    try:
-        server, err = await db.db_select_server_by_subscription_id(subscription_id)
-        if not server:
-            return create_error_response("Server not found", 404)
-
-        subscription, err = await db.db_select_subscription_by_id(subscription_id)
-        if not subscription:
-            return create_error_response("Subscription not found", 404)
-
-        plan, err = await db.db_select_plan_by_id(str(subscription.get("plan_id", "")))
-        if not plan:
-            return create_error_response("Plan not found", 404)
+    return await queue_server_action(
+        "backup", db.SERVER_STATUS.RUNNING.value, "backing up"
+    )
 
-        game, err = await db.db_select_game_by_id(str(plan.get("parent_id", "")))
-        if not game:
-            return create_error_response("Game not found", 404)
 
-        game_name = game.get("name", "")
-        await db.db_update_server_status(
-            status=db.SERVER_STATUS.RUNNING.value,
-            docker_container_id=server.get("docker_container_id", ""),
-            subscription_id=subscription_id,
-            ports=server.get("ports", ""),
-        )
-        ip = server.get("ip_address", "")
-        queueName = f"badger:pending:{ip}"
-        payload = f"python3 setup_server.py -u {subscription_id} -g {game_name} backup"
-        await redis_Client.lpush(queueName, payload)
-        return "backing up", 200
-    except Exception as e:
-        logging.exception(
-            f"Unexpected error when backing up server for subscription_id {subscription_id}: {e}"
-        )
-        return create_error_response("Internal server error", 500)
+@serverActionsBlueprint.route("/command_status", methods=["GET"])
+@login_required
+async def command_status():
+    """State of a command pushed for one of the current user's servers."""
+    command_id = request.args.get("command_id", "")
+    if not command_id:
+        return create_error_response("Missing command_id", 400)
+    redis_Client = await db.get_redis_client()
+    command = await db.COMMAND_TRACKER.get(redis_Client, command_id)
+    if not command:
+        return create_error_response("Command not found", 404)
+    subscription, _ = await db.db_select_subscription_by_id(
+        subscription_id=command.get("subscription_id", "")
+    )
+    if not subscription or str(subscription.get("user_id")) != current_user.auth_id:
+        return create_error_response("Command not found", 404)
+    return jsonify(
+        {
+            field: command.get(field)
+            for field in (
+                "id",
+                "type",
+                "subscription_id",
+                "state",
+                "attempts",
+                "detail",
+                "created_at",
+                "updated_at",
+            )
+        }
+    )
 
 
 @serverActionsBlueprint.route("/save-config", methods=["POST"])
@@ -163,38 +169,19 @@ async def save_config():
     error_html = "<p>Error updating the configuration</p>"
     success_html = "<p>Success</p>"
 
-    server, err = await db.db_select_server_by_subscription_id(
-        subscription_id=subscription_id
-    )
+    context, err = await db.db_select_server_context(subscription_id=subscription_id)
 
     def log_error(err):
         logger.error(
-            f"Error when updating configuration server:{server} of subscription_id:{subscription_id} err:{err} "
+            f"Error when updating configuration server:{context} of subscription_id:{subscription_id} err:{err} "
         )
 
-    if not server or not subscription_id:
-        log_error(err)
-        return error_html
-
-    subscription, err = await db.db_select_subscription_by_id(
-        subscription_id=subscription_id
-    )
-    if not subscription:
-        log_error(err)
-        return error_html
-
-    plan, err = await db.db_select_plan_by_id(str(subscription.get("plan_id", "")))
-    if not plan:
-        log_error(err)
-        return error_html
-
-    game, err = await db.db_select_game_by_id(str(plan.get("parent_id", "")))
-    if not game or not game.get("name", None):
+    if not context or not context.game_name:
         log_error(err)
         return error_html
 
-    ip = server.get("ip_address", "")
-    game_name = game.get("name", "")
+    ip = context.ip_address
+    game_name = context.game_name
 
     # take care of nestings of 1 level and ints
     raw_config_values = await request.form
@@ -226,7 +213,7 @@ async def save_config():
         config_values = parsed_config_form
 
     result, _ = await db.db_update_server_config(
-        config=json.dumps(config_values), server_id=str(server.get("id", ""))
+        config=json.dumps(config_values), server_id=context.server_id
     )
     await provisioner.job_update_config(
         game_server_ip=ip,
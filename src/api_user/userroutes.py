@@ -5,19 +5,35 @@ This module provides routes for user registration, login, dashboard access,
 and server management functionality.
 """
 
+import asyncio
 import json
 import logging
-from typing import Dict, Optional, List, Any
+import os
+from typing import Dict, Mapping, Optional, List, Any
 from urllib.parse import parse_qs
 
 import asyncpg
-from quart import Blueprint, current_app, redirect, render_template, request, url_for
+from quart import (
+    Blueprint,
+    current_app,
+    make_response,
+    redirect,
+    render_template,
+    request,
+    url_for,
+)
 from quart_auth import AuthUser, current_user, login_required, login_user
 
 import helper_classes.custom_dataclass as cdata
 from db import db
+from db.metrics_store import get_metrics_store
+from db.server_events import get_server_event_hub
 from game_jobs.mainProvisioner import MainProvisioner
-from api_user.helpers import extract_single_sub_record
+from api_user.helpers import (
+    extract_single_sub_record,
+    memory_percent,
+    sparkline_points,
+)
 
 # Create logger
 logger = logging.getLogger(__name__)
@@ -25,6 +41,13 @@ logger = logging.getLogger(__name__)
 # Blueprint definition
 userblueprint = Blueprint("userroute", __name__)
 
+# Bounds for /server-events streams
+SERVER_EVENTS_MAX_SUBSCRIPTIONS = int(os.getenv("SERVER_EVENTS_MAX_SUBSCRIPTIONS", 100))
+SERVER_EVENTS_KEEPALIVE_SECONDS = float(
+    os.getenv("SERVER_EVENTS_KEEPALIVE_SECONDS", 15)
+)
+SERVER_EVENTS_RETRY_MS = int(os.getenv("SERVER_EVENTS_RETRY_MS", 3000))
+
 # Password hashing configuration
 
 # TODO: Remove hardcoded secret and use environment variable
@@ -91,6 +114,13 @@ async def register():
         logger.info(data)
         user_record, err = await db.db_insert_user(data)
 
+        if err == db.PASSWORD_HASHER_BUSY:
+            errors["general_errors"].append(err)
+            return (
+                await render_template("home.html", errors=errors),
+                503,
+                {"Retry-After": "1"},
+            )
         if not user_record:
             errors["email_errors"].append(str(err))
             logger.error(f"Failed to create user for email: {data.email}")
@@ -235,7 +265,7 @@ async def monitoring():
 
     # Fetch server linked to this subscription
     res = await db.db_select_server_by_subscription_id(subscription_id)
-    server: Optional[asyncpg.Record] = res[0] if res else None
+    server: Optional[Mapping[str, Any]] = res[0] if res else None
     if not server:
         return "Invalid subscription or server not found", 404
     ip_address = server.get("ip_address", None)
@@ -249,9 +279,20 @@ async def monitoring():
     if not subscription:
         return "Subscription  found", 404
 
-    # CPU/Memory usage — static placeholders (replace with actual call later)
-    cpu_usage_percent = 43  # Example static value
-    memory_usage_percent = 68  # Example static value
+    # Latest sample and last hour of 1-minute averages, None without data
+    metrics = get_metrics_store()
+    sample = await metrics.latest(subscription_id) or {}
+    cpu_usage_percent = sample.get("cpu_usage_percent")
+    memory_usage_percent = memory_percent(sample, subscription["ram_gb"])
+    cpu_history = await metrics.history(subscription_id, "cpu_usage_percent")
+    memory_history = await metrics.history(subscription_id, "memory_usage_percent")
+    if not memory_history:
+        memory_history = [
+            (timestamp, memory_percent({"memory_usage_mb": mb}, subscription["ram_gb"]))
+            for timestamp, mb in await metrics.history(
+                subscription_id, "memory_usage_mb"
+            )
+        ]
 
     # Server running status
     server_status = server["status"]
@@ -263,6 +304,8 @@ async def monitoring():
         subscription_id=subscription_id,
         cpu_usage_percent=cpu_usage_percent,
         memory_usage_percent=memory_usage_percent,
+        cpu_sparkline=sparkline_points(cpu_history),
+        memory_sparkline=sparkline_points(memory_history),
         server_status=server_status,
         subscription=subscription,
     )
@@ -282,6 +325,83 @@ async def server_status():
     return data
 
 
+@userblueprint.route("/server-events", methods=["GET"])
+@login_required
+async def server_events():
+    """
+    Server-Sent Events stream of status and metric changes.
+
+    Streams the events of every `subscription_id` in the query string that
+    belongs to the current user, fed by Redis pub/sub instead of database
+    polling. With `snapshot=1` the stream opens with each server's current
+    status and latest metrics.
+
+    Returns:
+        text/event-stream response
+    """
+    requested = set(request.args.getlist("subscription_id"))
+    all_subs, err = await db.db_select_subscriptions_by_user(
+        user_id=current_user.auth_id
+    )
+    if err:
+        logger.warning(f"Unable to load subscriptions for event stream: {err}")
+        return {"status": "Error loading subscriptions"}, 500
+    subscription_ids = [
+        str(record["id"]) for record in all_subs if str(record["id"]) in requested
+    ]
+    if not subscription_ids or len(subscription_ids) > SERVER_EVENTS_MAX_SUBSCRIPTIONS:
+        return {"status": "Invalid subscription_id"}, 400
+    snapshot = request.args.get("snapshot") == "1"
+
+    async def stream():
+        yield f"retry: {SERVER_EVENTS_RETRY_MS}\n\n"
+        async with get_server_event_hub().watch(*subscription_ids) as events:
+            if snapshot:
+                for subscription_id in subscription_ids:
+                    for event in await _server_snapshot(subscription_id):
+                        yield _sse(subscription_id, event)
+            while True:
+                try:
+                    event = await asyncio.wait_for(
+                        events.get(), timeout=SERVER_EVENTS_KEEPALIVE_SECONDS
+                    )
+                except asyncio.TimeoutError:
+                    # Keeps proxies from closing an idle stream
+                    yield ": keepalive\n\n"
+                    continue
+                yield _sse(event.pop("subscription_id"), event)
+
+    response = await make_response(
+        stream(),
+        {
+            "Content-Type": "text/event-stream",
+            "Cache-Control": "no-cache",
+            "X-Accel-Buffering": "no",
+        },
+    )
+    response.timeout = None
+    return response
+
+
+async def _server_snapshot(subscription_id: str) -> List[Dict[str, Any]]:
+    """Current status and latest metrics of a server, as stream events."""
+    events = []
+    server, _ = await db.db_select_server_by_subscription_id(subscription_id)
+    if server:
+        events.append({"type": "status", "status": server.get("status")})
+    sample = await get_metrics_store().latest(subscription_id)
+    if sample:
+        sample.pop("timestamp", None)
+        events.append({"type": "metrics", **sample})
+    return events
+
+
+def _sse(subscription_id: str, event: Dict[str, Any]) -> str:
+    event_type = event.pop("type", "message")
+    data = json.dumps({"subscription_id": subscription_id, **event})
+    return f"event: {event_type}\ndata: {data}\n\n"
+
+
 @userblueprint.route("/configure", methods=["GET", "POST"])
 @login_required
 async def configure():
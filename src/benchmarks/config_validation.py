@@ -0,0 +1,73 @@
+"""
+Config validation benchmark.
+
+Compares validating game configs the old way, a new provisioner and a
+`jsonschema.validate` call (which checks the schema and builds a
+validator) per config, with the shared provisioner's compiled validator.
+Validates the default config and an invalid variant, and reports
+validations per second for each. Imports the provisioners, so run it with
+the app's environment (.env) in place:
+
+    python benchmarks/config_validation.py --seconds 2
+"""
+
+import argparse
+import asyncio
+import json
+import sys
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict
+
+import jsonschema
+
+sys.path.append(str(Path(__file__).parent.parent))
+
+from game_jobs.provisioner_factory import ProvisionerFactory
+
+
+def rate(work: Callable[[], Any], seconds: float) -> float:
+    """Calls of `work` per second, measured over about `seconds`."""
+    calls, started = 0, time.perf_counter()
+    deadline = started + seconds
+    while (now := time.perf_counter()) < deadline:
+        for _ in range(100):
+            work()
+        calls += 100
+    return calls / (now - started)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--game", default="valheim")
+    parser.add_argument("--seconds", type=float, default=2.0)
+    args = parser.parse_args()
+
+    provisioner = ProvisionerFactory.get_provisioner(args.game)
+    if provisioner is None:
+        sys.exit(f"No provisioner for {args.game}")
+    provisioner_class = type(provisioner)
+    valid: Dict[str, Any] = json.loads(asyncio.run(provisioner.get_default_config()))
+    configs = {"valid": valid, "invalid": {**valid, "name": ""}}
+
+    def old(config: Dict[str, Any]) -> bool:
+        try:
+            jsonschema.validate(config, provisioner_class().schema)
+            return True
+        except jsonschema.ValidationError:
+            return False
+
+    def new(config: Dict[str, Any]) -> bool:
+        provisioner = ProvisionerFactory.get_provisioner(args.game)
+        return provisioner.validator.is_valid(config)
+
+    print(f"{'config':<10}{'old /s':>12}{'new /s':>12}{'speedup':>10}")
+    for name, config in configs.items():
+        assert old(config) == new(config) == (name == "valid")
+        before = rate(lambda config=config: old(config), args.seconds)
+        after = rate(lambda config=config: new(config), args.seconds)
+        print(f"{name:<10}{before:>12.0f}{after:>12.0f}{after / before:>9.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,183 @@
+"""
+Placement simulator.
+
+Fills a synthetic fleet to a target RAM load with every placement
+strategy, frees a share of the servers, refills to the same load, then
+probes how many of the largest plan still fit. Reports packing density
+(RAM used over RAM of hosts in use), hosts in use, large-order headroom
+and per-decision latency. Runs entirely in memory.
+
+    python benchmarks/placement_sim.py --hosts 10000
+"""
+
+import argparse
+import random
+import statistics
+import sys
+import time
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Tuple
+
+sys.path.append(str(Path(__file__).parent.parent))
+
+from game_jobs.placement import (
+    STRATEGIES,
+    CapacityIndex,
+    Demand,
+    HostCapacity,
+    PlacementStrategy,
+)
+
+
+class WorstFit(PlacementStrategy):
+    """Baseline: most free RAM first, which is what the old first-fit over
+    `ORDER BY capacity_used ASC` amounts to."""
+
+    name = "worst_fit_baseline"
+
+    def rank(self, index: CapacityIndex, demand: Demand) -> Iterator[HostCapacity]:
+        return (host for host in index.by_most_free_ram() if host.fits(demand))
+
+
+REGIONS = ["eu-west", "us-east", "ap-south"]
+# (ram_gb, cpu_cores, storage_gb, weight)
+PLANS = [
+    (2, 1, 20, 30),
+    (4, 2, 40, 30),
+    (6, 4, 60, 20),
+    (8, 4, 80, 15),
+    (16, 8, 160, 5),
+]
+
+
+def make_hosts(count: int, rng: random.Random) -> List[HostCapacity]:
+    hosts = []
+    for i in range(count):
+        size = rng.choice([1, 2, 4])
+        hosts.append(
+            HostCapacity(
+                id=f"host-{i:05d}",
+                ip_address=f"10.{i // 65536}.{i // 256 % 256}.{i % 256}",
+                ram_total=64.0 * size,
+                cpu_total=48.0 * size,
+                storage_total=1000.0 * size,
+                region=rng.choice(REGIONS),
+            )
+        )
+    return hosts
+
+
+def make_orders(ram_target: float, rng: random.Random) -> List[Demand]:
+    """Random plan mix adding up to `ram_target` GB."""
+    orders: List[Demand] = []
+    demanded = 0.0
+    weights = [plan[3] for plan in PLANS]
+    while demanded < ram_target:
+        ram, cpu, storage, _ = rng.choices(PLANS, weights=weights)[0]
+        orders.append(Demand(ram, cpu, storage, region=rng.choice(REGIONS)))
+        demanded += ram
+    return orders
+
+
+def run_strategy(
+    strategy: PlacementStrategy,
+    hosts: List[HostCapacity],
+    load: float,
+    batch_size: int,
+    churn: float,
+    seed: int,
+) -> Dict[str, float]:
+    rng = random.Random(seed)
+    index = CapacityIndex(HostCapacity(**host.__dict__) for host in hosts)
+    ram_total = sum(host.ram_total for host in hosts)
+    latencies: List[int] = []
+    placed: List[Tuple[str, Demand]] = []
+    rejected = 0
+
+    def place(orders: List[Demand]) -> None:
+        nonlocal rejected
+        for start in range(0, len(orders), batch_size):
+            batch = orders[start : start + batch_size]
+            started = time.perf_counter_ns()
+            chosen: List[Optional[HostCapacity]] = strategy.place_batch(index, batch)
+            latencies.append((time.perf_counter_ns() - started) // len(batch))
+            for host, demand in zip(chosen, batch, strict=True):
+                if host is None:
+                    rejected += 1
+                else:
+                    placed.append((host.id, demand))
+
+    place(make_orders(ram_total * load, rng))
+
+    # Free a share of the servers, then refill to the same load
+    rng.shuffle(placed)
+    departures = int(len(placed) * churn)
+    for host_id, demand in placed[:departures]:
+        index.release(host_id, demand)
+    del placed[:departures]
+    ram_used = sum(host.ram_used for host in index.hosts.values())
+    place(make_orders(ram_total * load - ram_used, rng))
+
+    used_hosts = [host for host in index.hosts.values() if host.ram_used > 0]
+    ram_used = sum(host.ram_used for host in used_hosts)
+
+    # Headroom: how many of the largest plan still fit after all that churn
+    largest = max(PLANS)
+    probe = Demand(largest[0], largest[1], largest[2])
+    large_fit = 0
+    while (host := strategy.choose(index, probe)) is not None:
+        index.reserve(host.id, probe)
+        large_fit += 1
+
+    ordered = sorted(latencies)
+    return {
+        "placed": len(placed),
+        "rejected": rejected,
+        "density": ram_used / sum(host.ram_total for host in used_hosts),
+        "hosts_used": len(used_hosts),
+        "large_fit": large_fit,
+        "p50_us": ordered[len(ordered) // 2] / 1000,
+        "p99_us": ordered[int(len(ordered) * 0.99)] / 1000,
+        "mean_us": statistics.fmean(latencies) / 1000,
+    }
+
+
+def main() -> None:
+    strategies = {**STRATEGIES, WorstFit.name: WorstFit}
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--hosts", type=int, default=10_000)
+    parser.add_argument(
+        "--load", type=float, default=0.6, help="target share of fleet RAM"
+    )
+    parser.add_argument(
+        "--batch", type=int, default=64, help="orders per scheduling pass"
+    )
+    parser.add_argument(
+        "--churn", type=float, default=0.2, help="share of servers freed midway"
+    )
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--strategy", choices=sorted(strategies), action="append")
+    args = parser.parse_args()
+
+    hosts = make_hosts(args.hosts, random.Random(args.seed))
+    print(
+        f"{len(hosts)} hosts, load {args.load}, batch {args.batch}, churn {args.churn}"
+    )
+    print(
+        f"{'strategy':<22}{'placed':>9}{'rejected':>10}{'density':>9}{'hosts':>8}"
+        f"{'large':>8}{'p50 us':>9}{'p99 us':>9}{'mean us':>9}"
+    )
+    for name in args.strategy or sorted(strategies):
+        result = run_strategy(
+            strategies[name](), hosts, args.load, args.batch, args.churn, args.seed
+        )
+        print(
+            f"{name:<22}{result['placed']:>9}{result['rejected']:>10}"
+            f"{result['density']:>9.3f}{result['hosts_used']:>8}"
+            f"{result['large_fit']:>8}{result['p50_us']:>9.1f}"
+            f"{result['p99_us']:>9.1f}{result['mean_us']:>9.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,155 @@
+"""
+Commands for the baremetal agents.
+
+Each baremetal's agent pops commands from `badger:pending:{ip}` (oldest
+first) and runs them. A command is a compact, versioned JSON envelope:
+
+    {"v": 1, "id": "9f0c...", "type": "restart", "sub": "<subscription id>",
+     "args": {"game": "valheim"}, "deadline": 1767225600000}
+
+`id` identifies the command, `deadline` is when it stops being worth
+running (ms since the epoch) and `args` depends on `type`:
+
+    start         game, ram_gb, cpu_cores
+    stop          game
+    restart       game
+    backup        game
+    updateConfig  game, config (the config values as an object)
+
+`decode` is the agent's parse path: it bounds the envelope's size and
+checks every field's type before anything runs, raising
+`CommandDecodeError` otherwise. Several commands for one host go out in a
+single LPUSH, in order.
+"""
+
+import json
+import os
+import time
+import uuid
+from dataclasses import dataclass, field
+from typing import Any, Dict, Iterable, Union
+
+from redis.asyncio import Redis
+from redis.asyncio.client import Pipeline
+
+COMMAND_VERSION = 1
+AGENT_QUEUE_PREFIX = "badger:pending:"
+# Envelopes larger than this are rejected without being parsed
+MAX_COMMAND_BYTES = 64 * 1024
+# How long a command stays worth running after it is queued
+COMMAND_TTL_SECONDS = float(os.getenv("AGENT_COMMAND_TTL_SECONDS", 5 * 60))
+
+# Required args of each command type and their types
+COMMAND_ARGS: Dict[str, Dict[str, Any]] = {
+    "start": {"game": str, "ram_gb": (int, float), "cpu_cores": (int, float)},
+    "stop": {"game": str},
+    "restart": {"game": str},
+    "backup": {"game": str},
+    "updateConfig": {"game": str, "config": dict},
+}
+
+
+class CommandDecodeError(ValueError):
+    """Raised for an envelope that is malformed, too large or of another version."""
+
+
+def agent_queue(ip_address: Any) -> str:
+    return f"{AGENT_QUEUE_PREFIX}{ip_address}"
+
+
+@dataclass(frozen=True)
+class Command:
+    type: str
+    subscription_id: str
+    args: Dict[str, Any]
+    deadline_ms: int = 0
+    id: str = field(default_factory=lambda: uuid.uuid4().hex)
+
+    @classmethod
+    def new(
+        cls,
+        command_type: str,
+        subscription_id: str,
+        ttl: float = COMMAND_TTL_SECONDS,
+        **args: Any,
+    ) -> "Command":
+        """A command due within `ttl` seconds; raises ValueError on bad args."""
+        command = cls(
+            type=command_type,
+            subscription_id=str(subscription_id),
+            args=args,
+            deadline_ms=int((time.time() + ttl) * 1000),
+        )
+        _check_args(command.type, command.args)
+        return command
+
+    @property
+    def expired(self) -> bool:
+        return time.time() * 1000 > self.deadline_ms
+
+    def encode(self) -> str:
+        return json.dumps(
+            {
+                "v": COMMAND_VERSION,
+                "id": self.id,
+                "type": self.type,
+                "sub": self.subscription_id,
+                "args": self.args,
+                "deadline": self.deadline_ms,
+            },
+            separators=(",", ":"),
+        )
+
+
+def _check_args(command_type: str, args: Any) -> None:
+    expected = COMMAND_ARGS.get(command_type)
+    if expected is None:
+        raise CommandDecodeError(f"Unknown command type {command_type!r}")
+    if not isinstance(args, dict):
+        raise CommandDecodeError("Command args must be an object")
+    for name, kind in expected.items():
+        value = args.get(name)
+        if not isinstance(value, kind) or isinstance(value, bool):
+            raise CommandDecodeError(f"{command_type} needs a valid {name}")
+
+
+def decode(raw: Union[str, bytes]) -> Command:
+    """Parse and check one envelope as popped from an agent queue."""
+    if len(raw) > MAX_COMMAND_BYTES:
+        raise CommandDecodeError(f"Command of {len(raw)} bytes is too large")
+    try:
+        envelope = json.loads(raw)
+    except ValueError as e:
+        raise CommandDecodeError(f"Command is not JSON: {e}") from e
+    if not isinstance(envelope, dict):
+        raise CommandDecodeError("Command must be an object")
+    if envelope.get("v") != COMMAND_VERSION:
+        raise CommandDecodeError(f"Unsupported command version {envelope.get('v')!r}")
+    command_id, subscription_id = envelope.get("id"), envelope.get("sub")
+    deadline_ms = envelope.get("deadline")
+    if not isinstance(command_id, str) or not isinstance(subscription_id, str):
+        raise CommandDecodeError("Command id and sub must be strings")
+    if not isinstance(deadline_ms, int) or isinstance(deadline_ms, bool):
+        raise CommandDecodeError("Command deadline must be an integer")
+    _check_args(envelope.get("type"), envelope.get("args"))
+    return Command(
+        type=envelope["type"],
+        subscription_id=subscription_id,
+        args=envelope["args"],
+        deadline_ms=deadline_ms,
+        id=command_id,
+    )
+
+
+def push_commands(
+    redis_client: Union[Redis, Pipeline],
+    ip_address: Any,
+    commands: Iterable[Command],
+):
+    """Queue commands for one host in a single LPUSH, run in the given order.
+
+    Returns the push coroutine for a client, the pipeline otherwise.
+    """
+    return redis_client.lpush(
+        agent_queue(ip_address), *(command.encode() for command in commands)
+    )
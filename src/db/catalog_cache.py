@@ -0,0 +1,106 @@
+"""
+In-process cache of catalog rows (games and plans).
+
+Catalog rows are only changed by operators, so every process keeps the
+ones it has read in memory for `ttl` seconds. After editing the catalog,
+publish on the invalidation channel so every process drops its copy
+straight away instead of waiting for the TTL:
+
+    redis-cli PUBLISH catalog:invalidate all
+"""
+
+import asyncio
+import logging
+import time
+from typing import Dict, Generic, Hashable, List, Optional, Tuple, TypeVar
+
+from asyncpg import Record
+from redis.asyncio import Redis
+
+CATALOG_INVALIDATE_CHANNEL = "catalog:invalidate"
+
+K = TypeVar("K", bound=Hashable)
+V = TypeVar("V")
+
+
+class TTLCache(Generic[K, V]):
+    """Dictionary whose entries expire `ttl` seconds after they were set.
+
+    When full, the entry closest to expiry is evicted.
+    """
+
+    def __init__(self, ttl: float, maxsize: int = 1024) -> None:
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self._entries: Dict[K, Tuple[float, V]] = {}
+
+    def get(self, key: K) -> Optional[V]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at <= time.monotonic():
+            del self._entries[key]
+            return None
+        return value
+
+    def set(self, key: K, value: V) -> None:
+        if key not in self._entries and len(self._entries) >= self.maxsize:
+            oldest = min(self._entries, key=lambda k: self._entries[k][0])
+            del self._entries[oldest]
+        self._entries[key] = (time.monotonic() + self.ttl, value)
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+class CatalogCache:
+    """Plans by id, games by id, a game's plans and the game list.
+
+    Records are immutable, so the cached rows are handed out as they are.
+    Lookups that find nothing are not cached.
+    """
+
+    def __init__(self, ttl: float = 300) -> None:
+        self.logger = logging.getLogger("backendlogger")
+        self.plans: TTLCache[str, Record] = TTLCache(ttl)
+        self.games: TTLCache[str, Record] = TTLCache(ttl)
+        self.plans_by_game: TTLCache[str, List[Record]] = TTLCache(ttl)
+        self.game_list: TTLCache[str, List[Record]] = TTLCache(ttl, maxsize=1)
+
+    def clear(self) -> None:
+        self.plans.clear()
+        self.games.clear()
+        self.plans_by_game.clear()
+        self.game_list.clear()
+
+    async def invalidate(self, redis_client: Redis) -> None:
+        """Drop the catalog here and in every other process."""
+        self.clear()
+        await redis_client.publish(CATALOG_INVALIDATE_CHANNEL, "all")
+
+    async def listen(self, redis_client: Redis) -> None:
+        """Clear the cache on every invalidation message, reconnecting on errors.
+
+        The cache is also cleared on every (re)subscribe, since messages
+        sent while disconnected are lost.
+        """
+        while True:
+            pubsub = redis_client.pubsub(ignore_subscribe_messages=True)
+            try:
+                await pubsub.subscribe(CATALOG_INVALIDATE_CHANNEL)
+                self.clear()
+                async for message in pubsub.listen():
+                    if message.get("type") == "message":
+                        self.clear()
+                        self.logger.info("Catalog cache invalidated")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.logger.error(f"Catalog invalidation listener failed: {e}")
+                await asyncio.sleep(1)
+            finally:
+                await pubsub.aclose()
@@ -0,0 +1,358 @@
+"""
+Delivery and outcome tracking for agent commands.
+
+Commands are admitted to a host's queue by one Lua script per command,
+which records the command in the same step:
+
+    command:{id}                  hash with the command's type, subscription,
+                                  host, state, attempts, deadline and envelope
+    commands:inflight             ZSET of unfinished command ids, scored by
+                                  when they time out, in ms
+    commands:dead                 ids of commands that timed out, newest first
+    commands:slot:{sub}:{type}    id of the subscription's latest command of
+                                  a type
+    commands:rate:{sub}           commands admitted for the subscription in
+                                  the current rate window
+
+While a subscription's command of some type is still queued, another one
+of that type is not queued again: a config update replaces the queued one
+in place (`coalesced`, the old one ends `superseded`) and any other command
+is dropped as a `duplicate` of it. The slot is read just before the
+script runs and passed to it, so the script only touches keys it is
+given; if another command took the slot in between, the new one is
+queued as is. Commands submitted on a user's behalf are also refused
+while the host's queue holds `max_depth` commands (`queue_full`) or the
+subscription has used up `rate_limit` commands in the current
+`rate_window` (`rate_limited`).
+
+A command is `queued` until the agent reports it `running`, then ends
+`succeeded` or `failed`. A queued command times out at its envelope's
+deadline and is pushed again with a fresh deadline, up to `max_attempts`
+times; the agent skips the stale copy since its deadline has passed. A
+running command times out `run_timeout` seconds after it started and is
+not retried, since it may have had effects. Either way it ends
+`timed_out` and is dead-lettered.
+"""
+
+import dataclasses
+from collections import defaultdict
+from typing import Any, Dict, Iterable, List, Optional, Tuple, Union
+
+from redis.asyncio import Redis
+from redis.asyncio.client import Pipeline
+
+from db.agent_commands import (
+    COMMAND_TTL_SECONDS,
+    Command,
+    agent_queue,
+    decode,
+    push_commands,
+)
+
+COMMAND_KEY_PREFIX = "command:"
+INFLIGHT_KEY = "commands:inflight"
+DEAD_LETTER_KEY = "commands:dead"
+COMMAND_SLOT_PREFIX = "commands:slot:"
+COMMAND_RATE_PREFIX = "commands:rate:"
+
+QUEUED, RUNNING = "queued", "running"
+SUCCEEDED, FAILED, TIMED_OUT = "succeeded", "failed", "timed_out"
+SUPERSEDED = "superseded"
+FINAL_STATES = {SUCCEEDED, FAILED, TIMED_OUT, SUPERSEDED}
+# States an agent may report
+REPORTED_STATES = {RUNNING, SUCCEEDED, FAILED}
+
+# Outcomes of admitting a command; the first two put it on the queue
+ADMITTED, COALESCED = "queued", "coalesced"
+DUPLICATE, QUEUE_FULL, RATE_LIMITED = "duplicate", "queue_full", "rate_limited"
+# What a new command does to a queued one of the same type and subscription
+COALESCE, DEDUPLICATE = "coalesce", "dedup"
+COMMAND_POLICIES = {"updateConfig": COALESCE}
+
+# KEYS: queue, command hash, inflight, slot, rate, hash of the slot's command.
+# ARGV: id, envelope, deadline ms, policy, max depth, rate limit,
+#       rate window ms, retention s, type, subscription, host, slot's command
+#       id as read before the call ('' for none).
+# The slot's command is only deduplicated or coalesced with if the slot
+# still holds the id read before the call; otherwise the command is queued
+# as is. Limits of 0 are not enforced. Returns {outcome, id of the queued
+# command it replaced or duplicates, or ''}.
+_ADMIT_SCRIPT = """
+local now = redis.call('TIME')
+local now_ms = tonumber(now[1]) * 1000 + math.floor(tonumber(now[2]) / 1000)
+local function record()
+    redis.call('HSET', KEYS[2], 'id', ARGV[1], 'type', ARGV[9],
+        'subscription_id', ARGV[10], 'ip_address', ARGV[11], 'state', 'queued',
+        'attempts', 1, 'deadline', ARGV[3], 'envelope', ARGV[2],
+        'created_at', now_ms, 'updated_at', now_ms)
+    redis.call('EXPIRE', KEYS[2], ARGV[8])
+    redis.call('ZADD', KEYS[3], ARGV[3], ARGV[1])
+    redis.call('SET', KEYS[4], ARGV[1], 'EX', ARGV[8])
+end
+
+local queued = redis.call('GET', KEYS[4])
+if queued and queued == ARGV[12] then
+    local fields = redis.call('HMGET', KEYS[6], 'state', 'envelope')
+    if fields[1] == 'queued' then
+        if ARGV[4] ~= 'coalesce' then
+            return {'duplicate', queued}
+        end
+        local position = redis.call('LPOS', KEYS[1], fields[2])
+        if position then
+            redis.call('LSET', KEYS[1], position, ARGV[2])
+            redis.call('HSET', KEYS[6], 'state', 'superseded',
+                'detail', 'superseded by ' .. ARGV[1], 'updated_at', now_ms)
+            redis.call('ZREM', KEYS[3], queued)
+            record()
+            return {'coalesced', queued}
+        end
+    end
+end
+
+local max_depth = tonumber(ARGV[5])
+if max_depth > 0 and redis.call('LLEN', KEYS[1]) >= max_depth then
+    return {'queue_full', ''}
+end
+local rate_limit = tonumber(ARGV[6])
+if rate_limit > 0 then
+    local used = redis.call('INCR', KEYS[5])
+    if used == 1 then
+        redis.call('PEXPIRE', KEYS[5], ARGV[7])
+    end
+    if used > rate_limit then
+        return {'rate_limited', ''}
+    end
+end
+redis.call('LPUSH', KEYS[1], ARGV[2])
+record()
+return {'queued', ''}
+"""
+
+# KEYS: command hash, inflight; ARGV: id, state, detail, run timeout ms.
+# Moves an unfinished command to `state`; returns the previous state.
+_MARK_SCRIPT = """
+local state = redis.call('HGET', KEYS[1], 'state')
+if not state or (state ~= 'queued' and state ~= 'running') then
+    return state or false
+end
+local now = redis.call('TIME')
+local now_ms = tonumber(now[1]) * 1000 + math.floor(tonumber(now[2]) / 1000)
+redis.call('HSET', KEYS[1], 'state', ARGV[2], 'detail', ARGV[3], 'updated_at', now_ms)
+if ARGV[2] == 'running' then
+    redis.call('ZADD', KEYS[2], now_ms + tonumber(ARGV[4]), ARGV[1])
+else
+    redis.call('ZREM', KEYS[2], ARGV[1])
+end
+return state
+"""
+
+# KEYS: inflight; ARGV: batch size, max attempts, queued ttl ms, hash prefix.
+# Handles up to a batch of timed-out commands: queued ones with attempts
+# left get a new deadline, the rest end timed_out. Returns a flat list of
+# id, "retry" or "dead", new deadline.
+_TIMEOUT_SCRIPT = """
+local now = redis.call('TIME')
+local now_ms = tonumber(now[1]) * 1000 + math.floor(tonumber(now[2]) / 1000)
+local ids = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', now_ms, 'LIMIT', 0, tonumber(ARGV[1]))
+local handled = {}
+for _, id in ipairs(ids) do
+    local key = ARGV[4] .. id
+    local fields = redis.call('HMGET', key, 'state', 'attempts')
+    local attempts = tonumber(fields[2] or '0')
+    if not fields[1] then
+        redis.call('ZREM', KEYS[1], id)
+    elseif fields[1] == 'queued' and attempts < tonumber(ARGV[2]) then
+        local deadline = now_ms + tonumber(ARGV[3])
+        redis.call('HSET', key, 'attempts', attempts + 1, 'deadline', deadline, 'updated_at', now_ms)
+        redis.call('ZADD', KEYS[1], deadline, id)
+        handled[#handled + 1] = id
+        handled[#handled + 1] = 'retry'
+        handled[#handled + 1] = deadline
+    else
+        redis.call('HSET', key, 'state', 'timed_out', 'updated_at', now_ms)
+        redis.call('ZREM', KEYS[1], id)
+        handled[#handled + 1] = id
+        handled[#handled + 1] = 'dead'
+        handled[#handled + 1] = 0
+    end
+end
+return handled
+"""
+
+
+def command_key(command_id: str) -> str:
+    return f"{COMMAND_KEY_PREFIX}{command_id}"
+
+
+def slot_key(command: Command) -> str:
+    return f"{COMMAND_SLOT_PREFIX}{command.subscription_id}:{command.type}"
+
+
+class CommandTracker:
+    """Pushes agent commands and follows each one to its outcome."""
+
+    def __init__(
+        self,
+        max_attempts: int = 3,
+        run_timeout: float = 30 * 60,
+        retention: float = 24 * 60 * 60,
+        dead_letter_size: int = 1000,
+        max_depth: int = 100,
+        rate_limit: int = 10,
+        rate_window: float = 60,
+    ) -> None:
+        self.max_attempts = max_attempts
+        self.run_timeout_ms = int(run_timeout * 1000)
+        self.retention_s = int(retention)
+        self.dead_letter_size = dead_letter_size
+        self.max_depth = max_depth
+        self.rate_limit = rate_limit
+        self.rate_window_ms = int(rate_window * 1000)
+
+    def _admit(
+        self,
+        redis_client: Union[Redis, Pipeline],
+        ip_address: Any,
+        command: Command,
+        queued_id: Optional[str],
+        limited: bool,
+    ):
+        return redis_client.eval(
+            _ADMIT_SCRIPT,
+            6,
+            agent_queue(ip_address),
+            command_key(command.id),
+            INFLIGHT_KEY,
+            slot_key(command),
+            f"{COMMAND_RATE_PREFIX}{command.subscription_id}",
+            command_key(queued_id or command.id),
+            command.id,
+            command.encode(),
+            command.deadline_ms,
+            COMMAND_POLICIES.get(command.type, DEDUPLICATE),
+            self.max_depth if limited else 0,
+            self.rate_limit if limited else 0,
+            self.rate_window_ms,
+            self.retention_s,
+            command.type,
+            command.subscription_id,
+            str(ip_address),
+            queued_id or "",
+        )
+
+    async def push(
+        self,
+        redis_client: Redis,
+        pipe: Pipeline,
+        ip_address: Any,
+        commands: Iterable[Command],
+    ) -> Pipeline:
+        """Queue the backend's own commands for one host on `pipe`, in order.
+
+        Duplicates are dropped and config updates coalesced, but depth and
+        rate limits do not apply. The commands' slots are read first, in one
+        MGET on `redis_client`.
+        """
+        commands = list(commands)
+        if not commands:
+            return pipe
+        queued_ids = await redis_client.mget([slot_key(c) for c in commands])
+        for command, queued_id in zip(commands, queued_ids, strict=True):
+            self._admit(pipe, ip_address, command, queued_id, limited=False)
+        return pipe
+
+    async def submit(
+        self, redis_client: Redis, ip_address: Any, command: Command
+    ) -> Tuple[str, str]:
+        """Queue a command on a user's behalf, within the depth and rate limits.
+
+        Returns the outcome and the id the user should follow: the new
+        command's, or for a duplicate the queued command's.
+        """
+        queued_id = await redis_client.get(slot_key(command))
+        outcome, queued_id = await self._admit(
+            redis_client, ip_address, command, queued_id, limited=True
+        )
+        return outcome, queued_id if outcome == DUPLICATE else command.id
+
+    async def get(
+        self, redis_client: Redis, command_id: str
+    ) -> Optional[Dict[str, str]]:
+        """A command's recorded fields, None once unknown or past retention."""
+        fields = await redis_client.hgetall(command_key(command_id))
+        return fields or None
+
+    async def mark(
+        self, redis_client: Redis, command_id: str, state: str, detail: str = ""
+    ) -> Optional[str]:
+        """Record an agent-reported state; returns the state it replaced.
+
+        A command that already finished keeps its outcome, and its final
+        state is returned; None means the command is unknown.
+        """
+        if state not in REPORTED_STATES:
+            raise ValueError(f"Unknown command state {state!r}")
+        return await redis_client.eval(
+            _MARK_SCRIPT,
+            2,
+            command_key(command_id),
+            INFLIGHT_KEY,
+            command_id,
+            state,
+            detail,
+            self.run_timeout_ms,
+        )
+
+    async def time_out(
+        self, redis_client: Redis, limit: int = 500
+    ) -> Tuple[int, List[Dict[str, str]]]:
+        """Retry or dead-letter a batch of commands past their deadline.
+
+        Returns the number of commands pushed again and the fields of the
+        ones that ended timed_out. Commands whose hash is gone by the time
+        it is read are dropped from the in-flight set.
+        """
+        handled = await redis_client.eval(
+            _TIMEOUT_SCRIPT,
+            1,
+            INFLIGHT_KEY,
+            limit,
+            self.max_attempts,
+            int(COMMAND_TTL_SECONDS * 1000),
+            COMMAND_KEY_PREFIX,
+        )
+        outcomes = list(zip(handled[0::3], handled[1::3], handled[2::3], strict=True))
+        if not outcomes:
+            return 0, []
+
+        pipe = redis_client.pipeline(transaction=False)
+        for command_id, _, _ in outcomes:
+            pipe.hgetall(command_key(command_id))
+        records = await pipe.execute()
+
+        retries: Dict[str, List[Command]] = defaultdict(list)
+        dead = []
+        pipe = redis_client.pipeline(transaction=False)
+        for (command_id, outcome, deadline_ms), fields in zip(
+            outcomes, records, strict=True
+        ):
+            if "envelope" not in fields:
+                # Expired or settled since the script ran
+                pipe.zrem(INFLIGHT_KEY, command_id)
+                continue
+            if outcome == "dead":
+                dead.append(fields)
+                pipe.lpush(DEAD_LETTER_KEY, command_id)
+                continue
+            command = dataclasses.replace(
+                decode(fields["envelope"]), deadline_ms=int(deadline_ms)
+            )
+            pipe.hset(command_key(command_id), "envelope", command.encode())
+            retries[fields["ip_address"]].append(command)
+        for ip_address, commands in retries.items():
+            push_commands(pipe, ip_address, commands)
+        if dead:
+            pipe.ltrim(DEAD_LETTER_KEY, 0, self.dead_letter_size - 1)
+        if pipe.command_stack:
+            await pipe.execute()
+        return sum(len(commands) for commands in retries.values()), dead
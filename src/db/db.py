@@ -4,13 +4,15 @@ import logging
 import re
 import os
 import sys
+import time
 import bcrypt
-from typing import Any, Dict, List, Optional, Tuple
+from typing import Any, Dict, List, Mapping, Optional, Tuple
 from contextlib import asynccontextmanager
 
 import asyncpg
 import dotenv
 from asyncpg import Pool, Record
+from asyncpg.prepared_stmt import PreparedStatement
 from redis.asyncio import Redis
 from pathlib import Path
 import enum
@@ -19,6 +21,11 @@ import enum
 sys.path.append(str(Path(__file__).parent.parent))
 
 import helper_classes.custom_dataclass as cdata
+from db.catalog_cache import CatalogCache
+from db.command_tracker import CommandTracker
+from db.expiry_schedule import ExpirySchedule
+from db.password_hasher import PasswordHasher, PasswordHasherBusy
+from db.server_cache import ServerCache
 
 dotenv.load_dotenv()
 
@@ -40,12 +47,46 @@ REDIS_CLIENT: Redis | None = None
 SQL_QUERIES: Dict[str, str] = {}
 pool: Pool | None = None
 _pool_lock = asyncio.Lock()
+CATALOG_CACHE = CatalogCache(ttl=float(os.getenv("CATALOG_CACHE_TTL", 300)))
+SERVER_CACHE = ServerCache(
+    ttl=float(os.getenv("SERVER_CACHE_TTL", 300)),
+    negative_ttl=float(os.getenv("SERVER_CACHE_NEGATIVE_TTL", 30)),
+)
+# Paid subscriptions expire this long after expires_at, trials right away
+EXPIRY_SCHEDULE = ExpirySchedule(
+    grace=float(os.getenv("SUBSCRIPTION_EXPIRY_GRACE_SECONDS", 3600)),
+    claim_ttl=float(os.getenv("SUBSCRIPTION_EXPIRY_CLAIM_TTL_SECONDS", 300)),
+)
+# Agent commands: queued ones are pushed again up to max attempts, running
+# ones time out after the run timeout. Users' commands are refused beyond a
+# host queue depth and a per-subscription rate.
+COMMAND_TRACKER = CommandTracker(
+    max_attempts=int(os.getenv("AGENT_COMMAND_MAX_ATTEMPTS", 3)),
+    run_timeout=float(os.getenv("AGENT_COMMAND_RUN_TIMEOUT_SECONDS", 30 * 60)),
+    max_depth=int(os.getenv("AGENT_QUEUE_MAX_DEPTH", 100)),
+    rate_limit=int(os.getenv("AGENT_COMMAND_RATE_LIMIT", 10)),
+    rate_window=float(os.getenv("AGENT_COMMAND_RATE_WINDOW_SECONDS", 60)),
+)
+# Prepare every named query on each pool connection; turn off for poolers
+# that do not support prepared statements
+PREPARE_STATEMENTS = os.getenv("DB_PREPARE_STATEMENTS", "1") != "0"
+QUERY_STATS: Dict[str, cdata.QueryStats] = {}
+# bcrypt runs on its own threads; calls beyond the pending limit are refused
+PASSWORD_HASHER = PasswordHasher(
+    workers=int(os.getenv("PASSWORD_HASH_WORKERS", 2)),
+    max_pending=int(os.getenv("PASSWORD_HASH_MAX_PENDING", 32)),
+)
+# Error returned by db_insert_user when the password hashing pool is full;
+# the register route answers 503
+PASSWORD_HASHER_BUSY = "Too many sign-ups in progress, please try again shortly"
 
 
 class QUERY_TYPE(enum.Enum):
     EXECUTE = "execute"
     FETCH = "fetch"
     FETCHROW = "fetchrow"
+    # Runs the query once per argument tuple; takes a single list of tuples
+    EXECUTEMANY = "executemany"
 
 
 class INTERNAL_SUBSCRIPTION_STATUS(enum.Enum):
@@ -79,14 +120,22 @@ class SERVER_STATUS(enum.Enum):
     NOT_FOUND = "not_found"
 
 
+# Server status set while each agent command is in flight
+COMMAND_SERVER_STATUS = {
+    "start": SERVER_STATUS.PROVISIONING.value,
+    "restart": SERVER_STATUS.RESTARTING.value,
+    "stop": SERVER_STATUS.STOPPING.value,
+}
+
+
 # Password Security Functions
 def hash_password(password: str) -> str:
-    """Hash a password using bcrypt"""
+    """Hash a password using bcrypt; blocks, so coroutines use PASSWORD_HASHER"""
     return bcrypt.hashpw(password.encode("utf-8"), bcrypt.gensalt()).decode("utf-8")
 
 
 def verify_password(password: str, hashed: str) -> bool:
-    """Verify a password against its hash"""
+    """Verify a password against its hash; blocks, so coroutines use PASSWORD_HASHER"""
     return bcrypt.checkpw(password.encode("utf-8"), hashed.encode("utf-8"))
 
 
@@ -112,6 +161,38 @@ async def get_redis_client() -> Redis:
     return REDIS_CLIENT
 
 
+async def _cache_servers(rows: List[Record]) -> None:
+    """Write server rows just returned by a write through to the server cache.
+
+    A failed cache write is logged and leaves the write itself untouched.
+    """
+    try:
+        await SERVER_CACHE.store(await get_redis_client(), [row for row in rows if row])
+    except Exception as e:
+        logger.warning(f"Unable to update server cache: {str(e)}")
+
+
+async def _uncache_servers(*subscription_ids: str) -> None:
+    """Drop cached servers after a write that returned no complete row"""
+    try:
+        await SERVER_CACHE.invalidate(await get_redis_client(), *subscription_ids)
+    except Exception as e:
+        logger.warning(f"Unable to invalidate server cache: {str(e)}")
+
+
+async def _schedule_expiries(rows: List[Record]) -> None:
+    """Index subscription rows just returned by a write by when they expire.
+
+    A failed index write is logged; the periodic backfill picks it up.
+    """
+    try:
+        await EXPIRY_SCHEDULE.schedule(
+            await get_redis_client(), [row for row in rows if row]
+        )
+    except Exception as e:
+        logger.warning(f"Unable to update expiry schedule: {str(e)}")
+
+
 def load_sql_queries() -> None:
     """Load SQL queries from files into memory with better error handling"""
     try:
@@ -153,6 +234,33 @@ def load_sql_queries() -> None:
         raise
 
 
+class NamedStatementConnection(asyncpg.Connection):
+    """Connection holding a prepared statement per named query in SQL_QUERIES"""
+
+    def __init__(self, *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self.named_statements: Dict[str, PreparedStatement] = {}
+
+    async def prepare_named(self, query_name: str) -> PreparedStatement:
+        statement = await self.prepare(SQL_QUERIES[query_name])
+        self.named_statements[query_name] = statement
+        return statement
+
+
+async def _prepare_named_queries(conn: NamedStatementConnection) -> None:
+    """Pool `init` hook: prepare every named query on a new connection.
+
+    A query that does not parse or plan against the schema fails here, when
+    the pool is created, instead of on the first request that uses it.
+    """
+    for query_name in SQL_QUERIES:
+        try:
+            await conn.prepare_named(query_name)
+        except asyncpg.PostgresError as e:
+            logger.error(f"Unable to prepare query {query_name}: {e}")
+            raise
+
+
 async def get_pool() -> Pool:
     """Get or create database connection pool with improved error handling"""
     global pool
@@ -168,6 +276,8 @@ async def get_pool() -> Pool:
                     server_settings={
                         "jit": "off"  # Disable JIT for better performance on simple queries
                     },
+                    connection_class=NamedStatementConnection,
+                    init=_prepare_named_queries if PREPARE_STATEMENTS else None,
                 )
                 logger.info("Database connection pool created")
 
@@ -209,17 +319,15 @@ async def execute_query(
         logger.error(f"Query '{query_name}' not found in loaded queries")
         raise ValueError(f"Unknown query: {query_name}")
 
-    query_sql = SQL_QUERIES[query_name]
-
     try:
         async with get_db_connection() as conn:
             if use_transaction:
                 async with conn.transaction():
                     return await _execute_query_by_type(
-                        conn, query_type, query_sql, args
+                        conn, query_type, query_name, args
                     )
             else:
-                return await _execute_query_by_type(conn, query_type, query_sql, args)
+                return await _execute_query_by_type(conn, query_type, query_name, args)
 
     except asyncpg.PostgresError as e:
         logger.error(f"Database error in {query_name}: {e}")
@@ -229,10 +337,56 @@ async def execute_query(
         raise
 
 
+async def _execute_named(conn, query_type: QUERY_TYPE, query_name: str, *args) -> Any:
+    """Execute a named query on an already acquired connection, e.g. inside a transaction"""
+    if query_name not in SQL_QUERIES:
+        logger.error(f"Query '{query_name}' not found in loaded queries")
+        raise ValueError(f"Unknown query: {query_name}")
+    return await _execute_query_by_type(conn, query_type, query_name, args)
+
+
 async def _execute_query_by_type(
+    conn, query_type: QUERY_TYPE, query_name: str, args: tuple
+) -> Any:
+    """Execute a named query based on type, recording its stats"""
+    stats = QUERY_STATS.setdefault(query_name, cdata.QueryStats())
+    started = time.perf_counter()
+    try:
+        statements = getattr(conn, "named_statements", None)
+        if statements is None or not PREPARE_STATEMENTS:
+            result = await _execute_sql(conn, query_type, SQL_QUERIES[query_name], args)
+        else:
+            statement = statements.get(query_name) or await conn.prepare_named(
+                query_name
+            )
+            try:
+                result = await _execute_prepared(statement, query_type, args)
+            except (
+                asyncpg.InvalidCachedStatementError,
+                asyncpg.OutdatedSchemaCacheError,
+            ):
+                # The schema changed under the prepared plan. Prepare it again,
+                # on next use if the error already aborted a transaction.
+                statements.pop(query_name, None)
+                if conn.is_in_transaction():
+                    raise
+                statement = await conn.prepare_named(query_name)
+                result = await _execute_prepared(statement, query_type, args)
+    except Exception:
+        stats.errors += 1
+        raise
+    finally:
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        stats.calls += 1
+        stats.total_ms += elapsed_ms
+        stats.max_ms = max(stats.max_ms, elapsed_ms)
+    stats.rows += _row_count(query_type, result, args)
+    return result
+
+
+async def _execute_sql(
     conn, query_type: QUERY_TYPE, query_sql: str, args: tuple
 ) -> Any:
-    """Execute query based on type"""
     match query_type:
         case QUERY_TYPE.EXECUTE:
             return await conn.execute(query_sql, *args)
@@ -240,17 +394,79 @@ async def _execute_query_by_type(
             return await conn.fetch(query_sql, *args)
         case QUERY_TYPE.FETCHROW:
             return await conn.fetchrow(query_sql, *args)
+        case QUERY_TYPE.EXECUTEMANY:
+            return await conn.executemany(query_sql, *args)
         case _:
             raise ValueError(f"Unknown query type: {query_type}")
 
 
+async def _execute_prepared(
+    statement: PreparedStatement, query_type: QUERY_TYPE, args: tuple
+) -> Any:
+    match query_type:
+        case QUERY_TYPE.EXECUTE:
+            await statement.fetch(*args)
+            return statement.get_statusmsg()
+        case QUERY_TYPE.FETCH:
+            return await statement.fetch(*args)
+        case QUERY_TYPE.FETCHROW:
+            return await statement.fetchrow(*args)
+        case QUERY_TYPE.EXECUTEMANY:
+            return await statement.executemany(*args)
+        case _:
+            raise ValueError(f"Unknown query type: {query_type}")
+
+
+def _row_count(query_type: QUERY_TYPE, result: Any, args: tuple) -> int:
+    match query_type:
+        case QUERY_TYPE.EXECUTEMANY:
+            return len(args[0]) if args else 0
+        case QUERY_TYPE.FETCH:
+            return len(result)
+        case QUERY_TYPE.FETCHROW:
+            return 0 if result is None else 1
+        case _:
+            # Command tags look like "UPDATE 3" or "INSERT 0 1"
+            count = str(result or "").rsplit(" ", 1)[-1]
+            return int(count) if count.isdigit() else 0
+
+
+def db_query_stats() -> Dict[str, cdata.QueryStats]:
+    """Per named query call count, errors, rows and latency since startup"""
+    return dict(QUERY_STATS)
+
+
+def db_password_hash_stats() -> cdata.PasswordHashStats:
+    """Password hashing pool calls, rejections, wait time and hash time since startup"""
+    return PASSWORD_HASHER.stats
+
+
+def log_password_hash_stats() -> None:
+    stats = PASSWORD_HASHER.stats
+    logger.info(
+        f"password hashing: calls={stats.calls} rejected={stats.rejected}"
+        f" wait mean={stats.wait_mean_ms:.2f}ms max={stats.wait_max_ms:.2f}ms"
+        f" hash mean={stats.hash_mean_ms:.2f}ms max={stats.hash_max_ms:.2f}ms"
+    )
+
+
+def log_query_stats(limit: int = 10) -> None:
+    """Log the named queries with the most total time"""
+    busiest = sorted(QUERY_STATS.items(), key=lambda item: -item[1].total_ms)
+    for query_name, stats in busiest[:limit]:
+        logger.info(
+            f"{query_name}: calls={stats.calls} errors={stats.errors} rows={stats.rows}"
+            f" mean={stats.mean_ms:.2f}ms max={stats.max_ms:.2f}ms"
+        )
+
+
 # USER OPERATIONS
 async def db_insert_user(
     data: cdata.RegisterUserData,
 ) -> Tuple[Optional[Record], Optional[str]]:
     """Insert a new user with hashed password"""
     try:
-        hashed_password = hash_password(data.password)
+        hashed_password = await PASSWORD_HASHER.hash(data.password)
 
         result = await execute_query(
             QUERY_TYPE.FETCHROW,
@@ -261,6 +477,9 @@ async def db_insert_user(
         )
         return result, None
 
+    except PasswordHasherBusy as e:
+        logger.warning(f"Refused sign-up for {data.email}: {str(e)}")
+        return None, PASSWORD_HASHER_BUSY
     except asyncpg.UniqueViolationError:
         logger.warning(f"Attempt to create duplicate user: {data.email}")
         return None, "User with that email already exists"
@@ -279,7 +498,7 @@ async def db_authenticate_user(
         if not user:
             return None, "User not found"
 
-        if not verify_password(password, user["password"]):
+        if not await PASSWORD_HASHER.verify(password, user["password"]):
             return None, "Invalid password"
 
         # Return user without password field - create a new dict to avoid modifying the original
@@ -339,6 +558,7 @@ async def db_insert_free_subscription(
             is_trial,
             use_transaction=True,
         )
+        await _schedule_expiries([result])
         return result, None
 
     except asyncpg.ForeignKeyViolationError:
@@ -375,6 +595,7 @@ async def db_insert_server(
     ports: str = "",
     docker_container_id: str = "",
     config: str = "",
+    baremetal_id: Optional[str] = None,
 ) -> Tuple[Optional[Record], Optional[str]]:
     """Insert a new server"""
     try:
@@ -390,8 +611,10 @@ async def db_insert_server(
             ports,
             docker_container_id,
             config,
+            baremetal_id,
             use_transaction=True,
         )
+        await _cache_servers([result])
         return result, None
 
     except asyncpg.ForeignKeyViolationError:
@@ -424,6 +647,7 @@ async def db_update_server_status(
 
         if not result:
             return None, "Server not found"
+        await _cache_servers([result])
         return result, None
 
     except Exception as e:
@@ -431,11 +655,62 @@ async def db_update_server_status(
         return None, f"Database error: {str(e)}"
 
 
+async def db_select_server_context(
+    subscription_id: str,
+) -> Tuple[Optional[cdata.ServerContext], Optional[str]]:
+    """Server, subscription, plan and game of a subscription in one query"""
+    try:
+        if not subscription_id:
+            return None, "Subscription ID is required"
+        result = await execute_query(
+            QUERY_TYPE.FETCHROW, "SelectServerContextBySubscription", subscription_id
+        )
+        if not result:
+            return None, "Server not found"
+        return cdata.ServerContext.from_record(result), None
+    except Exception as e:
+        logger.error(f"Error in db_select_server_context : {str(e)}")
+        return None, f"Database error: {str(e)}"
+
+
+async def db_update_server_status_with_context(
+    subscription_id: str, status: str
+) -> Tuple[Optional[cdata.ServerContext], Optional[str]]:
+    """Set a server's status and return its context in the same statement"""
+    try:
+        if not subscription_id:
+            return None, "Subscription ID is required"
+        result = await execute_query(
+            QUERY_TYPE.FETCHROW,
+            "UpdateServerStatusWithContext",
+            status,
+            subscription_id,
+        )
+        if not result:
+            return None, "Server not found"
+        try:
+            await SERVER_CACHE.patch(
+                await get_redis_client(), str(subscription_id), status=status
+            )
+        except Exception as e:
+            logger.warning(f"Unable to update server cache: {str(e)}")
+            await _uncache_servers(str(subscription_id))
+        return cdata.ServerContext.from_record(result), None
+    except Exception as e:
+        logger.error(f"Error in db_update_server_status_with_context : {str(e)}")
+        return None, f"Database error: {str(e)}"
+
+
 # CATALOG OPERATIONS
 async def db_select_games() -> Tuple[List[Record], Optional[str]]:
     """Get all available games"""
     try:
+        cached = CATALOG_CACHE.game_list.get("all")
+        if cached is not None:
+            return cached, None
         result = await execute_query(QUERY_TYPE.FETCH, "SelectAllGames")
+        if result:
+            CATALOG_CACHE.game_list.set("all", result)
         return result or [], None
 
     except Exception as e:
@@ -449,7 +724,12 @@ async def db_select_plans_by_game(game_id: str) -> Tuple[List[Record], Optional[
         if not game_id:
             return [], "Game ID is required"
 
+        cached = CATALOG_CACHE.plans_by_game.get(str(game_id))
+        if cached is not None:
+            return cached, None
         result = await execute_query(QUERY_TYPE.FETCH, "SelectAllPlansByGame", game_id)
+        if result:
+            CATALOG_CACHE.plans_by_game.set(str(game_id), result)
         return result or [], None
 
     except Exception as e:
@@ -474,12 +754,20 @@ async def db_select_subscription_by_id(
 
 async def db_select_server_by_subscription_id(
     subscription_id: str,
-) -> Tuple[Optional[Record], Optional[str]]:
+) -> Tuple[Optional[Mapping[str, Any]], Optional[str]]:
+    """A subscription's server, served from the server cache when possible.
+
+    Values of a cached row are strings; NULL columns read as None.
+    """
     try:
         if not subscription_id:
             return None, "Subscription ID is required"
-        result = await execute_query(
-            QUERY_TYPE.FETCHROW, "SelectServerBySubscription", subscription_id
+        result = await SERVER_CACHE.get(
+            await get_redis_client(),
+            str(subscription_id),
+            lambda: execute_query(
+                QUERY_TYPE.FETCHROW, "SelectServerBySubscription", subscription_id
+            ),
         )
         return result or None, None
     except Exception as e:
@@ -487,6 +775,28 @@ async def db_select_server_by_subscription_id(
         return None, f"Database error: {str(e)}"
 
 
+async def db_select_stale_servers(
+    older_than_seconds: float, limit: int = 500
+) -> Tuple[List[Record], Optional[str]]:
+    """Servers still provisioning, restarting or stopping after `older_than_seconds`"""
+    try:
+        result = await execute_query(
+            QUERY_TYPE.FETCH,
+            "SelectStaleServers",
+            [
+                SERVER_STATUS.PROVISIONING.value,
+                SERVER_STATUS.RESTARTING.value,
+                SERVER_STATUS.STOPPING.value,
+            ],
+            float(older_than_seconds),
+            limit,
+        )
+        return result or [], None
+    except Exception as e:
+        logger.error(f"Error in db_select_stale_servers : {str(e)}")
+        return [], f"Database error: {str(e)}"
+
+
 async def db_select_server_by_id(
     server_id: str,
 ) -> Tuple[Optional[Record], Optional[str]]:
@@ -506,20 +816,56 @@ async def db_select_plan_by_id(
     try:
         if not plan_id:
             return None, "Plan ID is required"
+        cached = CATALOG_CACHE.plans.get(str(plan_id))
+        if cached is not None:
+            return cached, None
         result = await execute_query(QUERY_TYPE.FETCHROW, "SelectPlanById", plan_id)
+        if result:
+            CATALOG_CACHE.plans.set(str(plan_id), result)
         return result or None, None
     except Exception as e:
         logger.error(f"Error selecting plan by id : {str(e)}")
         return None, f"Database error: {str(e)}"
 
 
+async def db_select_plans_by_ids(
+    plan_ids: List[str],
+) -> Tuple[Dict[str, Record], Optional[str]]:
+    """Active plans for a set of ids keyed by id, querying only the uncached ones"""
+    try:
+        plans = {}
+        missing = []
+        for plan_id in plan_ids:
+            cached = CATALOG_CACHE.plans.get(str(plan_id))
+            if cached is not None:
+                plans[plan_id] = cached
+            else:
+                missing.append(plan_id)
+        if not missing:
+            return plans, None
+        result = await execute_query(QUERY_TYPE.FETCH, "SelectPlansByIds", missing)
+        for plan in result or []:
+            plan_id = str(plan.get("id"))
+            CATALOG_CACHE.plans.set(plan_id, plan)
+            plans[plan_id] = plan
+        return plans, None
+    except Exception as e:
+        logger.error(f"Error selecting plans by ids : {str(e)}")
+        return {}, f"Database error: {str(e)}"
+
+
 async def db_select_game_by_id(
     game_id: str,
 ) -> Tuple[Optional[Record], Optional[str]]:
     try:
         if not game_id:
             return None, "Game ID is required"
+        cached = CATALOG_CACHE.games.get(str(game_id))
+        if cached is not None:
+            return cached, None
         result = await execute_query(QUERY_TYPE.FETCHROW, "SelectGameById", game_id)
+        if result:
+            CATALOG_CACHE.games.set(str(game_id), result)
         return result or None, None
     except Exception as e:
         logger.error(f"Error selecting game by id : {str(e)}")
@@ -548,6 +894,7 @@ async def db_insert_subscription_with_payment(
             next_billing_date,
             False,  # Changed from FALSE to False
         )
+        await _schedule_expiries([result])
         return result or None, None
     except Exception as e:
         logger.error(f"Error db_insert_subscription_with_payment  : {str(e)}")
@@ -600,6 +947,7 @@ async def db_cancel_subscription(
             SUBSCRIPTION_STATUS.CANCELLED.value,  # Use .value to get the string
             paddle_subscription_id,
         )
+        await _schedule_expiries([result])
         return result or None, None
     except Exception as e:
         logger.error(f"Error in db_cancel_subscription  : {str(e)}")
@@ -619,6 +967,7 @@ async def db_mark_subscription_expired(
             paddle_subscription_id,
             user_id,
         )
+        await _schedule_expiries([result])
         return result or None, None
     except Exception as e:
         logger.error(f"Error in db_mark_subscription_expired : {str(e)}")
@@ -638,6 +987,7 @@ async def db_mark_subscription_paused(
             paddle_subscription_id,
             user_id,
         )
+        await _schedule_expiries([result])
         return result or None, None
     except Exception as e:
         logger.error(f"Error in db_mark_subscription_paused  : {str(e)}")
@@ -663,6 +1013,7 @@ async def db_update_subscription(
             paddle_subscription_id,
             user_id,
         )
+        await _schedule_expiries([result])
         return result or None, None
     except Exception as e:
         logger.error(f"Error in db_update_subscription : {str(e)}")
@@ -682,6 +1033,7 @@ async def db_update_server_sftp(
             sftp_password,
             server_id,
         )
+        await _cache_servers([result])
         return result or None, None
     except Exception as e:
         logger.error(f"Error in db_update_server_sftp  : {str(e)}")
@@ -697,6 +1049,144 @@ async def db_select_all_baremetals() -> Tuple[List[Record], Optional[str]]:
         return [], f"Database error: {str(e)}"
 
 
+async def db_reserve_baremetal_capacity_on_host(
+    baremetal_id: str, ram_gb: float
+) -> Tuple[Optional[Record], Optional[str]]:
+    """Reserve RAM on one specific baremetal if it still has room"""
+    try:
+        if not baremetal_id:
+            return None, "Baremetal ID is required"
+        result = await execute_query(
+            QUERY_TYPE.FETCHROW, "ReserveBaremetalCapacityOnHost", ram_gb, baremetal_id
+        )
+        return result or None, None
+    except Exception as e:
+        logger.error(f"Error in db_reserve_baremetal_capacity_on_host : {str(e)}")
+        return None, f"Database error: {str(e)}"
+
+
+async def db_select_baremetal_capacity() -> Tuple[List[Record], Optional[str]]:
+    """Active baremetals with RAM, CPU and storage usage for the placement index"""
+    try:
+        result = await execute_query(QUERY_TYPE.FETCH, "SelectBaremetalCapacity")
+        return result or [], None
+    except Exception as e:
+        logger.error(f"Error in db_select_baremetal_capacity : {str(e)}")
+        return [], f"Database error: {str(e)}"
+
+
+async def db_release_baremetal_capacity(
+    baremetal_id: str, ram_gb: float
+) -> Tuple[Optional[Record], Optional[str]]:
+    """Give back RAM reserved on a baremetal that never got a server"""
+    try:
+        if not baremetal_id:
+            return None, "Baremetal ID is required"
+        result = await execute_query(
+            QUERY_TYPE.FETCHROW, "ReleaseBaremetalCapacity", ram_gb, baremetal_id
+        )
+        return result or None, None
+    except Exception as e:
+        logger.error(f"Error in db_release_baremetal_capacity : {str(e)}")
+        return None, f"Database error: {str(e)}"
+
+
+async def db_commit_server_placements(
+    placements: List[cdata.ServerPlacement],
+) -> Tuple[cdata.PlacementCommit, Optional[str]]:
+    """Reserve capacity and insert servers for a batch of placements in one transaction.
+
+    Capacity is reserved per host: a host without room for everything placed
+    on it reserves nothing, and its placements are left out. Placements whose
+    subscription already has a server, or no longer exists, are not inserted
+    and their capacity is given back before the commit.
+    """
+    try:
+        if not placements:
+            return cdata.PlacementCommit(), None
+        async with get_db_connection() as conn:
+            async with conn.transaction():
+                reserved = await _execute_named(
+                    conn,
+                    QUERY_TYPE.FETCH,
+                    "ReserveBaremetalCapacityBatch",
+                    [p.baremetal_id for p in placements],
+                    [p.ram_gb for p in placements],
+                )
+                baremetals = {str(host.get("id")): host for host in reserved}
+                accepted = [p for p in placements if p.baremetal_id in baremetals]
+                if not accepted:
+                    return cdata.PlacementCommit(), None
+
+                servers = await _execute_named(
+                    conn,
+                    QUERY_TYPE.FETCH,
+                    "InsertProvisioningServers",
+                    [p.subscription_id for p in accepted],
+                    [p.ip_address for p in accepted],
+                    [p.config for p in accepted],
+                    [p.baremetal_id for p in accepted],
+                )
+                inserted = {str(server.get("subscription_id")) for server in servers}
+                skipped = [p for p in accepted if p.subscription_id not in inserted]
+                if skipped:
+                    released = await _execute_named(
+                        conn,
+                        QUERY_TYPE.FETCH,
+                        "ReleaseBaremetalCapacityBatch",
+                        [p.baremetal_id for p in skipped],
+                        [p.ram_gb for p in skipped],
+                    )
+                    baremetals.update({str(host.get("id")): host for host in released})
+        await _cache_servers(servers)
+        return cdata.PlacementCommit(servers=servers, baremetals=baremetals), None
+    except Exception as e:
+        logger.error(f"Error in db_commit_server_placements : {str(e)}")
+        return cdata.PlacementCommit(), f"Database error: {str(e)}"
+
+
+async def db_release_server_capacity(
+    subscription_id: str,
+) -> Tuple[Optional[Record], Optional[str]]:
+    """Release the capacity a subscription's server holds on its baremetal.
+
+    The server is detached from the baremetal in the same statement, so
+    releasing twice is a no-op.
+    """
+    try:
+        if not subscription_id:
+            return None, "Subscription ID is required"
+        result = await execute_query(
+            QUERY_TYPE.FETCHROW, "ReleaseServerCapacity", subscription_id
+        )
+        await _uncache_servers(str(subscription_id))
+        return result or None, None
+    except Exception as e:
+        logger.error(f"Error in db_release_server_capacity : {str(e)}")
+        return None, f"Database error: {str(e)}"
+
+
+async def db_attach_server_capacity(
+    subscription_id: str,
+) -> Tuple[Optional[Record], Optional[str]]:
+    """Reserve a detached server's capacity on the host at its IP again.
+
+    Returns the baremetal row, or None if the server is not detached or
+    the host is inactive or has no room for its plan.
+    """
+    try:
+        if not subscription_id:
+            return None, "Subscription ID is required"
+        result = await execute_query(
+            QUERY_TYPE.FETCHROW, "AttachServerCapacity", subscription_id
+        )
+        await _uncache_servers(str(subscription_id))
+        return result or None, None
+    except Exception as e:
+        logger.error(f"Error in db_attach_server_capacity : {str(e)}")
+        return None, f"Database error: {str(e)}"
+
+
 async def db_update_server_config(
     config: str, server_id: str
 ) -> Tuple[Optional[Record], Optional[str]]:
@@ -709,12 +1199,393 @@ async def db_update_server_config(
             config,
             server_id,
         )
+        await _cache_servers([result])
         return result or None, None
     except Exception as e:
         logger.error(f"Error in db_update_server_config  : {str(e)}")
         return None, f"Database error: {str(e)}"
 
 
+# BULK OPERATIONS
+async def _copy_records(table: str, records: List[Dict[str, Any]]) -> int:
+    """COPY dict records into `table` in one transaction and return the row count.
+
+    Every record must have the same keys; columns left out get their defaults.
+    """
+    columns = list(records[0])
+    if any(set(record) != set(columns) for record in records):
+        raise ValueError(f"All {table} records must have the same columns")
+    async with get_db_connection() as conn:
+        async with conn.transaction():
+            status = await conn.copy_records_to_table(
+                table,
+                records=[
+                    tuple(record[column] for column in columns) for record in records
+                ],
+                columns=columns,
+            )
+    # Command tag is "COPY <n>"
+    return int(status.rsplit(" ", 1)[-1])
+
+
+async def db_bulk_insert_baremetals(
+    records: List[Dict[str, Any]],
+) -> Tuple[int, Optional[str]]:
+    """Insert many baremetal hosts with COPY, e.g. when seeding a region"""
+    try:
+        if not records:
+            return 0, None
+        return await _copy_records("baremetal", records), None
+    except Exception as e:
+        logger.error(f"Error in db_bulk_insert_baremetals : {str(e)}")
+        return 0, f"Database error: {str(e)}"
+
+
+async def db_bulk_insert_servers(
+    records: List[Dict[str, Any]],
+) -> Tuple[int, Optional[str]]:
+    """Insert many servers with COPY"""
+    try:
+        if not records:
+            return 0, None
+        copied = await _copy_records("servers", records)
+        await _uncache_servers(*(str(record["subscription_id"]) for record in records))
+        return copied, None
+    except Exception as e:
+        logger.error(f"Error in db_bulk_insert_servers : {str(e)}")
+        return 0, f"Database error: {str(e)}"
+
+
+async def db_bulk_insert_transactions(
+    records: List[Dict[str, Any]],
+) -> Tuple[int, Optional[str]]:
+    """Insert many transactions with COPY, e.g. when backfilling payments"""
+    try:
+        if not records:
+            return 0, None
+        return await _copy_records("transactions", records), None
+    except Exception as e:
+        logger.error(f"Error in db_bulk_insert_transactions : {str(e)}")
+        return 0, f"Database error: {str(e)}"
+
+
+async def db_bulk_insert_subscriptions_with_payment(
+    subscriptions: List[Tuple],
+) -> Tuple[int, Optional[str]]:
+    """Insert many paid subscriptions with one executemany in a single transaction.
+
+    Each tuple holds the InsertSubscriptionWithPayment arguments: user_id,
+    plan_id, status, paddle_subscription_id, paddle_customer_id, expires_at,
+    next_billing_date, is_trial. The rows are not returned, so they enter
+    the expiry schedule on its next backfill.
+    """
+    try:
+        if not subscriptions:
+            return 0, None
+        await execute_query(
+            QUERY_TYPE.EXECUTEMANY,
+            "InsertSubscriptionWithPayment",
+            subscriptions,
+            use_transaction=True,
+        )
+        return len(subscriptions), None
+    except Exception as e:
+        logger.error(f"Error in db_bulk_insert_subscriptions_with_payment : {str(e)}")
+        return 0, f"Database error: {str(e)}"
+
+
+async def db_fail_command_servers(
+    commands: List[Mapping[str, Any]],
+) -> Tuple[cdata.FailedServers, Optional[str]]:
+    """Mark failed the servers of commands that failed or timed out.
+
+    Takes the commands' tracked fields. A server is only marked failed
+    while it is still in the status its command set, so a server the agent
+    has since reported on keeps that status. The servers marked failed
+    release their baremetal capacity in the same transaction, as a failed
+    report does.
+    """
+    try:
+        expected = {
+            str(command.get("subscription_id")): COMMAND_SERVER_STATUS[
+                command.get("type")
+            ]
+            for command in commands
+            if command.get("type") in COMMAND_SERVER_STATUS
+        }
+        if not expected:
+            return cdata.FailedServers(), None
+        async with get_db_connection() as conn:
+            async with conn.transaction():
+                servers = await _execute_named(
+                    conn,
+                    QUERY_TYPE.FETCH,
+                    "FailServersInStatusBatch",
+                    list(expected.keys()),
+                    list(expected.values()),
+                )
+                failed = [str(server.get("subscription_id")) for server in servers]
+                released = []
+                if failed:
+                    released = await _execute_named(
+                        conn, QUERY_TYPE.FETCH, "ReleaseServerCapacityBatch", failed
+                    )
+        await _uncache_servers(*failed)
+        return cdata.FailedServers(servers=servers, released=released), None
+    except Exception as e:
+        logger.error(f"Error in db_fail_command_servers : {str(e)}")
+        return cdata.FailedServers(), f"Database error: {str(e)}"
+
+
+async def db_bulk_update_server_status(
+    updates: List[Tuple[str, str, Optional[str], Optional[str]]],
+) -> Tuple[List[Record], Optional[str]]:
+    """Set the status of many servers in one UPDATE.
+
+    Each tuple is (subscription_id, status, docker_container_id, ports as
+    JSON); a None status, container id or ports keeps the current value.
+    Give each subscription at most once.
+    """
+    try:
+        if not updates:
+            return [], None
+        subscription_ids, statuses, container_ids, ports = map(
+            list, zip(*updates, strict=True)
+        )
+        result = await execute_query(
+            QUERY_TYPE.FETCH,
+            "UpdateServerStatusBatch",
+            subscription_ids,
+            statuses,
+            container_ids,
+            ports,
+        )
+        await _cache_servers(result or [])
+        return result or [], None
+    except Exception as e:
+        logger.error(f"Error in db_bulk_update_server_status : {str(e)}")
+        return [], f"Database error: {str(e)}"
+
+
+async def db_bulk_update_server_sftp(
+    updates: List[Tuple[str, str, str]],
+) -> Tuple[List[Record], Optional[str]]:
+    """Set SFTP credentials of many servers in one UPDATE.
+
+    Each tuple is (subscription_id, sftp_username, sftp_password).
+    """
+    try:
+        if not updates:
+            return [], None
+        subscription_ids, usernames, passwords = map(list, zip(*updates, strict=True))
+        result = await execute_query(
+            QUERY_TYPE.FETCH,
+            "UpdateServerSftpBatch",
+            subscription_ids,
+            usernames,
+            passwords,
+        )
+        await _cache_servers(result or [])
+        return result or [], None
+    except Exception as e:
+        logger.error(f"Error in db_bulk_update_server_sftp : {str(e)}")
+        return [], f"Database error: {str(e)}"
+
+
+async def db_bulk_update_subscription_internal_status(
+    updates: List[Tuple[str, str]],
+) -> Tuple[List[Record], Optional[str]]:
+    """Set the internal status of many subscriptions in one UPDATE.
+
+    Each tuple is (subscription_id, internal_status).
+    """
+    try:
+        if not updates:
+            return [], None
+        subscription_ids, statuses = map(list, zip(*updates, strict=True))
+        result = await execute_query(
+            QUERY_TYPE.FETCH,
+            "UpdateSubscriptionInternalStatusBatch",
+            subscription_ids,
+            statuses,
+        )
+        return result or [], None
+    except Exception as e:
+        logger.error(f"Error in db_bulk_update_subscription_internal_status : {str(e)}")
+        return [], f"Database error: {str(e)}"
+
+
+async def db_bulk_update_baremetal_status(
+    updates: List[Tuple[str, str]],
+) -> Tuple[List[Record], Optional[str]]:
+    """Set the status of many baremetals in one UPDATE and stamp their health check.
+
+    Each tuple is (baremetal_id, status).
+    """
+    try:
+        if not updates:
+            return [], None
+        baremetal_ids, statuses = map(list, zip(*updates, strict=True))
+        result = await execute_query(
+            QUERY_TYPE.FETCH,
+            "UpdateBaremetalStatusBatch",
+            baremetal_ids,
+            statuses,
+        )
+        return result or [], None
+    except Exception as e:
+        logger.error(f"Error in db_bulk_update_baremetal_status : {str(e)}")
+        return [], f"Database error: {str(e)}"
+
+
+async def db_ping() -> Tuple[bool, Optional[str]]:
+    """Whether the database answers a trivial query."""
+    try:
+        async with get_db_connection() as conn:
+            await conn.execute("SELECT 1")
+        return True, None
+    except Exception as e:
+        return False, f"Database error: {str(e)}"
+
+
+async def db_apply_server_reports(
+    reports: List[cdata.ServerReport],
+) -> Tuple[List[Record], Optional[str]]:
+    """Apply a batch of server reports in one transaction.
+
+    Give each subscription at most once. Subscriptions without a server are
+    skipped. Returns the baremetal rows whose capacity was released.
+    """
+    try:
+        if not reports:
+            return [], None
+        async with get_db_connection() as conn:
+            async with conn.transaction():
+                servers = await _execute_named(
+                    conn,
+                    QUERY_TYPE.FETCH,
+                    "UpdateServerStatusBatch",
+                    [r.subscription_id for r in reports],
+                    [r.status for r in reports],
+                    [r.docker_container_id for r in reports],
+                    [r.ports for r in reports],
+                )
+                found = {str(server.get("subscription_id")) for server in servers}
+                reports = [r for r in reports if r.subscription_id in found]
+
+                sftp = [r for r in reports if r.sftp is not None]
+                if sftp:
+                    servers += await _execute_named(
+                        conn,
+                        QUERY_TYPE.FETCH,
+                        "UpdateServerSftpBatch",
+                        [r.subscription_id for r in sftp],
+                        [r.sftp[0] for r in sftp],
+                        [r.sftp[1] for r in sftp],
+                    )
+
+                internal = [r for r in reports if r.internal_status is not None]
+                if internal:
+                    await _execute_named(
+                        conn,
+                        QUERY_TYPE.FETCH,
+                        "UpdateSubscriptionInternalStatusBatch",
+                        [r.subscription_id for r in internal],
+                        [r.internal_status for r in internal],
+                    )
+
+                released = []
+                freeing = [r.subscription_id for r in reports if r.releases_capacity]
+                if freeing:
+                    released = await _execute_named(
+                        conn, QUERY_TYPE.FETCH, "ReleaseServerCapacityBatch", freeing
+                    )
+        # Later rows of a server are newer; released servers lost their baremetal
+        latest = {str(server.get("subscription_id")): server for server in servers}
+        for subscription_id in freeing:
+            latest.pop(subscription_id, None)
+        await _cache_servers(list(latest.values()))
+        await _uncache_servers(*freeing)
+        return released, None
+    except Exception as e:
+        logger.error(f"Error in db_apply_server_reports : {str(e)}")
+        return [], f"Database error: {str(e)}"
+
+
+async def db_schedule_subscription_expiries(
+    subscription_ids: Optional[List[str]] = None,
+) -> Tuple[int, Optional[str]]:
+    """Index subscriptions in the expiry schedule from their current rows.
+
+    With no ids, indexes every active subscription that expires; run it
+    periodically to pick up rows whose write did not reach the schedule.
+    Returns the number of rows read.
+    """
+    try:
+        if subscription_ids is None:
+            result = await execute_query(
+                QUERY_TYPE.FETCH, "SelectActiveSubscriptionExpiries"
+            )
+        elif subscription_ids:
+            result = await execute_query(
+                QUERY_TYPE.FETCH, "SelectSubscriptionExpiries", subscription_ids
+            )
+        else:
+            return 0, None
+        await EXPIRY_SCHEDULE.schedule(await get_redis_client(), result or [])
+        return len(result or []), None
+    except Exception as e:
+        logger.error(f"Error in db_schedule_subscription_expiries : {str(e)}")
+        return 0, f"Database error: {str(e)}"
+
+
+async def db_expire_subscriptions(
+    subscription_ids: List[str],
+) -> Tuple[cdata.ExpiredSubscriptions, Optional[str]]:
+    """Expire the given subscriptions that are past due, in one transaction.
+
+    Subscriptions renewed or no longer active are left alone. The servers
+    of the expired ones are set to stopping and detached from their
+    baremetal, releasing its capacity.
+    """
+    try:
+        if not subscription_ids:
+            return cdata.ExpiredSubscriptions(), None
+        servers, released = [], []
+        async with get_db_connection() as conn:
+            async with conn.transaction():
+                subscriptions = await _execute_named(
+                    conn,
+                    QUERY_TYPE.FETCH,
+                    "ExpireSubscriptionsBatch",
+                    subscription_ids,
+                    EXPIRY_SCHEDULE.grace_ms / 1000,
+                )
+                expired = [str(row.get("id")) for row in subscriptions]
+                if expired:
+                    servers = await _execute_named(
+                        conn, QUERY_TYPE.FETCH, "StopServersBatch", expired
+                    )
+                    released = await _execute_named(
+                        conn, QUERY_TYPE.FETCH, "ReleaseServerCapacityBatch", expired
+                    )
+        await _uncache_servers(*expired)
+        return cdata.ExpiredSubscriptions(subscriptions, servers, released), None
+    except Exception as e:
+        logger.error(f"Error in db_expire_subscriptions : {str(e)}")
+        return cdata.ExpiredSubscriptions(), f"Database error: {str(e)}"
+
+
+async def db_listen_catalog_invalidations() -> None:
+    """Keep this process's catalog cache in sync with invalidations from any process"""
+    await CATALOG_CACHE.listen(await get_redis_client())
+
+
+async def db_invalidate_catalog() -> None:
+    """Drop cached games and plans in every process, e.g. after editing the catalog"""
+    await CATALOG_CACHE.invalidate(await get_redis_client())
+
+
 # DATABASE INITIALIZATION
 async def initialize_database():
     """Initialize database with all tables"""
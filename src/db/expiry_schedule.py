@@ -0,0 +1,98 @@
+"""
+Redis index of when subscriptions expire.
+
+    subscriptions:expiry          ZSET of subscription ids, scored by when
+                                  they are due for expiry, in ms
+    subscriptions:expiry:claimed  ZSET of ids a sweep is expiring, scored by
+                                  when the claim lapses, in ms
+
+Writes in the db layer index every subscription row they return, and a
+periodic backfill indexes any that were missed, so a sweep reads only the
+subscriptions that are due instead of scanning the table. Trials are due
+when they expire; paid subscriptions `grace` seconds later, which leaves
+time for a late renewal webhook.
+
+A sweep claims due ids in batches and acknowledges them once handled. A
+claim lapses after `claim_ttl` seconds and is handed out again, so ids
+claimed by a process that died are not lost.
+"""
+
+from typing import Any, Iterable, List, Mapping, Optional
+
+from redis.asyncio import Redis
+
+EXPIRY_KEY = "subscriptions:expiry"
+EXPIRY_CLAIMED_KEY = "subscriptions:expiry:claimed"
+
+# KEYS: schedule, claimed; ARGV: batch size, claim ttl ms.
+# Hands out lapsed claims first, then due ids, and claims them all.
+_CLAIM_SCRIPT = """
+local now = redis.call('TIME')
+local now_ms = tonumber(now[1]) * 1000 + math.floor(tonumber(now[2]) / 1000)
+local limit = tonumber(ARGV[1])
+local ids = redis.call('ZRANGEBYSCORE', KEYS[2], '-inf', now_ms, 'LIMIT', 0, limit)
+if #ids < limit then
+    local due = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', now_ms, 'LIMIT', 0, limit - #ids)
+    if #due > 0 then
+        redis.call('ZREM', KEYS[1], unpack(due))
+        for _, id in ipairs(due) do
+            ids[#ids + 1] = id
+        end
+    end
+end
+for _, id in ipairs(ids) do
+    redis.call('ZADD', KEYS[2], now_ms + tonumber(ARGV[2]), id)
+end
+return ids
+"""
+
+
+class ExpirySchedule:
+    """Sorted-set index of subscription expiry times with claimable batches."""
+
+    def __init__(self, grace: float = 0, claim_ttl: float = 300) -> None:
+        self.grace_ms = int(grace * 1000)
+        self.claim_ttl_ms = int(claim_ttl * 1000)
+
+    def due_at(self, row: Mapping[str, Any]) -> Optional[int]:
+        """When a subscription row is due for expiry in ms, None if it never is."""
+        expires_at = row.get("expires_at")
+        if expires_at is None or row.get("status", "active") != "active":
+            return None
+        due_ms = int(expires_at.timestamp() * 1000)
+        return due_ms if row.get("is_trial") else due_ms + self.grace_ms
+
+    async def schedule(
+        self, redis_client: Redis, rows: Iterable[Mapping[str, Any]]
+    ) -> None:
+        """Index subscription rows by when they are due, in one round trip.
+
+        Rows that are no longer active, or have no expiry, are dropped from
+        the index.
+        """
+        due, dropped = {}, []
+        for row in rows:
+            subscription_id = str(row.get("id"))
+            due_ms = self.due_at(row)
+            if due_ms is None:
+                dropped.append(subscription_id)
+            else:
+                due[subscription_id] = due_ms
+        pipe = redis_client.pipeline(transaction=False)
+        if due:
+            pipe.zadd(EXPIRY_KEY, due)
+        if dropped:
+            pipe.zrem(EXPIRY_KEY, *dropped)
+        if pipe.command_stack:
+            await pipe.execute()
+
+    async def claim(self, redis_client: Redis, limit: int) -> List[str]:
+        """Claim up to `limit` due subscription ids, lapsed claims first."""
+        return await redis_client.eval(
+            _CLAIM_SCRIPT, 2, EXPIRY_KEY, EXPIRY_CLAIMED_KEY, limit, self.claim_ttl_ms
+        )
+
+    async def ack(self, redis_client: Redis, subscription_ids: List[str]) -> None:
+        """Release claims on ids that have been handled."""
+        if subscription_ids:
+            await redis_client.zrem(EXPIRY_CLAIMED_KEY, *subscription_ids)
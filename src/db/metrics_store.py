@@ -0,0 +1,199 @@
+"""
+Container metrics kept in Redis.
+
+The latest sample of each server lives in a hash for O(1) reads. Every
+sample is also appended to a RedisTimeSeries series per metric (built
+into Redis 8, or the RedisTimeSeries module), which Redis downsamples into
+1-minute and 1-hour averages with their own retention. Without
+RedisTimeSeries only the latest sample is kept.
+
+    metrics:latest:{subscription_id}             hash of the latest sample
+    metrics:ts:{subscription_id}:{metric}        raw samples
+    metrics:ts:{subscription_id}:{metric}:1m     1-minute averages
+    metrics:ts:{subscription_id}:{metric}:1h     1-hour averages
+"""
+
+import logging
+import os
+import time
+from typing import Any, Dict, List, Mapping, Optional, Tuple
+
+from redis.asyncio import Redis
+from redis.exceptions import ResponseError
+
+from db import db
+from db.server_events import publish_server_event
+
+# Metrics an agent may report, named like the servers table columns
+METRICS = (
+    "cpu_usage_percent",
+    "memory_usage_mb",
+    "memory_usage_percent",
+    "storage_usage_gb",
+)
+
+HOUR_MS = 60 * 60 * 1000
+# resolution: (bucket size in ms, retention in ms); 0 means raw samples
+RESOLUTIONS: Dict[str, Tuple[int, int]] = {
+    "raw": (0, int(os.getenv("METRICS_RAW_RETENTION_HOURS", 24)) * HOUR_MS),
+    "1m": (60 * 1000, int(os.getenv("METRICS_1M_RETENTION_HOURS", 7 * 24)) * HOUR_MS),
+    "1h": (HOUR_MS, int(os.getenv("METRICS_1H_RETENTION_HOURS", 90 * 24)) * HOUR_MS),
+}
+# A server that stops reporting has no latest sample after this long
+LATEST_TTL_SECONDS = int(os.getenv("METRICS_LATEST_TTL_SECONDS", 600))
+
+
+def latest_key(subscription_id: str) -> str:
+    return f"metrics:latest:{subscription_id}"
+
+
+def series_key(subscription_id: str, metric: str, resolution: str = "raw") -> str:
+    key = f"metrics:ts:{subscription_id}:{metric}"
+    return key if resolution == "raw" else f"{key}:{resolution}"
+
+
+def parse_sample(metrics: Mapping[str, Any]) -> Dict[str, float]:
+    """The known numeric metrics of a report's `metrics` payload."""
+    sample = {}
+    for metric in METRICS:
+        value = metrics.get(metric)
+        if isinstance(value, bool):
+            continue
+        try:
+            sample[metric] = float(value)
+        except (TypeError, ValueError):
+            continue
+    return sample
+
+
+class MetricsStore:
+    """Writes samples to, and reads them back from, Redis."""
+
+    # Subscriptions whose series and rollup rules this process has created
+    _series_ready: set[str] = set()
+    # Flipped off the first time Redis rejects a TS.* command
+    _timeseries_enabled: bool = os.getenv("METRICS_TIMESERIES", "1") != "0"
+
+    def __init__(self) -> None:
+        self.logger = logging.getLogger("backendlogger")
+
+    async def _client(self) -> Redis:
+        return await db.get_redis_client()
+
+    async def record(self, subscription_id: str, metrics: Mapping[str, Any]) -> bool:
+        """Store and publish a sample in one pipeline.
+
+        Returns False if it had no known metric.
+        """
+        sample = parse_sample(metrics)
+        if not sample:
+            return False
+        now_ms = int(time.time() * 1000)
+        if self._timeseries_enabled and subscription_id not in self._series_ready:
+            await self._create_series(subscription_id)
+
+        redis_client = await self._client()
+        pipe = redis_client.pipeline(transaction=False)
+        pipe.hset(latest_key(subscription_id), mapping={**sample, "timestamp": now_ms})
+        pipe.expire(latest_key(subscription_id), LATEST_TTL_SECONDS)
+        publish_server_event(pipe, subscription_id, "metrics", **sample)
+        if self._timeseries_enabled:
+            arguments: List[Any] = []
+            for metric, value in sample.items():
+                arguments += [series_key(subscription_id, metric), now_ms, value]
+            pipe.execute_command("TS.MADD", *arguments)
+        try:
+            await pipe.execute()
+        except ResponseError as e:
+            self._disable_timeseries(e)
+        return True
+
+    async def _create_series(self, subscription_id: str) -> None:
+        """Create the raw and rollup series with their compaction rules."""
+        redis_client = await self._client()
+        pipe = redis_client.pipeline(transaction=False)
+        for metric in METRICS:
+            for resolution, (_, retention) in RESOLUTIONS.items():
+                pipe.execute_command(
+                    "TS.CREATE",
+                    series_key(subscription_id, metric, resolution),
+                    "RETENTION",
+                    retention,
+                    "DUPLICATE_POLICY",
+                    "LAST",
+                    "LABELS",
+                    "subscription_id",
+                    subscription_id,
+                    "metric",
+                    metric,
+                    "resolution",
+                    resolution,
+                )
+            for resolution, (bucket, _) in RESOLUTIONS.items():
+                if bucket:
+                    pipe.execute_command(
+                        "TS.CREATERULE",
+                        series_key(subscription_id, metric),
+                        series_key(subscription_id, metric, resolution),
+                        "AGGREGATION",
+                        "avg",
+                        bucket,
+                    )
+        for result in await pipe.execute(raise_on_error=False):
+            # Series and rules made by another process or an earlier run
+            if isinstance(result, ResponseError) and "already" not in str(result):
+                self._disable_timeseries(result)
+                return
+        self._series_ready.add(subscription_id)
+
+    def _disable_timeseries(self, error: ResponseError) -> None:
+        if MetricsStore._timeseries_enabled:
+            self.logger.warning(
+                f"RedisTimeSeries unavailable, keeping only the latest metrics: {error}"
+            )
+        MetricsStore._timeseries_enabled = False
+
+    async def latest(self, subscription_id: str) -> Optional[Dict[str, float]]:
+        """The latest sample, with its `timestamp` in ms, or None if there is none."""
+        redis_client = await self._client()
+        sample = await redis_client.hgetall(latest_key(subscription_id))
+        if not sample:
+            return None
+        return {field: float(value) for field, value in sample.items()}
+
+    async def history(
+        self,
+        subscription_id: str,
+        metric: str,
+        resolution: str = "1m",
+        since_ms: int = HOUR_MS,
+    ) -> List[Tuple[int, float]]:
+        """(timestamp ms, value) points of one metric over the last `since_ms`."""
+        if not self._timeseries_enabled or resolution not in RESOLUTIONS:
+            return []
+        redis_client = await self._client()
+        now_ms = int(time.time() * 1000)
+        try:
+            points = await redis_client.execute_command(
+                "TS.RANGE",
+                series_key(subscription_id, metric, resolution),
+                now_ms - since_ms,
+                now_ms,
+            )
+        except ResponseError as e:
+            # The series does not exist until the first sample arrives
+            if "key does not exist" not in str(e).lower():
+                self.logger.warning(f"Unable to read {metric} history: {e}")
+            return []
+        return [(int(timestamp), float(value)) for timestamp, value in points]
+
+
+_store: Optional[MetricsStore] = None
+
+
+def get_metrics_store() -> MetricsStore:
+    """Process-wide metrics store shared by the report handler and the panel."""
+    global _store
+    if _store is None:
+        _store = MetricsStore()
+    return _store
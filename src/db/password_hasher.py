@@ -0,0 +1,84 @@
+"""
+bcrypt hashing off the event loop.
+
+bcrypt is deliberately slow (100-300 ms per call) and releases the GIL
+while it works, so hashes run on a small dedicated thread pool. The pool
+admits at most `max_pending` calls, running or waiting; beyond that
+callers get `PasswordHasherBusy` straight away so the route can answer 503
+instead of piling up work.
+"""
+
+import asyncio
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Tuple, TypeVar
+
+import bcrypt
+
+import helper_classes.custom_dataclass as cdata
+
+T = TypeVar("T")
+
+
+class PasswordHasherBusy(Exception):
+    """Raised when the hashing pool already has `max_pending` calls."""
+
+
+class PasswordHasher:
+    """Bounded thread pool for bcrypt with wait and hash time statistics."""
+
+    def __init__(self, workers: int = 2, max_pending: int = 32) -> None:
+        self.logger = logging.getLogger("backendlogger")
+        self.workers = workers
+        self.max_pending = max_pending
+        self.stats = cdata.PasswordHashStats()
+        self._pending = 0
+        self._executor = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix="bcrypt"
+        )
+
+    @property
+    def pending(self) -> int:
+        """Calls running or waiting for a worker."""
+        return self._pending
+
+    async def hash(self, password: str) -> str:
+        return await self._run(
+            lambda: bcrypt.hashpw(password.encode("utf-8"), bcrypt.gensalt()).decode(
+                "utf-8"
+            )
+        )
+
+    async def verify(self, password: str, hashed: str) -> bool:
+        return await self._run(
+            lambda: bcrypt.checkpw(password.encode("utf-8"), hashed.encode("utf-8"))
+        )
+
+    async def _run(self, work: Callable[[], T]) -> T:
+        if self._pending >= self.max_pending:
+            self.stats.rejected += 1
+            raise PasswordHasherBusy(f"{self._pending} password hashes already pending")
+        self._pending += 1
+        queued_at = time.perf_counter()
+
+        def timed() -> Tuple[T, float, float]:
+            started_at = time.perf_counter()
+            result = work()
+            return result, started_at, time.perf_counter()
+
+        loop = asyncio.get_running_loop()
+        try:
+            result, started_at, finished_at = await loop.run_in_executor(
+                self._executor, timed
+            )
+        finally:
+            self._pending -= 1
+        self.stats.record(
+            wait_ms=(started_at - queued_at) * 1000,
+            hash_ms=(finished_at - started_at) * 1000,
+        )
+        return result
+
+    def shutdown(self) -> None:
+        self._executor.shutdown(wait=False, cancel_futures=True)
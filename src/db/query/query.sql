@@ -14,8 +14,16 @@ VALUES ($1, $2, $3, $4, $5, $6, $7, $8)
 RETURNING *;
 
 -- name: InsertServer
-INSERT INTO servers (subscription_id, status, ip_address, ports, docker_container_id, config)
-VALUES ($1, $2, $3, $4, $5, $6)
+INSERT INTO servers (subscription_id, status, ip_address, ports, docker_container_id, config, baremetal_id)
+VALUES ($1, $2, $3, $4, $5, $6, $7)
+RETURNING *;
+
+-- name: InsertProvisioningServers
+INSERT INTO servers (subscription_id, status, ip_address, ports, docker_container_id, config, baremetal_id)
+SELECT o.subscription_id, 'provisioning', o.ip_address::inet, '{}'::jsonb, '-', o.config::jsonb, o.baremetal_id
+FROM UNNEST($1::uuid[], $2::text[], $3::text[], $4::uuid[]) AS o(subscription_id, ip_address, config, baremetal_id)
+JOIN subscriptions sub ON sub.id = o.subscription_id
+ON CONFLICT (subscription_id) DO NOTHING
 RETURNING *;
 
 -- name: InsertTransaction
@@ -39,6 +47,129 @@ FROM baremetal
 WHERE status = 'active'
 ORDER BY capacity_used ASC;
 
+-- name: ReserveBaremetalCapacityOnHost
+UPDATE baremetal
+SET capacity_used = capacity_used + $1,
+    updated_at = NOW()
+WHERE id = $2 AND status = 'active' AND capacity_total - capacity_used >= $1
+RETURNING id, hostname, ip_address, status, capacity_total, capacity_used;
+
+-- name: SelectBaremetalCapacity
+SELECT b.id, b.hostname, b.ip_address, b.region, b.datacenter,
+       b.capacity_total, b.capacity_used, b.cpu_cores_total, b.storage_gb_total,
+       COALESCE(SUM(c.cpu_cores), 0) AS cpu_cores_used,
+       COALESCE(SUM(c.storage_gb), 0) AS storage_gb_used
+FROM baremetal b
+LEFT JOIN servers s ON s.baremetal_id = b.id
+LEFT JOIN subscriptions sub ON sub.id = s.subscription_id
+LEFT JOIN catalog c ON c.id = sub.plan_id
+WHERE b.status = 'active'
+GROUP BY b.id
+ORDER BY b.hostname;
+
+-- name: ReleaseBaremetalCapacity
+UPDATE baremetal
+SET capacity_used = GREATEST(capacity_used - $1, 0),
+    updated_at = NOW()
+WHERE id = $2
+RETURNING id, hostname, ip_address, status, capacity_total, capacity_used;
+
+-- name: ReleaseServerCapacity
+WITH target AS (
+    SELECT s.id, s.baremetal_id, c.ram_gb
+    FROM servers s
+    JOIN subscriptions sub ON sub.id = s.subscription_id
+    JOIN catalog c ON c.id = sub.plan_id
+    WHERE s.subscription_id = $1 AND s.baremetal_id IS NOT NULL
+    FOR UPDATE OF s
+), detached AS (
+    UPDATE servers
+    SET baremetal_id = NULL
+    FROM target
+    WHERE servers.id = target.id
+)
+UPDATE baremetal b
+SET capacity_used = GREATEST(b.capacity_used - target.ram_gb, 0),
+    updated_at = NOW()
+FROM target
+WHERE b.id = target.baremetal_id
+RETURNING b.id, b.hostname, b.ip_address, b.status, b.capacity_total, b.capacity_used;
+
+-- name: AttachServerCapacity
+WITH target AS (
+    SELECT s.id, s.ip_address, c.ram_gb
+    FROM servers s
+    JOIN subscriptions sub ON sub.id = s.subscription_id
+    JOIN catalog c ON c.id = sub.plan_id
+    WHERE s.subscription_id = $1 AND s.baremetal_id IS NULL
+    FOR UPDATE OF s
+), host AS (
+    UPDATE baremetal b
+    SET capacity_used = b.capacity_used + target.ram_gb,
+        updated_at = NOW()
+    FROM target
+    WHERE b.ip_address = target.ip_address AND b.status = 'active'
+      AND b.capacity_total - b.capacity_used >= target.ram_gb
+    RETURNING b.id, b.hostname, b.ip_address, b.status, b.capacity_total, b.capacity_used
+), attached AS (
+    UPDATE servers
+    SET baremetal_id = host.id
+    FROM target, host
+    WHERE servers.id = target.id
+)
+SELECT * FROM host;
+
+-- name: ReserveBaremetalCapacityBatch
+WITH demand AS (
+    SELECT d.id, SUM(d.ram_gb) AS ram_gb
+    FROM UNNEST($1::uuid[], $2::real[]) AS d(id, ram_gb)
+    GROUP BY d.id
+)
+UPDATE baremetal b
+SET capacity_used = b.capacity_used + demand.ram_gb,
+    updated_at = NOW()
+FROM demand
+WHERE b.id = demand.id AND b.status = 'active' AND b.capacity_total - b.capacity_used >= demand.ram_gb
+RETURNING b.id, b.hostname, b.ip_address, b.status, b.capacity_total, b.capacity_used;
+
+-- name: ReleaseBaremetalCapacityBatch
+WITH demand AS (
+    SELECT d.id, SUM(d.ram_gb) AS ram_gb
+    FROM UNNEST($1::uuid[], $2::real[]) AS d(id, ram_gb)
+    GROUP BY d.id
+)
+UPDATE baremetal b
+SET capacity_used = GREATEST(b.capacity_used - demand.ram_gb, 0),
+    updated_at = NOW()
+FROM demand
+WHERE b.id = demand.id
+RETURNING b.id, b.hostname, b.ip_address, b.status, b.capacity_total, b.capacity_used;
+
+-- name: ReleaseServerCapacityBatch
+WITH target AS (
+    SELECT s.id, s.baremetal_id, c.ram_gb
+    FROM servers s
+    JOIN subscriptions sub ON sub.id = s.subscription_id
+    JOIN catalog c ON c.id = sub.plan_id
+    WHERE s.subscription_id = ANY($1::uuid[]) AND s.baremetal_id IS NOT NULL
+    FOR UPDATE OF s
+), detached AS (
+    UPDATE servers
+    SET baremetal_id = NULL
+    FROM target
+    WHERE servers.id = target.id
+), freed AS (
+    SELECT baremetal_id, SUM(ram_gb) AS ram_gb
+    FROM target
+    GROUP BY baremetal_id
+)
+UPDATE baremetal b
+SET capacity_used = GREATEST(b.capacity_used - freed.ram_gb, 0),
+    updated_at = NOW()
+FROM freed
+WHERE b.id = freed.baremetal_id
+RETURNING b.id, b.hostname, b.ip_address, b.status, b.capacity_total, b.capacity_used;
+
 -- name: SelectAllSubscriptions
 SELECT s.*, c.name as plan_name, c.price_monthly
 FROM subscriptions s
@@ -63,6 +194,11 @@ SELECT *
 FROM catalog
 WHERE id = $1 AND active = true;
 
+-- name: SelectPlansByIds
+SELECT *
+FROM catalog
+WHERE id = ANY($1::uuid[]) AND active = true;
+
 -- name: SelectGameById
 SELECT *
 FROM catalog
@@ -86,6 +222,39 @@ SELECT *
 FROM servers
 WHERE subscription_id = $1;
 
+-- name: SelectServerContextBySubscription
+SELECT s.id AS server_id, s.subscription_id, s.status, s.ip_address, s.ports,
+       s.docker_container_id, s.config, s.baremetal_id, sub.user_id, sub.plan_id,
+       p.ram_gb, p.cpu_cores, g.id AS game_id, g.name AS game_name
+FROM servers s
+JOIN subscriptions sub ON sub.id = s.subscription_id
+JOIN catalog p ON p.id = sub.plan_id
+JOIN catalog g ON g.id = p.parent_id
+WHERE s.subscription_id = $1;
+
+-- name: UpdateServerStatusWithContext
+UPDATE servers s
+SET status = $1,
+    updated_at = NOW()
+FROM subscriptions sub
+JOIN catalog p ON p.id = sub.plan_id
+JOIN catalog g ON g.id = p.parent_id
+WHERE s.subscription_id = $2 AND sub.id = s.subscription_id
+RETURNING s.id AS server_id, s.subscription_id, s.status, s.ip_address, s.ports,
+          s.docker_container_id, s.config, s.baremetal_id, sub.user_id, sub.plan_id,
+          p.ram_gb, p.cpu_cores, g.id AS game_id, g.name AS game_name;
+
+-- name: StopServersBatch
+UPDATE servers s
+SET status = 'stopping',
+    updated_at = NOW()
+FROM subscriptions sub
+JOIN catalog p ON p.id = sub.plan_id
+JOIN catalog g ON g.id = p.parent_id
+WHERE s.subscription_id = ANY($1::uuid[]) AND sub.id = s.subscription_id
+  AND s.status <> 'stopped'
+RETURNING s.subscription_id, s.status, s.ip_address, g.name AS game_name;
+
 -- name: SelectServerById
 SELECT *
 FROM servers
@@ -109,6 +278,25 @@ SELECT *
 FROM subscriptions
 WHERE status = 'active' AND expires_at < NOW();
 
+-- name: SelectActiveSubscriptionExpiries
+SELECT id, status, is_trial, expires_at
+FROM subscriptions
+WHERE status = 'active' AND expires_at IS NOT NULL;
+
+-- name: SelectSubscriptionExpiries
+SELECT id, status, is_trial, expires_at
+FROM subscriptions
+WHERE id = ANY($1::uuid[]);
+
+-- name: ExpireSubscriptionsBatch
+UPDATE subscriptions
+SET status = 'expired',
+    updated_at = NOW()
+WHERE id = ANY($1::uuid[])
+  AND status = 'active'
+  AND expires_at <= NOW() - CASE WHEN is_trial THEN 0 ELSE $2::float8 END * INTERVAL '1 second'
+RETURNING *;
+
 -- name: SelectTransactionsByUser
 SELECT *
 FROM transactions
@@ -116,6 +304,14 @@ WHERE user_id = $1
 ORDER BY created_at DESC
 LIMIT $2 OFFSET $3;
 
+-- name: SelectStaleServers
+SELECT id, subscription_id, baremetal_id, status, ip_address, updated_at
+FROM servers
+WHERE status = ANY($1::server_status[])
+  AND updated_at < NOW() - make_interval(secs => $2)
+ORDER BY updated_at
+LIMIT $3;
+
 -- name: UpdateServerStatus
 UPDATE servers
 SET status = $1,
@@ -124,6 +320,32 @@ SET status = $1,
 WHERE subscription_id = $4
 RETURNING *;
 
+-- name: UpdateServerStatusBatch
+UPDATE servers s
+SET status = COALESCE(u.status::server_status, s.status),
+    docker_container_id = COALESCE(u.docker_container_id, s.docker_container_id),
+    ports = COALESCE(u.ports::jsonb, s.ports)
+FROM UNNEST($1::uuid[], $2::text[], $3::text[], $4::text[]) AS u(subscription_id, status, docker_container_id, ports)
+WHERE s.subscription_id = u.subscription_id
+RETURNING s.*;
+
+-- name: FailServersInStatusBatch
+UPDATE servers s
+SET status = 'failed',
+    updated_at = NOW()
+FROM UNNEST($1::uuid[], $2::text[]) AS u(subscription_id, status)
+WHERE s.subscription_id = u.subscription_id AND s.status = u.status::server_status
+RETURNING s.*;
+
+-- name: UpdateBaremetalStatusBatch
+UPDATE baremetal b
+SET status = u.status::baremetal_status,
+    last_health_check = NOW(),
+    updated_at = NOW()
+FROM UNNEST($1::uuid[], $2::text[]) AS u(id, status)
+WHERE b.id = u.id
+RETURNING b.id, b.hostname, b.ip_address, b.status, b.capacity_total, b.capacity_used;
+
 -- name: UpdateSubscriptionStatus
 UPDATE subscriptions
 SET status = $1
@@ -136,6 +358,13 @@ SET internal_status = $1
 WHERE id = $2
 RETURNING *;
 
+-- name: UpdateSubscriptionInternalStatusBatch
+UPDATE subscriptions s
+SET internal_status = u.internal_status::subscription_internal_status
+FROM UNNEST($1::uuid[], $2::text[]) AS u(id, internal_status)
+WHERE s.id = u.id
+RETURNING s.*;
+
 -- name: UpdateSubscriptionIsTrial
 UPDATE subscriptions
 SET is_trial = $1
@@ -155,6 +384,14 @@ SET sftp_username = $1,
 WHERE id = $3
 RETURNING *;
 
+-- name: UpdateServerSftpBatch
+UPDATE servers s
+SET sftp_username = u.sftp_username,
+    sftp_password = u.sftp_password
+FROM UNNEST($1::uuid[], $2::text[], $3::text[]) AS u(subscription_id, sftp_username, sftp_password)
+WHERE s.subscription_id = u.subscription_id
+RETURNING s.*;
+
 -- name: UpdateSubscription
 UPDATE subscriptions
 SET status = $1,
@@ -111,6 +111,9 @@ CREATE TABLE baremetal (
     -- Resource tracking
     capacity_total   REAL NOT NULL CHECK (capacity_total > 0),
     capacity_used    REAL NOT NULL DEFAULT 0 CHECK (capacity_used >= 0 AND capacity_used <= capacity_total),
+    -- Optional limits for placement; NULL means the dimension is not enforced
+    cpu_cores_total  REAL CHECK (cpu_cores_total IS NULL OR cpu_cores_total > 0),
+    storage_gb_total REAL CHECK (storage_gb_total IS NULL OR storage_gb_total > 0),
 
     -- Metadata
     region           VARCHAR(50),
@@ -162,3 +165,4 @@ CREATE INDEX idx_subscriptions_internal_status ON subscriptions(internal_status)
 CREATE INDEX idx_subscriptions_paddle_id ON subscriptions(paddle_subscription_id) WHERE paddle_subscription_id IS NOT NULL;
 CREATE INDEX idx_subscriptions_expires_at ON subscriptions(expires_at);
 CREATE INDEX idx_subscriptions_user_status ON subscriptions(user_id, status);
+CREATE INDEX idx_servers_baremetal_id ON servers(baremetal_id) WHERE baremetal_id IS NOT NULL;
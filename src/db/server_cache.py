@@ -0,0 +1,191 @@
+"""
+Redis cache of server rows, keyed by subscription.
+
+Dashboards read a server's status, address, ports and config far more often
+than agents change them. Rows are cached as hashes shared by every process:
+
+    server:{subscription_id}       the row, values as strings, None left out
+    server:{subscription_id}:fill  lock held by the process loading the row
+
+Every write in the db layer stores the row it returned (write-through) or
+drops the entry when it has no complete row. Reads fill a missing entry
+only if no write stored one meanwhile, so a slow read never overwrites a
+newer row. A subscription without a server is cached as a short-lived
+negative entry. A burst of misses for one subscription costs one query:
+callers in a process share a single load, and other processes wait briefly
+for the process holding the fill lock.
+"""
+
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict, Iterable, Mapping, Optional
+
+from redis.asyncio import Redis
+from redis.exceptions import RedisError
+
+SERVER_CACHE_PREFIX = "server:"
+# Field marking a cached "no server"
+MISSING_FIELD = "__missing__"
+
+# Store a loaded row unless the entry was written meanwhile
+_FILL_SCRIPT = """
+if redis.call('EXISTS', KEYS[1]) == 1 then
+    return 0
+end
+redis.call('HSET', KEYS[1], unpack(ARGV, 2))
+redis.call('PEXPIRE', KEYS[1], ARGV[1])
+return 1
+"""
+
+# Update some fields of a cached row, leaving missing and negative entries alone
+_PATCH_SCRIPT = """
+if redis.call('EXISTS', KEYS[1]) == 0 or redis.call('HEXISTS', KEYS[1], ARGV[1]) == 1 then
+    return 0
+end
+redis.call('HSET', KEYS[1], unpack(ARGV, 2))
+return 1
+"""
+
+_MISS = object()
+
+
+def cache_key(subscription_id: str) -> str:
+    return f"{SERVER_CACHE_PREFIX}{subscription_id}"
+
+
+def encode_row(row: Mapping[str, Any]) -> Dict[str, str]:
+    """A row as hash fields; None values are left out and read back as None."""
+    return {column: str(value) for column, value in row.items() if value is not None}
+
+
+class CachedServer(dict):
+    """A cached server row. Values are strings; absent columns read as None."""
+
+    def get(self, key: str, default: Any = None) -> Any:
+        value = super().get(key)
+        return default if value is None else value
+
+    def __missing__(self, key: str) -> None:
+        return None
+
+
+class ServerCache:
+    """Write-through cache of server rows with negative caching and single-flight."""
+
+    def __init__(
+        self,
+        ttl: float = 300,
+        negative_ttl: float = 30,
+        lock_ttl: float = 2,
+        lock_wait: float = 0.2,
+    ) -> None:
+        self.logger = logging.getLogger("backendlogger")
+        self.ttl_ms = int(ttl * 1000)
+        self.negative_ttl_ms = int(negative_ttl * 1000)
+        self.lock_ttl_ms = int(lock_ttl * 1000)
+        self.lock_wait = lock_wait
+        self._loads: Dict[str, asyncio.Task] = {}
+
+    async def get(
+        self,
+        redis_client: Redis,
+        subscription_id: str,
+        load: Callable[[], Awaitable[Optional[Mapping[str, Any]]]],
+    ) -> Optional[CachedServer]:
+        """The cached row of a subscription, loading it with `load` on a miss.
+
+        Returns None if the subscription has no server. Errors raised by
+        `load` propagate; Redis errors fall back to `load`.
+        """
+        try:
+            cached = await self._read(redis_client, subscription_id)
+        except RedisError as e:
+            self.logger.warning(f"Server cache unavailable: {e}")
+            row = await load()
+            return CachedServer(encode_row(row)) if row else None
+        if cached is not _MISS:
+            return cached
+
+        task = self._loads.get(subscription_id)
+        if task is None:
+            task = asyncio.ensure_future(
+                self._load(redis_client, subscription_id, load)
+            )
+            self._loads[subscription_id] = task
+            task.add_done_callback(lambda _: self._loads.pop(subscription_id, None))
+        return await asyncio.shield(task)
+
+    async def _read(self, redis_client: Redis, subscription_id: str) -> Any:
+        fields = await redis_client.hgetall(cache_key(subscription_id))
+        if not fields:
+            return _MISS
+        if MISSING_FIELD in fields:
+            return None
+        return CachedServer(fields)
+
+    async def _load(
+        self,
+        redis_client: Redis,
+        subscription_id: str,
+        load: Callable[[], Awaitable[Optional[Mapping[str, Any]]]],
+    ) -> Optional[CachedServer]:
+        key = cache_key(subscription_id)
+        try:
+            locked = await redis_client.set(
+                f"{key}:fill", 1, nx=True, px=self.lock_ttl_ms
+            )
+        except RedisError as e:
+            self.logger.warning(f"Server cache unavailable: {e}")
+            row = await load()
+            return CachedServer(encode_row(row)) if row else None
+        try:
+            if not locked:
+                # Another process is loading the row; give it a moment
+                for _ in range(4):
+                    await asyncio.sleep(self.lock_wait / 4)
+                    cached = await self._read(redis_client, subscription_id)
+                    if cached is not _MISS:
+                        return cached
+
+            row = await load()
+            if row:
+                fields, ttl_ms = encode_row(row), self.ttl_ms
+            else:
+                fields, ttl_ms = {MISSING_FIELD: "1"}, self.negative_ttl_ms
+            try:
+                arguments = [value for field in fields.items() for value in field]
+                await redis_client.eval(_FILL_SCRIPT, 1, key, ttl_ms, *arguments)
+            except RedisError as e:
+                self.logger.warning(f"Unable to cache server {subscription_id}: {e}")
+            return CachedServer(fields) if row else None
+        finally:
+            if locked:
+                await redis_client.delete(f"{key}:fill")
+
+    async def store(
+        self, redis_client: Redis, rows: Iterable[Mapping[str, Any]]
+    ) -> None:
+        """Replace the entries of freshly written rows in one round trip."""
+        pipe = redis_client.pipeline(transaction=True)
+        for row in rows:
+            key = cache_key(str(row.get("subscription_id")))
+            pipe.delete(key)
+            pipe.hset(key, mapping=encode_row(row))
+            pipe.pexpire(key, self.ttl_ms)
+        if pipe.command_stack:
+            await pipe.execute()
+
+    async def patch(
+        self, redis_client: Redis, subscription_id: str, **fields: Any
+    ) -> None:
+        """Update some fields of a cached row, if the row is cached."""
+        arguments = [value for field in encode_row(fields).items() for value in field]
+        if arguments:
+            await redis_client.eval(
+                _PATCH_SCRIPT, 1, cache_key(subscription_id), MISSING_FIELD, *arguments
+            )
+
+    async def invalidate(self, redis_client: Redis, *subscription_ids: str) -> None:
+        """Drop entries, e.g. after a write that returned no complete row."""
+        if subscription_ids:
+            await redis_client.delete(*(cache_key(sid) for sid in subscription_ids))
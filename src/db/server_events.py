@@ -0,0 +1,159 @@
+"""
+Server change events over Redis pub/sub.
+
+Writers publish a small JSON event on `server_events:{subscription_id}`
+whenever a server's state changes, in the same pipeline as the change's
+other Redis commands where there is one. Every app process holds a single
+pub/sub connection, subscribed to the channels of the subscriptions its
+clients are watching, and fans the events out to them:
+
+    {"type": "status", "status": "running", "internal_status": "on"}
+    {"type": "metrics", "cpu_usage_percent": 12.5, "memory_usage_mb": 512.0}
+"""
+
+import asyncio
+import json
+import logging
+import os
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Dict, Optional, Set, Union
+
+from redis.asyncio import Redis
+from redis.asyncio.client import Pipeline
+
+from db import db
+
+SERVER_EVENTS_PREFIX = "server_events:"
+
+
+def events_channel(subscription_id: str) -> str:
+    return f"{SERVER_EVENTS_PREFIX}{subscription_id}"
+
+
+def publish_server_event(
+    redis_client: Union[Redis, Pipeline],
+    subscription_id: str,
+    event_type: str,
+    **data: Any,
+):
+    """Publish an event, or queue its PUBLISH when given a pipeline.
+
+    Returns the publish coroutine for a client, the pipeline otherwise.
+    """
+    return redis_client.publish(
+        events_channel(subscription_id), json.dumps({"type": event_type, **data})
+    )
+
+
+class ServerEventHub:
+    """Fans events from one pub/sub connection out to local watchers.
+
+    A channel is subscribed while at least one watcher needs it. Each
+    watcher has its own bounded queue; when a slow watcher's queue is full
+    its oldest event is dropped, since every event carries current values
+    rather than deltas.
+    """
+
+    def __init__(
+        self, queue_size: int = int(os.getenv("SERVER_EVENTS_QUEUE_SIZE", 64))
+    ) -> None:
+        self.logger = logging.getLogger("backendlogger")
+        self.queue_size = queue_size
+        self._watchers: Dict[str, Set[asyncio.Queue]] = {}
+        self._pubsub = None
+        self._ready = asyncio.Event()
+        self._subscribed = asyncio.Event()
+
+    async def run(self) -> None:
+        """Read events forever, reconnecting and resubscribing on errors."""
+        redis_client = await db.get_redis_client()
+        while True:
+            self._pubsub = redis_client.pubsub(ignore_subscribe_messages=True)
+            try:
+                if self._watchers:
+                    await self._pubsub.subscribe(
+                        *(events_channel(sub) for sub in self._watchers)
+                    )
+                self._ready.set()
+                while True:
+                    if not self._pubsub.subscribed:
+                        # Nothing to read until a watcher subscribes a channel
+                        self._subscribed.clear()
+                        try:
+                            await asyncio.wait_for(self._subscribed.wait(), 1.0)
+                        except asyncio.TimeoutError:
+                            pass
+                        continue
+                    message = await self._pubsub.get_message(
+                        ignore_subscribe_messages=True, timeout=1.0
+                    )
+                    if message and message.get("type") == "message":
+                        self._dispatch(message["channel"], message["data"])
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.logger.error(f"Server event listener failed: {e}")
+                await asyncio.sleep(1)
+            finally:
+                self._ready.clear()
+                await self._pubsub.aclose()
+                self._pubsub = None
+
+    def _dispatch(self, channel: str, data: str) -> None:
+        subscription_id = channel.removeprefix(SERVER_EVENTS_PREFIX)
+        watchers = self._watchers.get(subscription_id)
+        if not watchers:
+            return
+        try:
+            event = json.loads(data)
+        except json.JSONDecodeError:
+            self.logger.warning(f"Undecodable server event on {channel}")
+            return
+        for queue in watchers:
+            if queue.full():
+                queue.get_nowait()
+            queue.put_nowait({**event, "subscription_id": subscription_id})
+
+    @asynccontextmanager
+    async def watch(self, *subscription_ids: str) -> AsyncIterator[asyncio.Queue]:
+        """Yield a queue receiving the events of the given subscriptions.
+
+        Each event is a copy tagged with its `subscription_id`.
+        """
+        queue: asyncio.Queue = asyncio.Queue(maxsize=self.queue_size)
+        new_channels = []
+        for subscription_id in subscription_ids:
+            watchers = self._watchers.setdefault(subscription_id, set())
+            if not watchers:
+                new_channels.append(events_channel(subscription_id))
+            watchers.add(queue)
+        try:
+            # Otherwise `run` subscribes to them when it (re)connects
+            if new_channels and self._ready.is_set():
+                await self._pubsub.subscribe(*new_channels)
+                self._subscribed.set()
+            yield queue
+        finally:
+            gone_channels = []
+            for subscription_id in subscription_ids:
+                watchers = self._watchers.get(subscription_id, set())
+                watchers.discard(queue)
+                if not watchers:
+                    self._watchers.pop(subscription_id, None)
+                    gone_channels.append(events_channel(subscription_id))
+            if gone_channels and self._ready.is_set():
+                try:
+                    await self._pubsub.unsubscribe(*gone_channels)
+                except Exception as e:
+                    self.logger.warning(f"Unable to unsubscribe server events: {e}")
+
+
+_hub: Optional[ServerEventHub] = None
+
+
+def get_server_event_hub() -> ServerEventHub:
+    """Process-wide hub shared by every event stream of this process."""
+    global _hub
+    if _hub is None:
+        _hub = ServerEventHub()
+    return _hub
@@ -0,0 +1,121 @@
+"""
+Leader election over a Redis lock.
+
+Every worker process campaigns for `leader:{name}`; the one holding the
+lock runs the singleton background jobs (e.g. the pending-queue drain)
+and the others stand by. The lock expires `ttl` seconds after its last
+renewal, so if the leader dies another worker takes over within `ttl`.
+"""
+
+import asyncio
+import logging
+import os
+import socket
+import uuid
+from typing import Awaitable, Callable, Dict
+
+from db import db
+
+# Extend the lock only if this process still holds it
+_RENEW_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('PEXPIRE', KEYS[1], ARGV[2])
+end
+return 0
+"""
+
+# Delete the lock only if this process still holds it
+_RELEASE_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+Job = Callable[[], Awaitable[None]]
+
+
+class LeaderElection:
+    """Runs jobs in the one process holding the `leader:{name}` lock.
+
+    The leader renews the lock every `ttl / 3` seconds. If a renewal fails,
+    including when Redis cannot be reached, it can no longer prove it is
+    the only leader, so it cancels its jobs and campaigns again.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        ttl: float = float(os.getenv("LEADER_LOCK_TTL_SECONDS", 15)),
+    ) -> None:
+        self.logger = logging.getLogger("backendlogger")
+        self.key = f"leader:{name}"
+        self.ttl = ttl
+        self.token = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.is_leader = False
+
+    async def acquire(self) -> bool:
+        redis_client = await db.get_redis_client()
+        acquired = await redis_client.set(
+            self.key, self.token, nx=True, px=int(self.ttl * 1000)
+        )
+        self.is_leader = bool(acquired)
+        return self.is_leader
+
+    async def renew(self) -> bool:
+        redis_client = await db.get_redis_client()
+        renewed = await redis_client.eval(
+            _RENEW_SCRIPT, 1, self.key, self.token, int(self.ttl * 1000)
+        )
+        self.is_leader = bool(renewed)
+        return self.is_leader
+
+    async def release(self) -> None:
+        self.is_leader = False
+        redis_client = await db.get_redis_client()
+        await redis_client.eval(_RELEASE_SCRIPT, 1, self.key, self.token)
+
+    async def run(self, jobs: Dict[str, Job]) -> None:
+        """Campaign forever, running `jobs` (by name) whenever this process leads."""
+        while True:
+            try:
+                if not await self.acquire():
+                    await asyncio.sleep(self.ttl / 3)
+                    continue
+                self.logger.info(f"{self.token} is now leader of {self.key}")
+                await self._lead(jobs)
+                self.logger.warning(f"{self.token} lost leadership of {self.key}")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.logger.error(f"Leader election for {self.key} failed: {e}")
+                await asyncio.sleep(1)
+
+    async def _lead(self, jobs: Dict[str, Job]) -> None:
+        """Run the jobs until a renewal fails, restarting any that stop."""
+        tasks = {name: asyncio.create_task(job()) for name, job in jobs.items()}
+        try:
+            while True:
+                await asyncio.sleep(self.ttl / 3)
+                for name, task in tasks.items():
+                    if task.done():
+                        if not task.cancelled() and task.exception():
+                            self.logger.error(
+                                f"Leader job {name} failed: {task.exception()}"
+                            )
+                        tasks[name] = asyncio.create_task(jobs[name]())
+                try:
+                    if not await self.renew():
+                        return
+                except Exception as e:
+                    self.logger.error(f"Unable to renew {self.key}: {e}")
+                    return
+        finally:
+            for task in tasks.values():
+                task.cancel()
+            await asyncio.gather(*tasks.values(), return_exceptions=True)
+            if self.is_leader:
+                try:
+                    await asyncio.shield(self.release())
+                except Exception as e:
+                    self.logger.warning(f"Unable to release {self.key}: {e}")
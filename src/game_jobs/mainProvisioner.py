@@ -1,11 +1,41 @@
 import datetime
 import logging
-from typing import Any, Dict, Optional
-import json
+import os
+from collections import defaultdict
+from dataclasses import dataclass
+from typing import Any, Dict, List, Mapping, Optional, Tuple
 import asyncpg
 import helper_classes.custom_dataclass as cdata
 from db import db
+from db.agent_commands import Command
+from db.server_events import publish_server_event
+from game_jobs.pending_queue import PendingQueue
+from game_jobs.placement import Demand, HostCapacity
+from game_jobs.placement_engine import get_placement_engine
 from game_jobs.provisioner_factory import ProvisionerFactory
+from game_jobs.scheduler import Lease, LeaseLost
+
+
+# "batch" places every order of a sweep in one pass, "single" one order at a time
+PENDING_SCHEDULING_MODE = os.getenv("PENDING_SCHEDULING_MODE", "batch")
+# Servers left in a transitional status longer than this are reported as stuck
+STALE_SERVER_AFTER_SECONDS = float(os.getenv("STALE_SERVER_AFTER_SECONDS", 30 * 60))
+# Due subscriptions expired per claim from the expiry schedule
+EXPIRY_BATCH_SIZE = int(os.getenv("SUBSCRIPTION_EXPIRY_BATCH_SIZE", 200))
+
+
+@dataclass
+class _BatchOrder:
+    """A pending order being placed by `job_schedule_pending_batch`."""
+
+    lane: str
+    entry_id: str
+    subscription_id: str
+    game_name: str
+    plan: Mapping[str, Any]
+    demand: Demand
+    config: str
+    host: Optional[HostCapacity] = None
 
 
 class MainProvisioner:
@@ -15,9 +45,9 @@ class MainProvisioner:
 
     def __init__(self) -> None:
         self.logger = logging.getLogger("backendlogger")
-
-        # Load all available provisioners
-        ProvisionerFactory.load_provisioners()
+        self.pending_queue = PendingQueue()
+        self.placement = get_placement_engine()
+        self.batch_scheduling = PENDING_SCHEDULING_MODE == "batch"
 
     async def job_update_config(
         self,
@@ -106,7 +136,7 @@ class MainProvisioner:
         # Get default configuration for this game
         cfg = await provisioner.get_default_config()
 
-        baremetal = await self._find_available_baremetal(plan.get("ram_gb"))
+        baremetal = await self._reserve_baremetal(Demand.from_plan(plan))
         if baremetal is None:
             self.logger.warning("No baremetal with enough capacity")
             sub_id = str(subscription.get("id"))
@@ -166,81 +196,461 @@ class MainProvisioner:
         self.logger.debug(f"Adding order to queue: {payload}")
 
         try:
-            self.redisClient = await db.get_redis_client()
-            await self.redisClient.json().arrappend(
-                "pending_servers", "$", json.dumps(payload)
+            entry_id = await self.pending_queue.enqueue(payload)
+            self.logger.info(
+                f"Added subscription {subscription_id} to pending queue as {entry_id}"
             )
-            self.logger.info(f"Added subscription {subscription_id} to pending queue")
         except Exception as e:
             self.logger.error(f"Failed to add order to queue: {e}")
 
-    async def job_repeating_check_pending_servers(self) -> None:
-        self.redisClient = await db.get_redis_client()
-        """Process pending server requests in FIFO order using Redis array operations."""
+    async def job_repeating_check_pending_servers(
+        self, lease: Optional[Lease] = None
+    ) -> int:
+        """Process pending server requests from every lane of the pending queue.
+
+        Orders are read in batches through the consumer group, so several
+        processes can drain the queue at once without picking up the same
+        order. Each lane is drained in FIFO order and stops at the first
+        order no host can fit, while the other lanes keep flowing. Under a
+        scheduler `lease`, the lease is checked before each order is written.
+
+        Returns:
+            int: The number of orders provisioned in this pass
+        """
+        processed_count = 0
         try:
-            # Get the length of the pending servers array
-            queue_length = await self.redisClient.json().arrlen("pending_servers")
-            if not queue_length or queue_length == 0:
+            lanes = await self.pending_queue.lanes()
+            await self.pending_queue.reclaim(lanes)
+            batches = await self.pending_queue.read_batch(lanes)
+            if not batches:
                 self.logger.debug("No pending servers in queue")
-                return
+                return processed_count
 
-            self.logger.debug(f"Processing {queue_length} pending servers")
+            for lane, pending_jobs in batches.items():
+                self.logger.debug(
+                    f"Processing {len(pending_jobs)} pending servers in {lane}"
+                )
+                processed_count += await self._drain_lane(lane, pending_jobs, lease)
 
-            # Process orders from the front of the queue (FIFO)
-            processed_count = 0
-            for _ in range(queue_length):
-                pending_job = {}
-                try:
-                    # Get the first item in the queue
-                    pending_job_json = await self.redisClient.json().get(
-                        "pending_servers", "$[0]"
+            if processed_count > 0:
+                self.logger.info(f"Processed {processed_count} pending server orders")
+
+        except LeaseLost:
+            raise
+        except Exception as e:
+            self.logger.error(f"Error in job_repeating_check_pending_servers: {e}")
+        return processed_count
+
+    async def _drain_lane(
+        self,
+        lane: str,
+        pending_jobs: List[Tuple[str, Dict[str, Any]]],
+        lease: Optional[Lease] = None,
+    ) -> int:
+        """Process one lane's batch in order, stopping at a blocked head."""
+        processed_count = 0
+        for entry_id, pending_job in pending_jobs:
+            if lease is not None:
+                await lease.check_held()
+            try:
+                if not pending_job:
+                    # Deleted or undecodable entry, drop it
+                    await self.pending_queue.ack(lane, entry_id)
+                    continue
+
+                if await self._process_pending_job(pending_job):
+                    await self.pending_queue.ack(lane, entry_id)
+                    processed_count += 1
+                    self.logger.info(
+                        f"Successfully processed and removed job for subscription {pending_job.get('subscription_id')}"
                     )
-                    if not pending_job_json or not pending_job_json[0]:
-                        break
-
-                    pending_job = json.loads(
-                        pending_job_json[0]
-                    )  # Extract from array wrapper
-
-                    # Try to process the job
-                    if await self._process_pending_job(pending_job):
-                        # Remove the processed job from the front of the queue
-                        await self.redisClient.json().arrpop("pending_servers", "$", 0)
-                        processed_count += 1
-                        self.logger.info(
-                            f"Successfully processed and removed job for subscription {pending_job.get('subscription_id')}"
-                        )
-                    else:
-                        # Can't process this job (no resources), stop processing queue
-                        self.logger.debug(
-                            "No available resources, stopping queue processing"
-                        )
-                        break
-
-                except Exception as e:
-                    subscription_id = str(
-                        (pending_job.get("subscription_id", "unknown"))
-                        if "pending_job" in locals()
-                        else "unknown"
+                else:
+                    # Can't process this job (no resources), stop processing the lane.
+                    # It stays pending for this consumer and is retried first.
+                    self.logger.debug(
+                        f"No available resources, stopping processing of {lane}"
                     )
+                    break
+
+            except Exception as e:
+                subscription_id = str(pending_job.get("subscription_id", "unknown"))
+                self.logger.error(
+                    f"Failed to process subscription_id job {subscription_id}: {e}"
+                )
+                # Remove the problematic job to prevent lane blocking
+                try:
+                    await self.pending_queue.ack(lane, entry_id)
+                    self.logger.warning("Removed problematic job from queue")
+                except Exception as cleanup_error:
                     self.logger.error(
-                        f"Failed to process subscription_id job {subscription_id}: {e}"
+                        f"Failed to remove problematic job: {cleanup_error}"
                     )
-                    # Remove the problematic job to prevent queue blocking
-                    try:
-                        await self.redisClient.json().arrpop("pending_servers", "$", 0)
-                        self.logger.warning("Removed problematic job from queue")
-                    except Exception as cleanup_error:
-                        self.logger.error(
-                            f"Failed to remove problematic job: {cleanup_error}"
-                        )
-                        break
+                    break
+        return processed_count
 
-            if processed_count > 0:
-                self.logger.info(f"Processed {processed_count} pending server orders")
+    async def job_drain_pending_servers(self, lease: Optional[Lease] = None) -> None:
+        """Drain the pending queue until it is empty or blocked on capacity.
+
+        Under a scheduler `lease`, stops with LeaseLost before writing once
+        another run has taken the job over.
+        """
+        schedule = (
+            self.job_schedule_pending_batch
+            if self.batch_scheduling
+            else self.job_repeating_check_pending_servers
+        )
+        while await schedule(lease) >= self.pending_queue.batch_size:
+            pass
+
+    async def job_sweep_stale_servers(self, lease: Optional[Lease] = None) -> int:
+        """Report servers stuck provisioning, restarting or stopping.
+
+        A server is stuck when its agent has not moved it out of the
+        transitional status within `STALE_SERVER_AFTER_SECONDS`. Under a
+        scheduler `lease`, the lease is checked before the admin is notified.
+
+        Returns:
+            int: The number of stuck servers found
+        """
+        servers, err = await db.db_select_stale_servers(STALE_SERVER_AFTER_SECONDS)
+        if err:
+            self.logger.error(f"Unable to sweep stale servers: {err}")
+            return 0
+        for server in servers:
+            self.logger.warning(
+                f"Server of subscription {server.get('subscription_id')} stuck in"
+                f" {server.get('status')} since {server.get('updated_at')}"
+                f" on {server.get('ip_address')}"
+            )
+        if servers:
+            if lease is not None:
+                await lease.check_held()
+            await self.job_notify_admin(f"{len(servers)} servers are stuck")
+        return len(servers)
+
+    async def job_expire_subscriptions(self, lease: Optional[Lease] = None) -> int:
+        """Expire due subscriptions, a claimed batch at a time, and stop their servers.
+
+        Reads only the due entries of the expiry schedule. Each batch is
+        expired in one transaction that also frees its baremetal capacity,
+        then one Redis round trip pushes the stop commands. Subscriptions
+        renewed since they were indexed go back into the schedule at their
+        new expiry. A batch that fails stays claimed until its claim lapses
+        and is then retried. Under a scheduler `lease`, the lease is checked
+        before each batch is committed and before its stops are pushed.
+
+        Returns:
+            int: The number of subscriptions expired
+        """
+        redis_client = await db.get_redis_client()
+        expired_count = 0
+        while True:
+            claimed = await db.EXPIRY_SCHEDULE.claim(redis_client, EXPIRY_BATCH_SIZE)
+            if not claimed:
+                return expired_count
+            if lease is not None:
+                await lease.check_held()
+            batch, err = await db.db_expire_subscriptions(claimed)
+            if err:
+                self.logger.error(
+                    f"Unable to expire {len(claimed)} subscriptions: {err}"
+                )
+                return expired_count
+            expired = {str(row.get("id")) for row in batch.subscriptions}
+            _, err = await db.db_schedule_subscription_expiries(
+                [sid for sid in claimed if sid not in expired]
+            )
+            if err:
+                self.logger.error(f"Unable to reschedule subscription expiries: {err}")
+                return expired_count
+
+            for record in batch.released:
+                self.placement.observe(record)
+            if batch.released:
+                await self.pending_queue.notify("capacity_freed")
+            pipe = redis_client.pipeline(transaction=False)
+            stops: Dict[str, List[Command]] = defaultdict(list)
+            for server in batch.servers:
+                subscription_id = str(server.get("subscription_id"))
+                stops[str(server.get("ip_address"))].append(
+                    Command.new("stop", subscription_id, game=server.get("game_name"))
+                )
+                publish_server_event(
+                    pipe, subscription_id, "status", status=server.get("status")
+                )
+            for ip, commands in stops.items():
+                await db.COMMAND_TRACKER.push(redis_client, pipe, ip, commands)
+            if lease is not None:
+                await lease.check_held()
+            if pipe.command_stack:
+                await pipe.execute()
+            await db.EXPIRY_SCHEDULE.ack(redis_client, claimed)
+
+            expired_count += len(expired)
+            if expired:
+                self.logger.info(
+                    f"Expired {len(expired)} subscriptions, stopping"
+                    f" {len(batch.servers)} servers"
+                )
+            if len(claimed) < EXPIRY_BATCH_SIZE:
+                return expired_count
+
+    async def job_time_out_commands(self, lease: Optional[Lease] = None) -> int:
+        """Retry or dead-letter agent commands that missed their deadline.
+
+        Servers whose start, restart or stop timed out are marked failed,
+        so their owners see the failure instead of a server stuck in a
+        transitional status, and release their capacity. Under a scheduler
+        `lease`, the lease is checked before commands are pushed again and
+        before servers are marked.
+
+        Returns:
+            int: The number of commands that timed out
+        """
+        redis_client = await db.get_redis_client()
+        if lease is not None:
+            await lease.check_held()
+        retried, dead = await db.COMMAND_TRACKER.time_out(redis_client)
+        if retried:
+            self.logger.info(f"Pushed {retried} unclaimed agent commands again")
+        if not dead:
+            return 0
+        if lease is not None:
+            await lease.check_held()
+        failed, err = await db.db_fail_command_servers(dead)
+        if err:
+            self.logger.error(f"Unable to mark servers of timed out commands: {err}")
+        servers = failed.servers
+        for record in failed.released:
+            self.placement.observe(record)
+        if failed.released:
+            await self.pending_queue.notify("capacity_freed")
+
+        pipe = redis_client.pipeline(transaction=False)
+        for command in dead:
+            publish_server_event(
+                pipe,
+                command.get("subscription_id"),
+                "command",
+                id=command.get("id"),
+                command=command.get("type"),
+                state=command.get("state"),
+            )
+        for server in servers:
+            publish_server_event(
+                pipe,
+                str(server.get("subscription_id")),
+                "status",
+                status=db.SERVER_STATUS.FAILED.value,
+            )
+        await pipe.execute()
+        self.logger.warning(
+            f"{len(dead)} agent commands timed out: "
+            + ", ".join(f"{c.get('type')} {c.get('id')}" for c in dead)
+        )
+        return len(dead)
+
+    async def job_schedule_pending_batch(self, lease: Optional[Lease] = None) -> int:
+        """Place a batch of pending orders in one scheduling pass.
+
+        Reads up to `batch_size` orders per lane, loads the plans they need
+        and the capacity index once, places the whole batch in memory and
+        commits every reservation and server row in a single transaction.
+        Each lane still stops at its first order no host can fit; orders
+        behind it stay queued so the lane remains FIFO. Under a scheduler
+        `lease`, the lease is checked right before the commit; a lost lease
+        leaves the batch queued for the run that took over.
+
+        Returns:
+            int: The number of orders provisioned in this pass
+        """
+        try:
+            lanes = await self.pending_queue.lanes()
+            await self.pending_queue.reclaim(lanes)
+            batches = await self.pending_queue.read_batch(lanes)
+            if not batches:
+                self.logger.debug("No pending servers in queue")
+                return 0
 
+            done: Dict[str, List[str]] = defaultdict(list)
+            orders = await self._prepare_batch(batches, done)
+            placed = await self._place_batch(orders)
+            if lease is not None:
+                try:
+                    await lease.check_held()
+                except LeaseLost:
+                    for order in placed:
+                        if order.host is not None:
+                            self.placement.release(order.host.id, order.demand)
+                    raise
+            commit, err = await db.db_commit_server_placements(
+                [
+                    cdata.ServerPlacement(
+                        subscription_id=order.subscription_id,
+                        baremetal_id=order.host.id,
+                        ip_address=order.host.ip_address,
+                        ram_gb=order.demand.ram_gb,
+                        config=order.config,
+                    )
+                    for order in placed
+                    if order.host is not None
+                ]
+            )
+            if err:
+                self.logger.error(f"Unable to commit batch placements: {err}")
+                for order in placed:
+                    if order.host is not None:
+                        self.placement.release(order.host.id, order.demand)
+                await self.pending_queue.ack_batch(done)
+                return 0
+
+            provisioned = await self._queue_batch_provisioning(placed, commit, done)
+            await self.pending_queue.ack_batch(done)
+            if provisioned:
+                self.logger.info(f"Processed {provisioned} pending server orders")
+            return provisioned
+
+        except LeaseLost:
+            raise
         except Exception as e:
-            self.logger.error(f"Error in job_repeating_check_pending_servers: {e}")
+            self.logger.error(f"Error in job_schedule_pending_batch: {e}")
+            return 0
+
+    async def _prepare_batch(
+        self,
+        batches: Dict[str, List[Tuple[str, Dict[str, Any]]]],
+        done: Dict[str, List[str]],
+    ) -> List[_BatchOrder]:
+        """Validate a batch and load its plans and configs.
+
+        Invalid orders are added to `done` so they are dropped from the queue.
+        """
+        valid = []
+        for lane, pending_jobs in batches.items():
+            for entry_id, pending_job in pending_jobs:
+                if all(
+                    pending_job.get(key)
+                    for key in ("subscription_id", "plan_id", "name")
+                ):
+                    valid.append((lane, entry_id, pending_job))
+                else:
+                    self.logger.warning(
+                        f"Missing required fields in pending job: {pending_job}"
+                    )
+                    done[lane].append(entry_id)
+
+        plans, err = await db.db_select_plans_by_ids(
+            list({str(pending_job["plan_id"]) for _, _, pending_job in valid})
+        )
+        if err:
+            # Leave the whole batch queued rather than dropping valid orders
+            raise RuntimeError(f"Unable to load plans: {err}")
+
+        orders = []
+        seen = set()
+        for lane, entry_id, pending_job in valid:
+            subscription_id = str(pending_job["subscription_id"])
+            plan = plans.get(str(pending_job["plan_id"]))
+            if not plan or not plan.get("ram_gb") or subscription_id in seen:
+                self.logger.warning(
+                    f"Dropping pending job {entry_id} for {subscription_id}: unknown plan or duplicate"
+                )
+                done[lane].append(entry_id)
+                continue
+            game_name = pending_job["name"]
+            try:
+                provisioner = ProvisionerFactory.get_provisioner(game_name)
+                if not provisioner:
+                    raise ValueError("no provisioner")
+                config = await provisioner.get_default_config()
+            except Exception as e:
+                self.logger.error(
+                    f"Failed to get provisioner for game '{game_name}': {e}"
+                )
+                done[lane].append(entry_id)
+                continue
+            seen.add(subscription_id)
+            orders.append(
+                _BatchOrder(
+                    lane=lane,
+                    entry_id=entry_id,
+                    subscription_id=subscription_id,
+                    game_name=game_name,
+                    plan=plan,
+                    demand=Demand.from_plan(plan, region=pending_job.get("region")),
+                    config=config,
+                )
+            )
+        return orders
+
+    async def _place_batch(self, orders: List[_BatchOrder]) -> List[_BatchOrder]:
+        """Choose a host for every order in memory, keeping each lane FIFO.
+
+        Orders behind a lane's first unplaceable order give their host back.
+        """
+        hosts = await self.placement.place_batch([order.demand for order in orders])
+        blocked_lanes = set()
+        for order, host in zip(orders, hosts, strict=True):
+            if order.lane in blocked_lanes or host is None:
+                if host is not None:
+                    self.placement.release(host.id, order.demand)
+                blocked_lanes.add(order.lane)
+                continue
+            order.host = host
+        if blocked_lanes:
+            self.logger.debug(
+                f"No available resources, stopping processing of {sorted(blocked_lanes)}"
+            )
+        return orders
+
+    async def _queue_batch_provisioning(
+        self,
+        orders: List[_BatchOrder],
+        commit: cdata.PlacementCommit,
+        done: Dict[str, List[str]],
+    ) -> int:
+        """Push provisioning commands for committed servers and mark their orders done.
+
+        Orders whose host turned out to be full stay queued and the index is
+        reloaded on the next pass.
+        """
+        for record in commit.baremetals.values():
+            self.placement.observe(record)
+        servers = {str(server.get("subscription_id")) for server in commit.servers}
+
+        redis_client = await db.get_redis_client()
+        pipe = redis_client.pipeline(transaction=False)
+        starts: Dict[str, List[Command]] = defaultdict(list)
+        for order in orders:
+            if order.host is None:
+                continue
+            if order.host.id not in commit.baremetals:
+                self.placement.invalidate()
+                continue
+            done[order.lane].append(order.entry_id)
+            if order.subscription_id not in servers:
+                # Already has a server or the subscription is gone
+                self.placement.invalidate()
+                continue
+            starts[order.host.ip_address].append(
+                self._build_payload(
+                    user_id=order.subscription_id,
+                    game_name=order.game_name,
+                    ram_gb=order.plan.get("ram_gb", 2),
+                    cpu_cores=order.plan.get("cpu_cores", 2),
+                )
+            )
+            publish_server_event(
+                pipe,
+                order.subscription_id,
+                "status",
+                status=db.SERVER_STATUS.PROVISIONING.value,
+            )
+        for ip, commands in starts.items():
+            await db.COMMAND_TRACKER.push(redis_client, pipe, ip, commands)
+        if starts:
+            await pipe.execute()
+        return sum(len(commands) for commands in starts.values())
 
     async def _process_pending_job(self, pending_job: dict) -> bool:
         """
@@ -250,7 +660,6 @@ class MainProvisioner:
             bool: True if job was successfully processed, False if no resources available
         """
         subscription_id = str(pending_job.get("subscription_id"))
-        ram_needed = pending_job.get("ram_gb")
         plan_id = str(pending_job.get("plan_id"))
         game_name = pending_job.get("name", "")
 
@@ -261,14 +670,6 @@ class MainProvisioner:
             )
             return True  # Return True to remove invalid job from queue
 
-        # Find available hardware
-        baremetal = await self._find_available_baremetal(ram_needed=ram_needed)
-        if not baremetal:
-            self.logger.debug(
-                f"No available baremetal for job {subscription_id} (RAM needed: {ram_needed}GB)"
-            )
-            return False  # Keep job in queue
-
         # Get plan details
         plan, _ = await db.db_select_plan_by_id(plan_id)
         if not plan:
@@ -288,6 +689,15 @@ class MainProvisioner:
             self.logger.error(f"Failed to get provisioner for game '{game_name}': {e}")
             return True  # Remove invalid job from queue
 
+        # Reserve capacity on a host, last so nothing above has to release it
+        demand = Demand.from_plan(plan, region=pending_job.get("region"))
+        baremetal = await self._reserve_baremetal(demand)
+        if not baremetal:
+            self.logger.debug(
+                f"No available baremetal for job {subscription_id} (RAM needed: {demand.ram_gb}GB)"
+            )
+            return False  # Keep job in queue
+
         # Provision the server
         try:
             await self._provision_server(
@@ -309,20 +719,17 @@ class MainProvisioner:
             )
             return False  # Keep job in queue for retry
 
-    async def _find_available_baremetal(
+    async def _reserve_baremetal(
         self,
-        ram_needed: int | None,
+        demand: Demand,
     ) -> asyncpg.Record | None:
-        """Find an available baremetal server with enough capacity."""
-        if ram_needed is None:
+        """Pick a baremetal server with the placement engine and reserve it.
+
+        The returned host already has the demanded RAM added to its `capacity_used`.
+        """
+        if not demand.ram_gb:
             return None
-        baremetals, _ = await db.db_select_all_baremetals()
-        for bm in baremetals:
-            total = bm.get("capacity_total") or 0
-            used = bm.get("capacity_used") or 0
-            if total - used >= ram_needed:
-                return bm
-        return None
+        return await self.placement.reserve(demand)
 
     async def _provision_server(
         self,
@@ -333,7 +740,9 @@ class MainProvisioner:
         provisioner,
         cfg: str,
     ) -> None:
-        """Provision a new game server.
+        """Provision a new game server on a host whose capacity is already reserved.
+
+        The reservation is released if the server cannot be recorded.
 
         Args:
             subscription_id: The subscription ID for the user
@@ -348,6 +757,7 @@ class MainProvisioner:
         ip = baremetal.get("ip_address")
         if not ip:
             self.logger.error("Baremetal record missing IP")
+            await self._release_baremetal(baremetal, plan)
             return
 
         server, err = await db.db_insert_server(
@@ -357,23 +767,43 @@ class MainProvisioner:
             ports="{}",
             docker_container_id="-",
             config=cfg,
+            baremetal_id=str(baremetal.get("id")),
         )
         if not server:
             self.logger.error(
-                f"Failed to record server in DB for  err{err}",
-                subscription_id,
+                f"Failed to record server in DB for {subscription_id} err:{err}"
             )
+            await self._release_baremetal(baremetal, plan)
             return
 
-        payload = self._build_payload(
+        command = self._build_payload(
             user_id=subscription_id,
             game_name=game_name,
             ram_gb=plan.get("ram_gb", 2),
             cpu_cores=plan.get("cpu_cores", 2),
         )
-        queue = f"badger:pending:{ip}"
-        await self.redisClient.lpush(queue, payload)
-        self.logger.info("Server provisioning queued: %s", payload)
+        pipe = self.redisClient.pipeline(transaction=False)
+        await (
+            await db.COMMAND_TRACKER.push(self.redisClient, pipe, ip, [command])
+        ).execute()
+        self.logger.info("Server provisioning queued: %s", command.id)
+
+    async def _release_baremetal(
+        self, baremetal: asyncpg.Record, plan: asyncpg.Record
+    ) -> None:
+        """Give back a reservation made by `_reserve_baremetal`."""
+        baremetal_id = str(baremetal.get("id"))
+        released, err = await db.db_release_baremetal_capacity(
+            baremetal_id=baremetal_id, ram_gb=plan.get("ram_gb") or 0
+        )
+        if err or not released:
+            self.logger.error(
+                f"Unable to release capacity on baremetal {baremetal_id}: {err}"
+            )
+            return
+        self.placement.release(baremetal_id, Demand.from_plan(plan))
+        self.placement.observe(released)
+        await self.pending_queue.notify("capacity_freed")
 
     def _build_payload(
         self,
@@ -381,11 +811,10 @@ class MainProvisioner:
         game_name: str,
         ram_gb: int,
         cpu_cores: int,
-    ) -> str:
-        """Build the payload for the provisioning job."""
-        return (
-            f"python3 setup_server.py -u {user_id}"
-            f" -g {game_name} -m {ram_gb}g -c {cpu_cores} start"
+    ) -> Command:
+        """Build the start command for the provisioning job."""
+        return Command.new(
+            "start", user_id, game=game_name, ram_gb=ram_gb, cpu_cores=cpu_cores
         )
 
     async def generate_config_view_schema(
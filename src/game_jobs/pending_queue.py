@@ -0,0 +1,272 @@
+import json
+import logging
+import os
+import socket
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from redis.asyncio import Redis
+from redis.exceptions import ResponseError
+
+from db import db
+
+PENDING_LANE_PREFIX = "pending_servers:lane:"
+PENDING_LANES = "pending_servers:lanes"
+PENDING_GROUP = "provisioners"
+# Published whenever a drain may make progress: a new order or freed capacity
+PENDING_WAKEUP_CHANNEL = "pending_servers:wakeup"
+# RedisJSON array of JSON encoded orders that queued orders before the lanes
+LEGACY_PENDING_KEY = "pending_servers"
+
+
+def lane_for(payload: Dict[str, Any]) -> str:
+    """Stream key of the lane an order belongs to, keyed by its RAM class."""
+    return f"{PENDING_LANE_PREFIX}{int(payload.get('ram_gb') or 0)}"
+
+
+class PendingQueue:
+    """Redis Streams backed queue of orders waiting for baremetal capacity.
+
+    Orders are split into lanes, one stream per RAM class, so an order that
+    no host can fit only holds back orders of its own size. Every app
+    process joins the same consumer group on each lane, so an order is
+    handed to exactly one consumer. An entry stays in that consumer's
+    pending entries list until it is acknowledged, and entries held by a
+    consumer that died are reclaimed by the others after `reclaim_idle_ms`.
+    """
+
+    # Lanes whose consumer group this process has already created
+    _known_lanes: set[str] = set()
+
+    def __init__(
+        self,
+        consumer_name: Optional[str] = None,
+        batch_size: int = int(os.getenv("PENDING_BATCH_SIZE", 16)),
+        reclaim_idle_ms: int = 5 * 60 * 1000,
+    ) -> None:
+        self.logger = logging.getLogger("backendlogger")
+        self.consumer_name = consumer_name or f"{socket.gethostname()}:{os.getpid()}"
+        self.batch_size = batch_size
+        self.reclaim_idle_ms = reclaim_idle_ms
+
+    async def _client(self) -> Redis:
+        return await db.get_redis_client()
+
+    async def ensure_group(self) -> None:
+        """Create the consumer group on every known lane."""
+        for lane in await self.lanes():
+            await self._ensure_lane(lane)
+
+    async def _ensure_lane(self, lane: str) -> None:
+        if lane in self._known_lanes:
+            return
+        redis_client = await self._client()
+        try:
+            await redis_client.xgroup_create(lane, PENDING_GROUP, id="0", mkstream=True)
+            self.logger.info(f"Created consumer group {PENDING_GROUP} on {lane}")
+        except ResponseError as e:
+            if "BUSYGROUP" not in str(e):
+                raise
+        self._known_lanes.add(lane)
+
+    async def migrate_legacy(self) -> int:
+        """Move orders left in the legacy `pending_servers` array into the lanes.
+
+        The array is renamed to a key of this consumer first, so one process
+        migrates it even when several start at once. Its orders are then
+        added to their lanes and the key deleted in one transaction. If that
+        fails, the array is renamed back for the next start.
+
+        Returns:
+            int: The number of orders moved
+        """
+        redis_client = await self._client()
+        claimed = f"{LEGACY_PENDING_KEY}:migrating:{self.consumer_name}"
+        try:
+            await redis_client.rename(LEGACY_PENDING_KEY, claimed)
+        except ResponseError as e:
+            if "no such key" not in str(e).lower():
+                raise
+            return 0
+        try:
+            orders = (await redis_client.json().get(claimed, "$") or [[]])[0]
+            pipe = redis_client.pipeline(transaction=True)
+            for order in orders:
+                raw = order if isinstance(order, str) else json.dumps(order)
+                try:
+                    payload = json.loads(raw)
+                except json.JSONDecodeError:
+                    # Queued anyway, so the drain drops it like any undecodable entry
+                    payload = {}
+                lane = lane_for(payload if isinstance(payload, dict) else {})
+                pipe.xadd(lane, {"payload": raw})
+                pipe.sadd(PENDING_LANES, lane)
+            pipe.delete(claimed)
+            await pipe.execute()
+        except Exception as e:
+            self.logger.error(f"Unable to migrate legacy pending orders: {e}")
+            if not await redis_client.renamenx(claimed, LEGACY_PENDING_KEY):
+                self.logger.error(f"Legacy pending orders left in {claimed}")
+            raise
+        if orders:
+            self.logger.info(f"Moved {len(orders)} legacy pending orders to the lanes")
+        return len(orders)
+
+    async def lanes(self) -> List[str]:
+        """All lanes, smallest RAM class first."""
+        redis_client = await self._client()
+        lanes = await redis_client.smembers(PENDING_LANES)
+        return sorted(lanes, key=lambda lane: int(lane.rsplit(":", 1)[-1]))
+
+    async def enqueue(self, payload: Dict[str, Any]) -> str:
+        """Append an order to its lane, wake the drainers and return its entry id."""
+        lane = lane_for(payload)
+        await self._ensure_lane(lane)
+        redis_client = await self._client()
+        pipe = redis_client.pipeline(transaction=False)
+        pipe.xadd(lane, {"payload": json.dumps(payload)})
+        pipe.sadd(PENDING_LANES, lane)
+        pipe.publish(PENDING_WAKEUP_CHANNEL, "enqueued")
+        entry_id, _, _ = await pipe.execute()
+        return entry_id
+
+    async def notify(self, reason: str) -> None:
+        """Wake the drainers, e.g. after a baremetal freed capacity."""
+        redis_client = await self._client()
+        await redis_client.publish(PENDING_WAKEUP_CHANNEL, reason)
+
+    @asynccontextmanager
+    async def wakeups(self) -> AsyncIterator[Callable[[float], Awaitable[bool]]]:
+        """Subscribe to drain wakeups.
+
+        Yields a coroutine function that waits up to `timeout` seconds for a
+        wakeup and returns True if one arrived, False on timeout. A burst of
+        notifications is collapsed into a single wakeup.
+        """
+        redis_client = await self._client()
+        pubsub = redis_client.pubsub(ignore_subscribe_messages=True)
+        await pubsub.subscribe(PENDING_WAKEUP_CHANNEL)
+
+        async def wait(timeout: float) -> bool:
+            message = await pubsub.get_message(
+                ignore_subscribe_messages=True, timeout=timeout
+            )
+            if message is None:
+                return False
+            while await pubsub.get_message(ignore_subscribe_messages=True):
+                pass
+            return True
+
+        try:
+            yield wait
+        finally:
+            await pubsub.unsubscribe(PENDING_WAKEUP_CHANNEL)
+            await pubsub.aclose()
+
+    async def read_batch(
+        self, lanes: List[str]
+    ) -> Dict[str, List[Tuple[str, Dict[str, Any]]]]:
+        """Read up to `batch_size` orders per lane for this consumer, FIFO per lane.
+
+        Entries already delivered to this consumer but not acknowledged
+        (e.g. orders that could not be placed on the last sweep) come first,
+        followed by entries never delivered to any consumer. All lanes are
+        read in one XREADGROUP per step.
+        """
+        if not lanes:
+            return {}
+        redis_client = await self._client()
+        batches = await self._xreadgroup(redis_client, {lane: "0" for lane in lanes})
+        hungry = [
+            lane for lane in lanes if len(batches.get(lane, [])) < self.batch_size
+        ]
+        if hungry:
+            fresh = await self._xreadgroup(redis_client, {lane: ">" for lane in hungry})
+            for lane, entries in fresh.items():
+                batches.setdefault(lane, []).extend(entries)
+        return {lane: batches[lane] for lane in lanes if batches.get(lane)}
+
+    async def _xreadgroup(
+        self, redis_client: Redis, streams: Dict[str, str]
+    ) -> Dict[str, List[Tuple[str, Dict[str, Any]]]]:
+        response = await redis_client.xreadgroup(
+            PENDING_GROUP,
+            self.consumer_name,
+            streams,
+            count=self.batch_size,
+        )
+        if not response:
+            return {}
+        return {
+            lane: [self._decode(entry_id, fields) for entry_id, fields in entries]
+            for lane, entries in response
+        }
+
+    def _decode(
+        self, entry_id: str, fields: Optional[Dict[str, str]]
+    ) -> Tuple[str, Dict[str, Any]]:
+        # Entries deleted while still pending are delivered with no fields
+        if not fields or "payload" not in fields:
+            return entry_id, {}
+        try:
+            return entry_id, json.loads(fields["payload"])
+        except json.JSONDecodeError:
+            self.logger.warning(f"Undecodable pending order {entry_id}")
+            return entry_id, {}
+
+    async def ack(self, lane: str, *entry_ids: str) -> None:
+        """Acknowledge and delete processed entries in a single round trip."""
+        if not entry_ids:
+            return
+        redis_client = await self._client()
+        pipe = redis_client.pipeline(transaction=False)
+        pipe.xack(lane, PENDING_GROUP, *entry_ids)
+        pipe.xdel(lane, *entry_ids)
+        await pipe.execute()
+
+    async def ack_batch(self, entries: Dict[str, List[str]]) -> None:
+        """Acknowledge and delete entries of several lanes in a single round trip."""
+        entries = {lane: ids for lane, ids in entries.items() if ids}
+        if not entries:
+            return
+        redis_client = await self._client()
+        pipe = redis_client.pipeline(transaction=False)
+        for lane, entry_ids in entries.items():
+            pipe.xack(lane, PENDING_GROUP, *entry_ids)
+            pipe.xdel(lane, *entry_ids)
+        await pipe.execute()
+
+    async def reclaim(self, lanes: List[str]) -> int:
+        """Take over entries left pending by consumers that stopped responding.
+
+        Claimed entries move into this consumer's pending entries list and
+        are returned by the next `read_batch`.
+        """
+        if not lanes:
+            return 0
+        redis_client = await self._client()
+        pipe = redis_client.pipeline(transaction=False)
+        for lane in lanes:
+            pipe.xautoclaim(
+                lane,
+                PENDING_GROUP,
+                self.consumer_name,
+                min_idle_time=self.reclaim_idle_ms,
+                start_id="0-0",
+                count=self.batch_size,
+                justid=True,
+            )
+        claimed = sum(len(ids) for ids in await pipe.execute())
+        if claimed:
+            self.logger.info(f"Reclaimed {claimed} stale pending orders")
+        return claimed
+
+    async def length(self) -> int:
+        redis_client = await self._client()
+        lanes = await self.lanes()
+        if not lanes:
+            return 0
+        pipe = redis_client.pipeline(transaction=False)
+        for lane in lanes:
+            pipe.xlen(lane)
+        return sum(await pipe.execute())
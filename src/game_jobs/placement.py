@@ -0,0 +1,305 @@
+"""
+Baremetal placement strategies.
+
+Everything here works on an in-memory `CapacityIndex` and has no database
+or Redis dependency, so the same code runs in the scheduler and in the
+placement simulator (`benchmarks/placement_sim.py`).
+"""
+
+import bisect
+import os
+from abc import ABC, abstractmethod
+from dataclasses import dataclass
+from typing import Any, Dict, Iterable, Iterator, List, Mapping, Optional, Tuple
+
+
+@dataclass(frozen=True)
+class Demand:
+    """Resources one server needs, taken from its catalog plan."""
+
+    ram_gb: float
+    cpu_cores: float = 0
+    storage_gb: float = 0
+    region: Optional[str] = None
+
+    @classmethod
+    def from_plan(cls, plan: Mapping[str, Any], region: Optional[str] = None):
+        return cls(
+            ram_gb=float(plan.get("ram_gb") or 0),
+            cpu_cores=float(plan.get("cpu_cores") or 0),
+            storage_gb=float(plan.get("storage_gb") or 0),
+            region=region,
+        )
+
+
+@dataclass
+class HostCapacity:
+    """Capacity of one baremetal. CPU and storage are only enforced when the
+    host has a total for them."""
+
+    id: str
+    ip_address: str
+    ram_total: float
+    ram_used: float = 0
+    cpu_total: Optional[float] = None
+    cpu_used: float = 0
+    storage_total: Optional[float] = None
+    storage_used: float = 0
+    region: Optional[str] = None
+    datacenter: Optional[str] = None
+
+    @property
+    def ram_free(self) -> float:
+        return self.ram_total - self.ram_used
+
+    def fits(self, demand: Demand) -> bool:
+        if self.ram_total - self.ram_used < demand.ram_gb:
+            return False
+        if (
+            self.cpu_total is not None
+            and self.cpu_total - self.cpu_used < demand.cpu_cores
+        ):
+            return False
+        if (
+            self.storage_total is not None
+            and self.storage_total - self.storage_used < demand.storage_gb
+        ):
+            return False
+        return True
+
+    @classmethod
+    def from_record(cls, record: Mapping[str, Any]):
+        return cls(
+            id=str(record.get("id")),
+            ip_address=str(record.get("ip_address")),
+            ram_total=float(record.get("capacity_total") or 0),
+            ram_used=float(record.get("capacity_used") or 0),
+            cpu_total=_optional_float(record.get("cpu_cores_total")),
+            cpu_used=float(record.get("cpu_cores_used") or 0),
+            storage_total=_optional_float(record.get("storage_gb_total")),
+            storage_used=float(record.get("storage_gb_used") or 0),
+            region=record.get("region"),
+            datacenter=record.get("datacenter"),
+        )
+
+
+def _optional_float(value: Any) -> Optional[float]:
+    return None if value is None else float(value)
+
+
+class CapacityIndex:
+    """Hosts keyed by id plus an ordering by free RAM.
+
+    `_by_free` is a sorted list of `(ram_free, host_id)` so strategies can
+    jump straight to the smallest host that fits. Reservations and
+    releases update a single host in place instead of rebuilding the index.
+    """
+
+    def __init__(self, hosts: Iterable[HostCapacity] = ()) -> None:
+        self.hosts: Dict[str, HostCapacity] = {}
+        self._by_free: List[Tuple[float, str]] = []
+        self.load(hosts)
+
+    def load(self, hosts: Iterable[HostCapacity]) -> None:
+        self.hosts = {host.id: host for host in hosts}
+        self._by_free = sorted((host.ram_free, host.id) for host in self.hosts.values())
+
+    def __len__(self) -> int:
+        return len(self.hosts)
+
+    def upsert(self, host: HostCapacity) -> None:
+        self.remove(host.id)
+        self.hosts[host.id] = host
+        bisect.insort(self._by_free, (host.ram_free, host.id))
+
+    def remove(self, host_id: str) -> None:
+        host = self.hosts.pop(host_id, None)
+        if host is not None:
+            self._discard(host)
+
+    def reserve(self, host_id: str, demand: Demand) -> None:
+        self._adjust(host_id, demand, 1)
+
+    def release(self, host_id: str, demand: Demand) -> None:
+        self._adjust(host_id, demand, -1)
+
+    def set_ram_used(self, host_id: str, ram_used: float) -> None:
+        """Apply the authoritative RAM usage returned by the database."""
+        host = self.hosts.get(host_id)
+        if host is None:
+            return
+        self._discard(host)
+        host.ram_used = ram_used
+        bisect.insort(self._by_free, (host.ram_free, host.id))
+
+    def _adjust(self, host_id: str, demand: Demand, sign: int) -> None:
+        host = self.hosts.get(host_id)
+        if host is None:
+            return
+        self._discard(host)
+        host.ram_used = max(host.ram_used + sign * demand.ram_gb, 0)
+        host.cpu_used = max(host.cpu_used + sign * demand.cpu_cores, 0)
+        host.storage_used = max(host.storage_used + sign * demand.storage_gb, 0)
+        bisect.insort(self._by_free, (host.ram_free, host.id))
+
+    def _discard(self, host: HostCapacity) -> None:
+        position = bisect.bisect_left(self._by_free, (host.ram_free, host.id))
+        if position < len(self._by_free) and self._by_free[position][1] == host.id:
+            del self._by_free[position]
+
+    def with_free_ram(self, ram_gb: float) -> Iterator[HostCapacity]:
+        """Hosts with at least `ram_gb` free, tightest first.
+
+        The index must not be modified while the iterator is in use.
+        """
+        start = bisect.bisect_left(self._by_free, (ram_gb, ""))
+        for position in range(start, len(self._by_free)):
+            yield self.hosts[self._by_free[position][1]]
+
+    def by_most_free_ram(self) -> Iterator[HostCapacity]:
+        """All hosts, most free RAM first."""
+        for position in range(len(self._by_free) - 1, -1, -1):
+            yield self.hosts[self._by_free[position][1]]
+
+    def in_load_order(self) -> Iterator[HostCapacity]:
+        return iter(self.hosts.values())
+
+
+class PlacementStrategy(ABC):
+    """Ranks hosts for a demand; the scheduler tries them best first."""
+
+    name: str = ""
+
+    @abstractmethod
+    def rank(self, index: CapacityIndex, demand: Demand) -> Iterator[HostCapacity]:
+        """Yield hosts that fit `demand`, best candidate first."""
+
+    def choose(self, index: CapacityIndex, demand: Demand) -> Optional[HostCapacity]:
+        return next(self.rank(index, demand), None)
+
+    def order_batch(self, demands: List[Demand]) -> List[int]:
+        """Order in which a batch of demands is placed, as indexes into `demands`."""
+        return list(range(len(demands)))
+
+    def place_batch(
+        self, index: CapacityIndex, demands: List[Demand]
+    ) -> List[Optional[HostCapacity]]:
+        """Place a batch against `index`, reserving in the index as it goes.
+
+        Returns the chosen host per demand, in the order of `demands`.
+        Capacity only shrinks during a batch, so a demand identical to one
+        that already failed is not searched for again.
+        """
+        placements: List[Optional[HostCapacity]] = [None] * len(demands)
+        unplaceable: set[Demand] = set()
+        for position in self.order_batch(demands):
+            demand = demands[position]
+            if demand in unplaceable:
+                continue
+            host = self.choose(index, demand)
+            if host is None:
+                unplaceable.add(demand)
+                continue
+            index.reserve(host.id, demand)
+            placements[position] = host
+        return placements
+
+
+class FirstFit(PlacementStrategy):
+    """First host in load order that fits."""
+
+    name = "first_fit"
+
+    def rank(self, index: CapacityIndex, demand: Demand) -> Iterator[HostCapacity]:
+        return (host for host in index.in_load_order() if host.fits(demand))
+
+
+class BestFit(PlacementStrategy):
+    """Host with the least free RAM that still fits, keeping big holes open."""
+
+    name = "best_fit"
+
+    def rank(self, index: CapacityIndex, demand: Demand) -> Iterator[HostCapacity]:
+        return (
+            host for host in index.with_free_ram(demand.ram_gb) if host.fits(demand)
+        )
+
+
+class FirstFitDecreasing(FirstFit):
+    """First-fit over a batch sorted by decreasing RAM.
+
+    Single orders are placed first-fit; only `place_batch` reorders.
+    """
+
+    name = "first_fit_decreasing"
+
+    def order_batch(self, demands: List[Demand]) -> List[int]:
+        return sorted(
+            range(len(demands)), key=lambda i: demands[i].ram_gb, reverse=True
+        )
+
+
+class MultiDimensionalFit(BestFit):
+    """Scores RAM, CPU and storage leftovers together, with region affinity.
+
+    Among the `max_candidates` tightest hosts by RAM, the host whose
+    normalised leftover across all tracked dimensions is smallest wins.
+    Hosts outside the demand's region are only used when no host in the
+    region fits. The scan stops after `scan_limit` fitting hosts once a
+    host in the region has been found.
+    """
+
+    name = "multi_dimensional"
+
+    def __init__(
+        self,
+        max_candidates: int = 16,
+        scan_limit: int = 128,
+        weights: Tuple[float, float, float] = (1.0, 0.5, 0.25),
+    ) -> None:
+        self.max_candidates = max_candidates
+        self.scan_limit = scan_limit
+        self.weights = weights
+
+    def rank(self, index: CapacityIndex, demand: Demand) -> Iterator[HostCapacity]:
+        local: List[Tuple[float, HostCapacity]] = []
+        remote: List[Tuple[float, HostCapacity]] = []
+        for scanned, host in enumerate(super().rank(index, demand), start=1):
+            if demand.region is None or host.region == demand.region:
+                local.append((self._score(host, demand), host))
+            elif len(remote) < self.max_candidates:
+                remote.append((self._score(host, demand), host))
+            if len(local) >= self.max_candidates or (
+                local and scanned >= self.scan_limit
+            ):
+                break
+        local.sort(key=lambda pair: pair[0])
+        remote.sort(key=lambda pair: pair[0])
+        for _, host in local + remote:
+            yield host
+
+    def _score(self, host: HostCapacity, demand: Demand) -> float:
+        ram_weight, cpu_weight, storage_weight = self.weights
+        score = ram_weight * (host.ram_free - demand.ram_gb) / host.ram_total
+        if host.cpu_total:
+            cpu_free = host.cpu_total - host.cpu_used - demand.cpu_cores
+            score += cpu_weight * cpu_free / host.cpu_total
+        if host.storage_total:
+            storage_free = host.storage_total - host.storage_used - demand.storage_gb
+            score += storage_weight * storage_free / host.storage_total
+        return score
+
+
+STRATEGIES: Dict[str, type[PlacementStrategy]] = {
+    strategy.name: strategy
+    for strategy in (FirstFit, BestFit, FirstFitDecreasing, MultiDimensionalFit)
+}
+
+
+def get_strategy(name: Optional[str] = None) -> PlacementStrategy:
+    """Build the strategy called `name`, defaulting to $PLACEMENT_STRATEGY or best fit."""
+    name = name or os.getenv("PLACEMENT_STRATEGY", BestFit.name)
+    strategy_class = STRATEGIES.get(name)
+    if strategy_class is None:
+        raise ValueError(f"Unknown placement strategy: {name}")
+    return strategy_class()
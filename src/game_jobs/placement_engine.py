@@ -0,0 +1,135 @@
+import asyncio
+import itertools
+import logging
+import os
+import time
+from typing import Any, List, Mapping, Optional
+
+import asyncpg
+
+from db import db
+from game_jobs.placement import (
+    CapacityIndex,
+    Demand,
+    HostCapacity,
+    PlacementStrategy,
+    get_strategy,
+)
+
+
+class PlacementEngine:
+    """Chooses baremetals from an in-memory capacity index and reserves them.
+
+    The strategy ranks hosts from the index; the reservation itself is an
+    atomic conditional UPDATE on the chosen host, so the database stays the
+    source of truth when several processes place orders at once. The index
+    is updated in place after every reservation or release and reloaded
+    every `refresh_interval` seconds, or as soon as it turns out to be stale:
+    a candidate that no longer has room, or no candidate at all while the
+    index is older than `min_refresh_interval`.
+    """
+
+    def __init__(
+        self,
+        strategy: Optional[PlacementStrategy] = None,
+        refresh_interval: float = float(os.getenv("PLACEMENT_REFRESH_SECONDS", 30)),
+        max_attempts: int = 3,
+        min_refresh_interval: float = 1.0,
+    ) -> None:
+        self.logger = logging.getLogger("backendlogger")
+        self.strategy = strategy or get_strategy()
+        self.index = CapacityIndex()
+        self.refresh_interval = refresh_interval
+        self.max_attempts = max_attempts
+        self.min_refresh_interval = min_refresh_interval
+        self._loaded_at: Optional[float] = None
+        self._refresh_lock = asyncio.Lock()
+
+    def _age(self) -> float:
+        if self._loaded_at is None:
+            return float("inf")
+        return time.monotonic() - self._loaded_at
+
+    def _is_fresh(self) -> bool:
+        return self._age() < self.refresh_interval
+
+    async def refresh(self, force: bool = False) -> None:
+        """Reload the index from the database if it is older than `refresh_interval`."""
+        if not force and self._is_fresh():
+            return
+        async with self._refresh_lock:
+            if not force and self._is_fresh():
+                return
+            records, err = await db.db_select_baremetal_capacity()
+            if err:
+                self.logger.error(f"Unable to load baremetal capacity: {err}")
+                return
+            self.index.load(HostCapacity.from_record(record) for record in records)
+            self._loaded_at = time.monotonic()
+            self.logger.debug(f"Loaded capacity index with {len(self.index)} hosts")
+
+    async def reserve(self, demand: Demand) -> Optional[asyncpg.Record]:
+        """Reserve `demand` on the best host the strategy finds.
+
+        Returns the reserved baremetal row, or None if no host fits.
+        """
+        await self.refresh()
+        record = await self._try_candidates(demand)
+        if record is None and self._age() > self.min_refresh_interval:
+            # Capacity may have been taken or freed by another process
+            await self.refresh(force=True)
+            record = await self._try_candidates(demand)
+        return record
+
+    async def _try_candidates(self, demand: Demand) -> Optional[asyncpg.Record]:
+        candidates = list(
+            itertools.islice(self.strategy.rank(self.index, demand), self.max_attempts)
+        )
+        for host in candidates:
+            record, err = await db.db_reserve_baremetal_capacity_on_host(
+                baremetal_id=host.id, ram_gb=demand.ram_gb
+            )
+            if record:
+                self.index.reserve(host.id, demand)
+                self.observe(record)
+                return record
+            if err:
+                self.logger.error(f"Unable to reserve capacity on {host.id}: {err}")
+            # The host no longer has room, so the index is stale
+            self.invalidate()
+        return None
+
+    async def place_batch(self, demands: List[Demand]) -> List[Optional[HostCapacity]]:
+        """Place a whole batch in the index without touching the database.
+
+        Capacity is reserved in the index only; the caller commits the
+        placements and feeds the returned rows back through `observe`, or
+        gives them back with `release` if they are not committed.
+        """
+        await self.refresh()
+        return self.strategy.place_batch(self.index, demands)
+
+    def invalidate(self) -> None:
+        """Reload the index on the next use."""
+        self._loaded_at = None
+
+    def release(self, baremetal_id: str, demand: Demand) -> None:
+        """Return a reservation to the index after the database released it."""
+        self.index.release(baremetal_id, demand)
+
+    def observe(self, record: Mapping[str, Any]) -> None:
+        """Apply a baremetal row's authoritative `capacity_used` to the index."""
+        self.index.set_ram_used(
+            str(record.get("id")), float(record.get("capacity_used") or 0)
+        )
+
+
+_engine: Optional[PlacementEngine] = None
+
+
+def get_placement_engine() -> PlacementEngine:
+    """Process-wide placement engine, so the capacity index is shared."""
+    global _engine
+    if _engine is None:
+        _engine = PlacementEngine()
+    return _engine
@@ -1,14 +1,60 @@
+import importlib
+import inspect
 import logging
+import time
+from dataclasses import dataclass
+from importlib.metadata import entry_points
+from pathlib import Path
+from typing import Any, Callable, Dict, Optional
 
 from game_jobs.abstract_provisioner import AbstractProvisioner
 
+# Entry point group through which installed packages add provisioners
+ENTRY_POINT_GROUP = "quartapp.provisioners"
+# Modules in game_jobs named `{game}provisioner.py` provide that game
+PROVISIONER_MODULE_SUFFIX = "provisioner"
+NOT_PROVISIONER_MODULES = {"abstract_provisioner", "mainprovisioner"}
+
+
+@dataclass
+class _Plugin:
+    """A discovered provisioner, imported and built on first use."""
+
+    source: str
+    target: str
+    load: Callable[[], type[AbstractProvisioner]]
+    import_ms: Optional[float] = None
+    init_ms: Optional[float] = None
+
+
+def _provisioner_in_module(module_name: str) -> type[AbstractProvisioner]:
+    """The provisioner class a game_jobs module defines."""
+    module = importlib.import_module(module_name)
+    for _, obj in inspect.getmembers(module, inspect.isclass):
+        if (
+            issubclass(obj, AbstractProvisioner)
+            and obj is not AbstractProvisioner
+            and obj.__module__ == module.__name__
+        ):
+            return obj
+    raise ImportError(f"{module_name} defines no provisioner")
+
 
 class ProvisionerFactory:
     """Factory class for creating game-specific provisioners.
     Allows for dynamic registration of new game provisioners.
+
+    Provisioners are discovered once, from the `quartapp.provisioners`
+    entry points of installed packages and the `*provisioner.py` modules
+    of game_jobs, without importing them. A game's module is imported and
+    its provisioner built on first use, and that instance is shared.
     """
 
-    _provisioners: dict[str, type[AbstractProvisioner]] = {}
+    _plugins: dict[str, _Plugin] = {}
+    # One shared instance per game, built on first use
+    _instances: dict[str, AbstractProvisioner] = {}
+    _discovered = False
+    _discovery_ms = 0.0
     _logger = logging.getLogger("backendlogger")
 
     @classmethod
@@ -24,12 +70,22 @@ class ProvisionerFactory:
             provisioner_class: The provisioner class to register
 
         """
-        cls._provisioners[game_name.lower()] = provisioner_class
+        game_name = game_name.lower()
+        cls._plugins[game_name] = _Plugin(
+            source="registered",
+            target=f"{provisioner_class.__module__}:{provisioner_class.__name__}",
+            load=lambda: provisioner_class,
+            import_ms=0.0,
+        )
+        cls._instances.pop(game_name, None)
         cls._logger.info(f"Registered provisioner for game: {game_name}")
 
     @classmethod
     def get_provisioner(cls, game_name: str) -> AbstractProvisioner | None:
-        """Get an instance of the provisioner for the specified game.
+        """Get the shared instance of the provisioner for the specified game.
+
+        Provisioners hold no per-request state, so one instance, with its
+        schema and compiled validator, serves every caller.
 
         Args:
             game_name: The name of the game
@@ -39,24 +95,93 @@ class ProvisionerFactory:
 
         """
         game_name = game_name.lower()
-        provisioner_class = cls._provisioners.get(game_name)
+        provisioner = cls._instances.get(game_name)
+        if provisioner is not None:
+            return provisioner
+        cls.load_provisioners()
+        plugin = cls._plugins.get(game_name)
 
-        if not provisioner_class:
+        if not plugin:
             cls._logger.warning(f"No provisioner found for game: {game_name}")
             return None
 
-        return provisioner_class()
+        try:
+            started = time.perf_counter()
+            provisioner_class = plugin.load()
+            imported = time.perf_counter()
+            provisioner = provisioner_class()
+        except Exception as e:
+            cls._logger.error(f"Error loading provisioner {plugin.target}: {e}")
+            return None
+        if plugin.import_ms is None:
+            plugin.import_ms = (imported - started) * 1000
+        plugin.init_ms = (time.perf_counter() - imported) * 1000
+        cls._instances[game_name] = provisioner
+        cls._logger.info(
+            f"Loaded provisioner for {game_name} from {plugin.target}: import"
+            f" {plugin.import_ms:.1f} ms, init {plugin.init_ms:.1f} ms"
+        )
+        return provisioner
 
     @classmethod
     def load_provisioners(cls) -> None:
-        """Load all available provisioners from the game_jobs module.
-        This can be expanded to load from a configuration file or database.
+        """Discover the available provisioners, once per process.
+
+        Registered provisioners take precedence over entry points, which
+        take precedence over game_jobs modules.
         """
-        # Import available provisioners
+        if cls._discovered:
+            return
+        cls._discovered = True
+        started = time.perf_counter()
+        found: Dict[str, _Plugin] = {}
+
+        for path in sorted(Path(__file__).parent.glob("*.py")):
+            stem = path.stem.lower()
+            game_name = stem.removesuffix(PROVISIONER_MODULE_SUFFIX)
+            if game_name == stem or not game_name or stem in NOT_PROVISIONER_MODULES:
+                continue
+            module_name = f"{__package__}.{path.stem}"
+            found[game_name] = _Plugin(
+                source="module",
+                target=module_name,
+                load=lambda module_name=module_name: _provisioner_in_module(
+                    module_name
+                ),
+            )
+
         try:
-            from game_jobs.valheimprovisioner import ValheimProvisioner
+            for entry_point in entry_points(group=ENTRY_POINT_GROUP):
+                found[entry_point.name.lower()] = _Plugin(
+                    source="entry point",
+                    target=entry_point.value,
+                    load=entry_point.load,
+                )
+        except Exception as e:
+            cls._logger.error(f"Error reading provisioner entry points: {e}")
+
+        cls._plugins = {**found, **cls._plugins}
+        cls._discovery_ms = (time.perf_counter() - started) * 1000
+        cls._logger.info(
+            f"Discovered provisioners for {sorted(cls._plugins)}"
+            f" in {cls._discovery_ms:.1f} ms"
+        )
 
-            cls.register_provisioner("valheim", ValheimProvisioner)
+    @classmethod
+    def load_timings(cls) -> Dict[str, Any]:
+        """Discovery time and, per game, where it comes from and its load times in ms.
 
-        except ImportError as e:
-            cls._logger.error(f"Error loading provisioners: {e}")
+        Import and init times stay None until the game is first used.
+        """
+        return {
+            "discovery_ms": cls._discovery_ms,
+            "provisioners": {
+                game_name: {
+                    "source": plugin.source,
+                    "target": plugin.target,
+                    "import_ms": plugin.import_ms,
+                    "init_ms": plugin.init_ms,
+                }
+                for game_name, plugin in cls._plugins.items()
+            },
+        }
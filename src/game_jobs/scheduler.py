@@ -0,0 +1,256 @@
+"""
+Lease-based scheduling of recurring background jobs.
+
+Every worker process runs a `Scheduler` with the same jobs. A job runs once
+per interval across all of them: whichever process first finds it due
+takes its lease in one atomic step, which also moves the job's next run
+time forward by `interval`:
+
+    scheduler:lease:{job}  "{run token}:{owner}" while the job runs
+    scheduler:next:{job}   when the job is next due, in ms (Redis clock)
+    scheduler:fence:{job}  last run token handed out
+    scheduler:job:{job}    hash with the last run's owner, token and outcome
+
+The holder renews the lease while the job runs. If it dies, the lease
+expires and the next due run goes to another process. If a renewal fails,
+the run is cancelled, since another process may already have taken over.
+Run tokens increase with every run. Jobs that write pass their lease down
+and call `Lease.check_held` before each batch they commit or push, so a
+run that was paused past its lease usually stops with LeaseLost instead of
+writing alongside the run that took over. This is a best-effort check,
+not fencing: the token never reaches the writes, so a run paused between
+the check and its write can still write once after losing the lease.
+Such a late batch is largely idempotent: expiry batches are claimed,
+pending orders are handed out by a consumer group and command timeouts
+are decided atomically in Redis.
+"""
+
+import asyncio
+import logging
+import os
+import socket
+import time
+from dataclasses import dataclass
+from typing import Awaitable, Callable, Dict, Optional
+
+from db import db
+
+SCHEDULER_PREFIX = "scheduler:"
+
+# KEYS: lease, next run, fence; ARGV: owner, interval ms, lease ttl ms.
+# Takes the lease if the job is due and nobody holds it. Returns
+# {token, 0} on success, otherwise {0, ms until it is worth asking again}.
+_ACQUIRE_SCRIPT = """
+local held_ms = redis.call('PTTL', KEYS[1])
+if held_ms > 0 then
+    return {0, held_ms}
+end
+local now = redis.call('TIME')
+local now_ms = tonumber(now[1]) * 1000 + math.floor(tonumber(now[2]) / 1000)
+local next_ms = tonumber(redis.call('GET', KEYS[2]) or '0')
+if now_ms < next_ms then
+    return {0, next_ms - now_ms}
+end
+local token = redis.call('INCR', KEYS[3])
+redis.call('SET', KEYS[1], token .. ':' .. ARGV[1], 'PX', ARGV[3])
+redis.call('SET', KEYS[2], now_ms + tonumber(ARGV[2]))
+return {token, 0}
+"""
+
+# Extend the lease only if this run still holds it
+_RENEW_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('PEXPIRE', KEYS[1], ARGV[2])
+end
+return 0
+"""
+
+# Drop the lease only if this run still holds it
+_RELEASE_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+
+def _key(kind: str, name: str) -> str:
+    return f"{SCHEDULER_PREFIX}{kind}:{name}"
+
+
+class LeaseLost(Exception):
+    """Raised by `Lease.check_held` once the run no longer holds its lease."""
+
+
+@dataclass
+class Lease:
+    """A job run's claim on its job, identified by an increasing run token."""
+
+    job: str
+    token: int
+    owner: str
+
+    @property
+    def value(self) -> str:
+        return f"{self.token}:{self.owner}"
+
+    async def check_held(self) -> None:
+        """Raise LeaseLost unless this run still holds the lease.
+
+        Best effort: the lease can still be lost right after this returns.
+        """
+        redis_client = await db.get_redis_client()
+        if await redis_client.get(_key("lease", self.job)) != self.value:
+            raise LeaseLost(f"{self.job} lease {self.token} lost")
+
+
+JobFunc = Callable[[Lease], Awaitable[None]]
+
+
+@dataclass
+class ScheduledJob:
+    name: str
+    interval: float
+    func: JobFunc
+    lease_ttl: float
+
+
+class Scheduler:
+    """Runs each registered job once per interval across every process."""
+
+    def __init__(self, owner: Optional[str] = None, tick: float = 1.0) -> None:
+        self.logger = logging.getLogger("backendlogger")
+        self.owner = owner or f"{socket.gethostname()}:{os.getpid()}"
+        self.tick = tick
+        self.jobs: Dict[str, ScheduledJob] = {}
+        self._running: Dict[str, asyncio.Task] = {}
+        # Monotonic time before which a job is known not to be due
+        self._not_before: Dict[str, float] = {}
+
+    def add(
+        self,
+        name: str,
+        interval: float,
+        func: JobFunc,
+        lease_ttl: float = 30,
+    ) -> None:
+        """Register `func` to run every `interval` seconds.
+
+        The lease is renewed every `lease_ttl / 3` seconds while it runs;
+        if this process dies, another one takes over after `lease_ttl`.
+        """
+        self.jobs[name] = ScheduledJob(name, interval, func, lease_ttl)
+
+    async def run(self) -> None:
+        """Start due jobs forever; runs of different jobs overlap freely."""
+        try:
+            while True:
+                try:
+                    await self.run_pending()
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    self.logger.error(f"Scheduler tick failed: {e}")
+                await asyncio.sleep(self.tick)
+        finally:
+            for task in self._running.values():
+                task.cancel()
+            await asyncio.gather(*self._running.values(), return_exceptions=True)
+
+    async def run_pending(self) -> None:
+        """Try to start every job that is due and not already running here."""
+        redis_client = await db.get_redis_client()
+        for job in self.jobs.values():
+            if job.name in self._running:
+                continue
+            if time.monotonic() < self._not_before.get(job.name, 0):
+                continue
+            token, wait_ms = await redis_client.eval(
+                _ACQUIRE_SCRIPT,
+                3,
+                _key("lease", job.name),
+                _key("next", job.name),
+                _key("fence", job.name),
+                self.owner,
+                int(job.interval * 1000),
+                int(job.lease_ttl * 1000),
+            )
+            if not token:
+                self._not_before[job.name] = time.monotonic() + wait_ms / 1000
+            else:
+                lease = Lease(job.name, int(token), self.owner)
+                task = asyncio.create_task(self._run_job(job, lease))
+                self._running[job.name] = task
+                task.add_done_callback(
+                    lambda _, name=job.name: self._running.pop(name, None)
+                )
+
+    async def _run_job(self, job: ScheduledJob, lease: Lease) -> None:
+        """Run one job under its lease, renewing the lease until the job ends."""
+        redis_client = await db.get_redis_client()
+        lease_key = _key("lease", job.name)
+        started = time.time()
+        outcome = "ok"
+        work = asyncio.create_task(job.func(lease))
+        try:
+            while True:
+                await asyncio.wait({work}, timeout=job.lease_ttl / 3)
+                if work.done():
+                    break
+                try:
+                    renewed = await redis_client.eval(
+                        _RENEW_SCRIPT,
+                        1,
+                        lease_key,
+                        lease.value,
+                        int(job.lease_ttl * 1000),
+                    )
+                except Exception as e:
+                    self.logger.error(f"Unable to renew {job.name} lease: {e}")
+                    renewed = 0
+                if not renewed:
+                    work.cancel()
+                    outcome = "lease lost"
+                    self.logger.warning(
+                        f"Cancelled {job.name} run {lease.token}: lease lost"
+                    )
+                    break
+            await asyncio.gather(work, return_exceptions=True)
+            if not work.cancelled() and isinstance(work.exception(), LeaseLost):
+                outcome = "lease lost"
+                self.logger.warning(f"Stopped {job.name} run {lease.token}: lease lost")
+            elif not work.cancelled() and work.exception() is not None:
+                outcome = f"error: {work.exception()}"
+                self.logger.error(f"Job {job.name} failed: {work.exception()}")
+        finally:
+            if not work.done():
+                work.cancel()
+                await asyncio.gather(work, return_exceptions=True)
+                outcome = "cancelled"
+            try:
+                pipe = redis_client.pipeline(transaction=False)
+                pipe.eval(_RELEASE_SCRIPT, 1, lease_key, lease.value)
+                pipe.hset(
+                    _key("job", job.name),
+                    mapping={
+                        "owner": lease.owner,
+                        "token": lease.token,
+                        "started_at": started,
+                        "duration_s": round(time.time() - started, 3),
+                        "outcome": outcome,
+                    },
+                )
+                await asyncio.shield(pipe.execute())
+            except Exception as e:
+                self.logger.warning(f"Unable to release {job.name} lease: {e}")
+
+
+_scheduler: Optional[Scheduler] = None
+
+
+def get_scheduler() -> Scheduler:
+    """Process-wide scheduler; register jobs before `run` starts."""
+    global _scheduler
+    if _scheduler is None:
+        _scheduler = Scheduler()
+    return _scheduler
@@ -1,10 +1,11 @@
-import base64
 import json
 import os
 import secrets
 import sys
-from typing import Dict, Any
+from types import MappingProxyType
+from typing import Dict, Any, Mapping
 from db import db
+from db.agent_commands import Command
 
 import jsonschema
 
@@ -169,6 +170,29 @@ class ValheimProvisioner(AbstractProvisioner):
             },
             "required": ["name", "world"],
         }
+        # Checked and compiled once; the factory shares this instance
+        validator_class = jsonschema.validators.validator_for(self.schema)
+        validator_class.check_schema(self.schema)
+        self.validator = validator_class(
+            self.schema, format_checker=validator_class.FORMAT_CHECKER
+        )
+
+        # Built once and never mutated: requests copy the default config and
+        # overlay their values on the schema without writing to it
+        properties = self.schema["properties"]
+        self.object_properties = frozenset(
+            key for key, value in properties.items() if value["type"] == "object"
+        )
+        defaults: dict = {}
+        for key, value in properties.items():
+            if value["type"] != "object":
+                defaults[key] = value["default"]
+            else:
+                for k, v in value["properties"].items():
+                    defaults[f"{key}_{k}"] = v["default"]
+        self.default_config: Mapping[str, Any] = MappingProxyType(defaults)
+        if not self.validator.is_valid({**defaults, "password": "x"}):
+            self.logger.error("Valheim schema defaults do not validate")
 
     def parse_check_boxes(self, form_dict) -> Dict:
         check_box_keys = [
@@ -197,35 +221,28 @@ class ValheimProvisioner(AbstractProvisioner):
         if not await self.validate_config(config_values):
             return
 
-        queue = f"badger:pending:{game_server_ip}"
-
-        raw = json.dumps(config_values, separators=(",", ":"))
-        encoded = base64.b64encode(raw.encode("utf-8")).decode("ascii")
-        payload = (
-            f"python setup_server.py "
-            f"-u {subscription_id} "
-            f"-g {game_name} "
-            f"--cfg-json {encoded} "
-            f"updateConfig"
+        command = Command.new(
+            "updateConfig", subscription_id, game=game_name, config=config_values
         )
         self.redisClient = await db.get_redis_client()
-        await self.redisClient.lpush(queue, payload)
+        # Coalesced with a queued update rather than rate limited, so the
+        # agent always gets the saved config
+        pipe = self.redisClient.pipeline(transaction=False)
+        await (
+            await db.COMMAND_TRACKER.push(
+                self.redisClient, pipe, game_server_ip, [command]
+            )
+        ).execute()
 
     async def get_default_config(self) -> str:
-        """Get the default configuration for Valheim servers."""
-        properties: dict = {}
-        for key, value in self.schema["properties"].items():
-            if value["type"] != "object":
-                properties[key] = value["default"]
-            else:
-                for k, v in value["properties"].items():
-                    properties[f"{key}_{k}"] = v["default"]
-        properties["password"] = secrets.token_urlsafe(nbytes=4)
-
-        # Validate the default config
-        await self.validate_config(properties)
+        """Get the default configuration for Valheim servers.
 
-        return json.dumps(properties)
+        The defaults were validated once when the provisioner was built;
+        each server only gets its own password.
+        """
+        return json.dumps(
+            {**self.default_config, "password": secrets.token_urlsafe(nbytes=4)}
+        )
 
     def get_required_ports(self) -> list[int]:
         """Get the required ports for Valheim servers."""
@@ -235,24 +252,29 @@ class ValheimProvisioner(AbstractProvisioner):
 
     async def validate_config(self, config_values: dict) -> bool:
         """Validate the provided configuration against the Valheim schema."""
-        try:
-            jsonschema.validate(config_values, self.schema)
-            return True
-        except jsonschema.ValidationError as e:
-            self.logger.error("Json Validation for valheim config failed:", str(e))
+        error = jsonschema.exceptions.best_match(
+            self.validator.iter_errors(config_values)
+        )
+        if error is not None:
+            self.logger.error("Json Validation for valheim config failed: %s", error)
             return False
+        return True
 
     async def generate_config_view_schema(self, cfg: Dict[str, Any]) -> Dict[str, Any]:
-        schema_copy = self.schema.copy()
+        """The schema with the saved values filled in, copy-on-write.
+
+        Only the properties that get a value are copied; the rest, and the
+        shared schema itself, are left untouched.
+        """
+        properties = self.schema["properties"]
+        filled: Dict[str, Dict[str, Any]] = {}
         for key, value in cfg.items():
-            if key in schema_copy["properties"].keys():
-                if schema_copy["properties"][key]["type"] != "object":
-                    schema_copy["properties"][key]["value"] = value
-            else:
-                for k in schema_copy["properties"].keys():
-                    if schema_copy["properties"][k]["type"] == "object":
-                        r = key.lower().split("_")
-                        if len(r) > 1 and r[0] == k:
-                            schema_copy["properties"][k][r[1]] = value
+            if key in properties:
+                if properties[key]["type"] != "object":
+                    filled.setdefault(key, dict(properties[key]))["value"] = value
+                continue
+            r = key.lower().split("_")
+            if len(r) > 1 and r[0] in self.object_properties:
+                filled.setdefault(r[0], dict(properties[r[0]]))[r[1]] = value
 
-        return schema_copy
+        return {**self.schema, "properties": {**properties, **filled}}
@@ -1,4 +1,5 @@
-from dataclasses import dataclass
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Mapping, Optional, Tuple
 
 from pydantic import EmailStr
 
@@ -17,3 +18,159 @@ class RegisterUserData:
     password: str
     game_id: str
     plan_id: str
+
+
+@dataclass
+class ServerPlacement:
+    subscription_id: str
+    baremetal_id: str
+    ip_address: str
+    ram_gb: float
+    config: str
+
+
+@dataclass
+class PlacementCommit:
+    # Server rows inserted by the batch
+    servers: List[Any] = field(default_factory=list)
+    # Baremetal rows touched by the batch, keyed by id, after the commit
+    baremetals: Dict[str, Any] = field(default_factory=dict)
+
+
+@dataclass
+class ExpiredSubscriptions:
+    # Subscription rows marked expired by the batch
+    subscriptions: List[Any] = field(default_factory=list)
+    # Their servers, set to stopping: subscription_id, ip_address, game_name
+    servers: List[Any] = field(default_factory=list)
+    # Baremetal rows whose capacity the servers released
+    released: List[Any] = field(default_factory=list)
+
+
+@dataclass
+class FailedServers:
+    # Server rows marked failed
+    servers: List[Any] = field(default_factory=list)
+    # Baremetal rows whose capacity the servers released
+    released: List[Any] = field(default_factory=list)
+
+
+@dataclass(frozen=True)
+class ServerContext:
+    """A server with the subscription, plan and game it belongs to"""
+
+    server_id: str
+    subscription_id: str
+    user_id: str
+    status: str
+    ip_address: str
+    ports: Any
+    docker_container_id: str
+    config: Any
+    plan_id: str
+    ram_gb: float
+    cpu_cores: float
+    game_id: str
+    game_name: str
+    # None once the server's capacity was released
+    baremetal_id: Optional[str] = None
+
+    @classmethod
+    def from_record(cls, record: Mapping[str, Any]) -> "ServerContext":
+        ip_address = record.get("ip_address")
+        baremetal_id = record.get("baremetal_id")
+        return cls(
+            server_id=str(record.get("server_id")),
+            subscription_id=str(record.get("subscription_id")),
+            user_id=str(record.get("user_id")),
+            status=record.get("status") or "",
+            ip_address=str(ip_address) if ip_address is not None else "",
+            ports=record.get("ports"),
+            docker_container_id=record.get("docker_container_id") or "",
+            config=record.get("config"),
+            plan_id=str(record.get("plan_id")),
+            ram_gb=float(record.get("ram_gb") or 0),
+            cpu_cores=float(record.get("cpu_cores") or 0),
+            game_id=str(record.get("game_id")),
+            game_name=record.get("game_name") or "",
+            baremetal_id=str(baremetal_id) if baremetal_id is not None else None,
+        )
+
+
+@dataclass
+class QueryStats:
+    """Running totals for one named query"""
+
+    calls: int = 0
+    errors: int = 0
+    rows: int = 0
+    total_ms: float = 0.0
+    max_ms: float = 0.0
+
+    @property
+    def mean_ms(self) -> float:
+        return self.total_ms / self.calls if self.calls else 0.0
+
+
+@dataclass
+class PasswordHashStats:
+    """Running totals for the password hashing pool"""
+
+    calls: int = 0
+    # Calls refused because the pool was full
+    rejected: int = 0
+    wait_total_ms: float = 0.0
+    wait_max_ms: float = 0.0
+    hash_total_ms: float = 0.0
+    hash_max_ms: float = 0.0
+
+    def record(self, wait_ms: float, hash_ms: float) -> None:
+        self.calls += 1
+        self.wait_total_ms += wait_ms
+        self.wait_max_ms = max(self.wait_max_ms, wait_ms)
+        self.hash_total_ms += hash_ms
+        self.hash_max_ms = max(self.hash_max_ms, hash_ms)
+
+    @property
+    def wait_mean_ms(self) -> float:
+        return self.wait_total_ms / self.calls if self.calls else 0.0
+
+    @property
+    def hash_mean_ms(self) -> float:
+        return self.hash_total_ms / self.calls if self.calls else 0.0
+
+
+@dataclass
+class ServerReport:
+    """Database changes from an agent's server report.
+
+    None means the report leaves that value as it is.
+    """
+
+    subscription_id: str
+    status: Optional[str] = None
+    docker_container_id: Optional[str] = None
+    # JSON encoded
+    ports: Optional[str] = None
+    sftp: Optional[Tuple[Optional[str], Optional[str]]] = None
+    internal_status: Optional[str] = None
+    releases_capacity: bool = False
+
+    def merged_into(self, older: "ServerReport") -> "ServerReport":
+        """This report applied on top of an older one for the same subscription.
+
+        A newer status decides whether capacity is released, so a server
+        that failed and then came back running keeps its reservation.
+        """
+        releases_capacity = self.releases_capacity
+        if self.status is None:
+            releases_capacity = releases_capacity or older.releases_capacity
+        return ServerReport(
+            subscription_id=self.subscription_id,
+            status=self.status or older.status,
+            docker_container_id=self.docker_container_id or older.docker_container_id,
+            ports=self.ports or older.ports,
+            sftp=self.sftp or older.sftp,
+            internal_status=self.internal_status or older.internal_status,
+            releases_capacity=releases_capacity,
+        )
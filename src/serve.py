@@ -0,0 +1,48 @@
+"""
+Production entry point.
+
+Runs `server:app` under Hypercorn with several worker processes sharing
+one listening socket:
+
+    cd src && python serve.py
+
+Configured with environment variables:
+
+    BIND              address to listen on (127.0.0.1:8000)
+    WEB_CONCURRENCY   number of worker processes (CPU count)
+    GRACEFUL_TIMEOUT  seconds workers get to finish requests on shutdown (30)
+    KEEP_ALIVE        idle keep-alive timeout in seconds (5)
+
+Send SIGHUP to reload: the workers finish their requests, flush their
+buffers and exit, then fresh workers start on the same socket. SIGTERM or
+SIGINT shut down. Workers use uvloop when it is installed.
+
+Background jobs that must run once per deployment are not run per worker;
+`server.py` runs them in whichever worker holds the Redis leader lock.
+"""
+
+import importlib.util
+import os
+import sys
+
+from hypercorn.config import Config
+from hypercorn.run import run
+
+
+def build_config(application_path: str = "server:app") -> Config:
+    config = Config()
+    config.application_path = application_path
+    config.bind = [os.getenv("BIND", "127.0.0.1:8000")]
+    config.workers = int(os.getenv("WEB_CONCURRENCY", os.cpu_count() or 1))
+    config.worker_class = (
+        "uvloop" if importlib.util.find_spec("uvloop") is not None else "asyncio"
+    )
+    config.graceful_timeout = float(os.getenv("GRACEFUL_TIMEOUT", 30))
+    config.keep_alive_timeout = float(os.getenv("KEEP_ALIVE", 5))
+    config.accesslog = "-"
+    config.errorlog = "-"
+    return config
+
+
+if __name__ == "__main__":
+    sys.exit(run(build_config()))
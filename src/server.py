@@ -9,9 +9,15 @@ from quart import Quart
 from quart_auth import QuartAuth
 from quart_schema import QuartSchema
 from db import db
+from db.server_events import get_server_event_hub
 from game_jobs import mainProvisioner
+from game_jobs.leader import LeaderElection
+from game_jobs.scheduler import Lease, get_scheduler
+from game_jobs.pending_queue import PendingQueue
+from game_jobs.provisioner_factory import ProvisionerFactory
 
 from api_internal.api import apiblueprint
+from api_internal.report_buffer import get_report_buffer
 from api_user.userroutes import userblueprint
 from api_user.create_order import orderBlueprint
 from api_user.server_actions import serverActionsBlueprint
@@ -29,6 +35,11 @@ logging.basicConfig(
 )
 
 BACKENDLOGGER = logging.getLogger("backendlogger")
+PENDING_FALLBACK_SWEEP_SECONDS = float(os.getenv("PENDING_FALLBACK_SWEEP_SECONDS", 300))
+STALE_SERVER_SWEEP_SECONDS = float(os.getenv("STALE_SERVER_SWEEP_SECONDS", 300))
+EXPIRY_SWEEP_SECONDS = float(os.getenv("SUBSCRIPTION_EXPIRY_SWEEP_SECONDS", 60))
+EXPIRY_BACKFILL_SECONDS = float(os.getenv("SUBSCRIPTION_EXPIRY_BACKFILL_SECONDS", 3600))
+COMMAND_TIMEOUT_SWEEP_SECONDS = float(os.getenv("AGENT_COMMAND_SWEEP_SECONDS", 15))
 STATIC_FOLDER = os.path.join(str(Path(__file__).parent) + "/static")
 # globals
 app = Quart(__name__)
@@ -48,27 +59,101 @@ app.register_blueprint(paymentBluePrint)
 @app.before_serving
 async def connect() -> None:
     try:
+        # Find the game provisioners once; each is imported on first use
+        ProvisionerFactory.load_provisioners()
         redis_Client = await db.get_redis_client()
-        if await redis_Client.json().get("pending_servers", "$") is None:
-            await redis_Client.json().set("pending_servers", "$", [])
+        pending_queue = PendingQueue()
+        # Orders queued before the lanes existed join them once
+        await pending_queue.migrate_legacy()
+        await pending_queue.ensure_group()
         # await db.db_createalldbs()
         await redis_Client.ping()
-        # app.add_background_task(check_pending_servers)
+        # Singleton jobs run in whichever worker holds the leader lock
+        app.add_background_task(
+            LeaderElection("background_jobs").run,
+            {"pending_drain": check_pending_servers},
+        )
+        # Recurring jobs run once per interval across all workers
+        scheduler = get_scheduler()
+        scheduler.add(
+            "pending_sweep", PENDING_FALLBACK_SWEEP_SECONDS, sweep_pending_servers
+        )
+        scheduler.add("stale_servers", STALE_SERVER_SWEEP_SECONDS, sweep_stale_servers)
+        scheduler.add("subscription_expiry", EXPIRY_SWEEP_SECONDS, expire_subscriptions)
+        scheduler.add(
+            "expiry_backfill", EXPIRY_BACKFILL_SECONDS, backfill_expiry_schedule
+        )
+        scheduler.add(
+            "command_timeouts", COMMAND_TIMEOUT_SWEEP_SECONDS, time_out_commands
+        )
+        app.add_background_task(scheduler.run)
+        app.add_background_task(db.db_listen_catalog_invalidations)
+        app.add_background_task(get_report_buffer().run)
+        app.add_background_task(get_server_event_hub().run)
     except Exception as e:
         BACKENDLOGGER.warning("error in startup:", e)
         raise
 
 
+@app.after_serving
+async def disconnect() -> None:
+    # Write reports still waiting in the buffer before the process exits
+    await get_report_buffer().flush()
+    db.log_query_stats()
+    db.log_password_hash_stats()
+    BACKENDLOGGER.info(f"Provisioner load timings: {ProvisionerFactory.load_timings()}")
+    db.PASSWORD_HASHER.shutdown()
+
+
 async def check_pending_servers():
+    """Drain the pending queue whenever an order is enqueued or capacity frees up.
+
+    Wakeups come over Redis pub/sub; the scheduled `sweep_pending_servers`
+    covers notifications lost while the leader was disconnected.
+    """
     pv = mainProvisioner.MainProvisioner()
-    await pv.job_repeating_check_pending_servers()
-    while True:
-        await pv.job_repeating_check_pending_servers()
-        await asyncio.sleep(30)
+    await pv.job_drain_pending_servers()
+    async with pv.pending_queue.wakeups() as wait_for_wakeup:
+        while True:
+            try:
+                if await wait_for_wakeup(5):
+                    await pv.job_drain_pending_servers()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                BACKENDLOGGER.error(f"Pending queue drain failed: {e}")
+                await asyncio.sleep(1)
 
 
-app.run(
-    debug=False,
-    host="127.0.0.1",
-    port=8000,
-)
+async def sweep_pending_servers(lease: Lease) -> None:
+    await mainProvisioner.MainProvisioner().job_drain_pending_servers(lease)
+
+
+async def sweep_stale_servers(lease: Lease) -> None:
+    await mainProvisioner.MainProvisioner().job_sweep_stale_servers(lease)
+
+
+async def time_out_commands(lease: Lease) -> None:
+    await mainProvisioner.MainProvisioner().job_time_out_commands(lease)
+
+
+async def expire_subscriptions(lease: Lease) -> None:
+    await mainProvisioner.MainProvisioner().job_expire_subscriptions(lease)
+
+
+async def backfill_expiry_schedule(lease: Lease) -> None:
+    await lease.check_held()
+    count, err = await db.db_schedule_subscription_expiries()
+    if err:
+        BACKENDLOGGER.error(f"Unable to backfill the expiry schedule: {err}")
+    else:
+        BACKENDLOGGER.info(f"Expiry schedule backfilled with {count} subscriptions")
+
+
+if __name__ == "__main__":
+    # Single process for development; production runs serve.py
+    app.run(
+        debug=False,
+        host="127.0.0.1",
+        port=8000,
+    )
@@ -0,0 +1,39 @@
+"""
+Pending queue: reclaiming orders left by consumers that stopped. Run from src:
+
+    python -m unittest discover tests
+"""
+
+import os
+import unittest
+from unittest import mock
+
+os.environ.setdefault("DATABASE_URL", "postgresql://localhost/test")
+
+from db import db
+from game_jobs.pending_queue import PendingQueue
+
+
+class PendingQueueReclaimTest(unittest.IsolatedAsyncioTestCase):
+    async def reclaim(self, results) -> int:
+        pipe = mock.Mock()
+        pipe.execute = mock.AsyncMock(return_value=results)
+        redis_client = mock.Mock()
+        redis_client.pipeline.return_value = pipe
+        with mock.patch.object(
+            db, "get_redis_client", mock.AsyncMock(return_value=redis_client)
+        ):
+            lanes = [f"pending_servers:lane:{i}" for i in range(len(results))]
+            return await PendingQueue(consumer_name="c1").reclaim(lanes)
+
+    async def test_counts_claimed_ids(self):
+        # XAUTOCLAIM with JUSTID is parsed into a flat list of ids
+        self.assertEqual(await self.reclaim([["1700000000000-0"]]), 1)
+        self.assertEqual(
+            await self.reclaim([["1700000000000-0", "1700000000001-0"], []]), 2
+        )
+        self.assertEqual(await self.reclaim([[], []]), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
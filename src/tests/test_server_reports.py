@@ -0,0 +1,115 @@
+"""
+Server reports: validation at the endpoint, merging in the buffer and
+isolating reports the database rejects. Run from src:
+
+    python -m unittest discover tests
+"""
+
+import os
+import unittest
+import uuid
+from typing import List
+from unittest import mock
+
+os.environ.setdefault("DATABASE_URL", "postgresql://localhost/test")
+
+from quart import Quart
+
+import helper_classes.custom_dataclass as cdata
+from api_internal import api, report_buffer
+from db import db
+
+
+def start_report(subscription_id: str, status: str = "running") -> dict:
+    return {
+        "action": "start",
+        "subscription_id": subscription_id,
+        "status": status,
+        "container_id": "c0ffee",
+        "ports": {"game": 2456},
+    }
+
+
+class ServerReportMergeTest(unittest.TestCase):
+    def test_newer_status_decides_capacity_release(self):
+        subscription_id = str(uuid.uuid4())
+        failed = cdata.ServerReport(subscription_id, status="failed")
+        release = cdata.ServerReport(subscription_id, releases_capacity=True)
+        running = cdata.ServerReport(subscription_id, status="running")
+
+        merged = running.merged_into(release.merged_into(failed))
+        self.assertEqual(merged.status, "running")
+        self.assertFalse(merged.releases_capacity)
+
+        merged = release.merged_into(failed.merged_into(running))
+        self.assertEqual(merged.status, "failed")
+        self.assertTrue(merged.releases_capacity)
+
+
+class ServerReportBatchTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.buffer = report_buffer.ReportBuffer(max_attempts=2)
+        patcher = mock.patch.object(api, "get_report_buffer", return_value=self.buffer)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        app = Quart(__name__)
+        app.register_blueprint(api.apiblueprint)
+        self.client = app.test_client()
+
+    async def test_bad_report_in_good_batch_is_rejected(self):
+        good = [str(uuid.uuid4()), str(uuid.uuid4())]
+        response = await self.client.post(
+            "/api/server_reports",
+            json=[
+                start_report(good[0]),
+                start_report(str(uuid.uuid4()), status="restart"),
+                start_report("not-a-uuid"),
+                start_report(good[1], status="stopped"),
+            ],
+        )
+        self.assertEqual(response.status_code, 200)
+        codes = [result["code"] for result in (await response.get_json())["results"]]
+        self.assertEqual(codes, [200, 400, 400, 200])
+        self.assertEqual(sorted(self.buffer._pending), sorted(good))
+
+    async def test_rejected_report_does_not_block_the_batch(self):
+        good = [str(uuid.uuid4()) for _ in range(5)]
+        bad = str(uuid.uuid4())
+        written: List[str] = []
+
+        async def apply(reports):
+            if any(report.subscription_id == bad for report in reports):
+                return [], "Database error: invalid input value for enum"
+            written.extend(report.subscription_id for report in reports)
+            return [], None
+
+        with (
+            mock.patch.object(db, "db_apply_server_reports", side_effect=apply),
+            mock.patch.object(db, "db_ping", return_value=(True, None)),
+            mock.patch.object(db, "get_redis_client", side_effect=ConnectionError),
+        ):
+            for subscription_id in good[:3] + [bad] + good[3:]:
+                self.buffer.add(cdata.ServerReport(subscription_id, status="running"))
+            self.assertEqual(await self.buffer.flush(), len(good))
+            self.assertEqual(sorted(written), sorted(good))
+            # Retried once more, then dead-lettered
+            self.assertEqual(list(self.buffer._pending), [bad])
+            self.assertEqual(await self.buffer.flush(), 0)
+            self.assertEqual(len(self.buffer), 0)
+
+    async def test_unreachable_database_keeps_reports(self):
+        subscription_id = str(uuid.uuid4())
+        with (
+            mock.patch.object(
+                db, "db_apply_server_reports", return_value=([], "Database error")
+            ),
+            mock.patch.object(db, "db_ping", return_value=(False, "Database error")),
+        ):
+            for _ in range(3):
+                self.buffer.add(cdata.ServerReport(subscription_id, status="running"))
+                self.assertEqual(await self.buffer.flush(), 0)
+        self.assertEqual(list(self.buffer._pending), [subscription_id])
+
+
+if __name__ == "__main__":
+    unittest.main()